@@ -1,22 +1,111 @@
+import binascii
+import json
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
 
+class WifiCache:
+    """ last successful association (bssid, channel, dhcp lease and time it was leased)
+    persisted on flash """
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def load(self):
+        try:
+            with open(self.filename, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, data):
+        with open(self.filename, "w") as f:
+            json.dump(data, f)
+
+    def clear(self):
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
+
+
 class ConnProvider:
-    def __init__(self, *, config, wlan, stdlib, blinker):
+    def __init__(self, *, config, wlan, stdlib, blinker, cache=None):
         self.config = config
         self.wlan = wlan
         self.stdlib = stdlib
         self.blinker = blinker
+        self.cache = cache
+        # real time clock starts over on power on - age of lease taken before is not known,
+        # until a lease is taken in this boot
+        self._clock_kept = bool(cache) and stdlib.rtc_kept()
 
-    async def init_client(self):
+    async def init_client(self, blink=True):
         logger.info("init client")
         conf = self.config.WIFI['client']
         wi = self.wlan
         stdlib = self.stdlib
 
+        started = stdlib.ticks_ms()
+        phases = []
+
+        def phase(name):
+            phases.append("%s=%s" % (name, stdlib.ticks_diff(stdlib.ticks_ms(), started)))
+
         wi.active(True)
+        phase("active")
+
+        lease = self.cache.load() if self.cache else None
+        if lease and not lease.get("bssid"):
+            lease = None  # access point is not known yet, see _save_lease()
+        mode = "cold"
+        if lease:
+            mode = "warm" if self._lease_valid(lease) else "renew"
+            if not await self._fast_connect(conf, lease, dhcp=mode == "renew"):
+                phase("fast_failed")
+                lease = None
+                mode = "cold"
+        if mode == "cold":
+            await self._connect(conf)
+        phase("connected")
+
+        logger.info("client connected. ifconfig is cli=%s", wi.ifconfig())
+
+        if self.cache and mode != "warm":
+            self._save_lease(lease["bssid"] if lease else None)
+            self._clock_kept = True
+            phase("saved")
+
+        logger.info("%s wifi connect, phases (ms from start): %s", mode, " ".join(phases))
+
+        if blink:
+            self.blinker.show("connected")
+
+        return wi
+
+    def suspend(self):
+        """ turn wifi off (before sleep), init_client() brings it back - fast, if cache is used """
+        logger.info("suspending wifi")
+        if self.cache:
+            self._find_bssid()
+        self.wlan.disconnect()
+        self.wlan.active(False)
+
+    def _lease_valid(self, lease) -> bool:
+        """ dhcp lease may still be set statically. Lease of unknown age (clock started over
+        on power on since) is not """
+        if not self._clock_kept:
+            return False
+        age = self.stdlib.time() - lease.get("leased_at", 0)
+        return 0 <= age < self.config.WIFI_LEASE_TIME
+
+    async def _connect(self, conf):
+        """ full (cold) connect """
+        wi = self.wlan
+        stdlib = self.stdlib
+
         logger.debug("sleep 1 sec after active(True)")
         await stdlib.sleep(1)
         # logger.debug("wi.scan()")
@@ -25,6 +114,7 @@ class ConnProvider:
         wi.config(dhcp_hostname=conf["dhcp"])
         wi.connect(conf["ssid"], conf["pass"])
         logger.debug("asked to connect to ssid/pass")
+        self.blinker.show("connecting")
 
         if conf.get("ip", None):
             logger.info("manually set ip/dns to %s/%s", conf["ip"], conf["dns"])
@@ -33,11 +123,74 @@ class ConnProvider:
             logger.info("ifconfig set")
 
         while not wi.isconnected():
-            await self.blinker.blink(0.2, 0.05)
+            await stdlib.sleep(0.2)
             logger.debug("cli is not connected yet, sleeping")
 
-        logger.info("client connected. ifconfig is cli=%s", wi.ifconfig())
+    async def _fast_connect(self, conf, lease, dhcp=False) -> bool:
+        """ connect straight to the last known access point, with the last dhcp lease set
+        statically (no dhcp round trip) - or with `dhcp`, when the lease is too old. Returns
+        False if it did not succeed in time. """
+        wi = self.wlan
+        logger.info("fast connect to bssid=%s (channel %s), lease %s", lease["bssid"], lease["channel"],
+                    "renewed by dhcp" if dhcp else lease["ifconfig"])
 
-        await self.blinker.blink(2, 0.5)
+        wi.config(dhcp_hostname=conf["dhcp"])
+        try:
+            wi.config(channel=lease["channel"])  # no scan of the other channels
+        except (OSError, ValueError) as e:
+            logger.debug("channel not set: %r", e)
+        wi.ifconfig("dhcp" if dhcp else tuple(lease["ifconfig"]))
+        try:
+            wi.connect(conf["ssid"], conf["pass"], bssid=binascii.unhexlify(lease["bssid"]))
+        except (OSError, ValueError, TypeError) as e:
+            logger.info("fast connect refused: %r", e)
+            self.cache.clear()
+            return False
 
-        return wi
+        self.blinker.show("connecting")
+        waited = 0.0
+        while not wi.isconnected():
+            if waited >= self.config.WIFI_FAST_CONNECT_TIMEOUT:
+                logger.info("fast connect timed out, falling back to full connect")
+                self.cache.clear()
+                wi.disconnect()
+                wi.ifconfig("dhcp")
+                return False
+            await self.stdlib.sleep(0.2)
+            waited += 0.2
+
+        return True
+
+    def _save_lease(self, bssid):
+        """ remember lease (just taken by dhcp), access point and channel of current
+        connection. `bssid` is the one it was told to connect to, if any, otherwise wifi
+        tells the one it connected to. Firmware which cannot tell, has it found before the
+        next sleep, off the path of the press """
+        wi = self.wlan
+        if bssid is None:
+            try:
+                bssid = binascii.hexlify(wi.config("bssid")).decode()
+            except (OSError, ValueError, TypeError) as e:
+                logger.debug("bssid not known: %r", e)
+        self.cache.save({"bssid": bssid,
+                         "channel": wi.config("channel"),
+                         "ifconfig": list(wi.ifconfig()),
+                         "leased_at": self.stdlib.time()})
+
+    def _find_bssid(self):
+        """ add bssid of the access point to saved lease, which has none """
+        lease = self.cache.load()
+        if not lease or lease.get("bssid"):
+            return
+
+        conf = self.config.WIFI['client']
+        try:
+            # strongest access point of our network on our channel is the one we are connected to
+            aps = [ap for ap in self.wlan.scan() if ap[0] == conf["ssid"].encode() and ap[2] == lease["channel"]]
+        except OSError as e:
+            logger.info("could not scan for bssid: %r", e)
+            return
+
+        if aps:
+            lease["bssid"] = binascii.hexlify(max(aps, key=lambda ap: ap[3])[1]).decode()
+            self.cache.save(lease)
@@ -0,0 +1,169 @@
+import json
+import logging
+import socket
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio  # type: ignore
+
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectError(OSError):
+    """ connection could not be opened - request has certainly not been sent """
+
+
+def split_url(url: str):
+    """ "http://host:port/path" -> (host, port, path) """
+    if not url.startswith("http://"):
+        raise ValueError("only http:// urls are supported, got %s" % url)
+
+    hostport, _, path = url[len("http://"):].partition("/")
+    host, _, port = hostport.partition(":")
+    return host, int(port) if port else 80, "/" + path
+
+
+class KeepAliveClient:
+    """ HTTP/1.1 client keeping one connection open to one host. Address of the host is
+    resolved once and cached. Connection is (re)opened when needed. Connection idle for
+    `keepalive` seconds (by `clock`, with ticks_ms, ticks_us and ticks_diff) is not used any
+    more - keep it below the server's keep-alive timeout, so the server does not close it
+    under a request. Request is sent once more over a new connection only if it has certainly not
+    reached the server: its write failed on kept-alive connection. Request which failed
+    after it was written, or timed out, may have been handled already - it is not repeated,
+    the error (not ConnectError) goes to the caller. """
+
+    def __init__(self, host: str, port: int, *, timeout: float, keepalive=None, clock=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.keepalive = keepalive
+        self.clock = clock
+
+        self._ip = None
+        self._reader = None
+        self._writer = None
+        self._used = 0  # ticks_ms when the connection was last used
+        self.connect_span = None  # (start, end) ticks_us of connecting for the last request, if it did
+        self._written = False  # current request (or part of it) went to the server
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None
+
+    def _resolve(self):
+        if self._ip is None:
+            self._ip = socket.getaddrinfo(self.host, self.port)[0][-1][0]
+            logger.info("%s resolved to %s", self.host, self._ip)
+        return self._ip
+
+    async def _connect(self):
+        start = self.clock.ticks_us() if self.clock else 0
+        try:
+            self._reader, self._writer = await asyncio.open_connection(self._resolve(), self.port)
+        except OSError as e:
+            self._ip = None  # address may have changed, resolve it again next time
+            raise ConnectError(*e.args)
+        finally:
+            if self.clock:
+                self.connect_span = (start, self.clock.ticks_us())
+
+    async def close(self):
+        writer = self._writer
+        self._reader = self._writer = None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def post_json(self, path: str, data, headers=None):
+        """ POST data as json, return (status, body) """
+        body = json.dumps(data).encode()
+        extra = "".join("%s: %s\r\n" % item for item in (headers or {}).items())
+        request = ("POST %s HTTP/1.1\r\nHost: %s\r\nContent-Type: application/json\r\n"
+                   "Content-Length: %s\r\n%s\r\n" % (path, self.host, len(body), extra)).encode()
+        return await self.request(request + body)
+
+    async def request(self, request: bytes):
+        """ send raw request, return (status, body) of the response. Raises ConnectError if
+        the request has not been sent """
+        self._written = False
+        self.connect_span = None
+        try:
+            return await asyncio.wait_for(self._request(request), self.timeout)
+        except asyncio.TimeoutError:
+            await self.close()
+            if self._written:
+                raise
+            self._ip = None
+            raise ConnectError("timed out connecting to %s" % self.host)
+        except BaseException:
+            await self.close()
+            raise
+
+    def _idle(self) -> bool:
+        return (self.clock is not None and self.keepalive is not None
+                and self.clock.ticks_diff(self.clock.ticks_ms(), self._used) >= self.keepalive * 1000)
+
+    async def _request(self, request: bytes):
+        if self.connected and self._idle():
+            logger.debug("kept-alive connection is idle for too long, reconnecting")
+            await self.close()
+
+        reused = self.connected
+        if not reused:
+            await self._connect()
+
+        try:
+            await self._write(self._writer, request)
+        except OSError as e:
+            await self.close()
+            if not reused:
+                raise
+            logger.debug("kept-alive connection is gone (%r), reconnecting", e)
+            self._written = False
+            await self._connect()
+            await self._write(self._writer, request)
+
+        return await self._read_response(self._reader)
+
+    async def _write(self, writer, request: bytes):
+        self._written = True
+        writer.write(request)
+        await writer.drain()
+
+    async def _read_response(self, reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise EOFError("connection closed by server")
+
+        status = int(status_line.split()[1])
+        length = None
+        close = False
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode().partition(":")
+            name = name.strip().lower()
+            if name == "content-length":
+                length = int(value)
+            elif name == "connection":
+                close = value.strip().lower() == "close"
+
+        if length is None:
+            body = await reader.read(-1)
+            close = True
+        else:
+            body = await reader.readexactly(length)
+
+        if close:
+            await self.close()
+        elif self.clock is not None:
+            self._used = self.clock.ticks_ms()
+
+        return status, body
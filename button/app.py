@@ -1,4 +1,7 @@
 import logging
+
+import tracing
+
 try:
     import uasyncio as asyncio
 except ImportError:
@@ -8,28 +11,117 @@ except ImportError:
 logger = logging.getLogger(__name__)
 
 
+class _EventFlag:
+    """ ThreadSafeFlag for asyncio without it (CPython, older uasyncio). Good enough, when
+    irq handlers run in the thread of event loop """
+    def __init__(self):
+        self._event = asyncio.Event()
+
+    def set(self):
+        self._event.set()
+
+    def clear(self):
+        self._event.clear()
+
+    async def wait(self):
+        await self._event.wait()
+        self._event.clear()
+
+
+ThreadSafeFlag = getattr(asyncio, "ThreadSafeFlag", _EventFlag)
+
+
 class App:
-    def __init__(self, *, config, stdlib, dispenser_client):
+    def __init__(self, *, config, stdlib, dispenser_client, conn=None, tracer=None):
         self.config = config
         self.stdlib = stdlib
         self.dispenser_client = dispenser_client
+        self.conn = conn
+        self.tracer = tracer
+        self.last_latency_ms = None  # from press (or wake) to sending treat
+
+        self.debounce_ms = config.BUTTON_DEBOUNCE_MS
+        self.pressed_at = 0  # ticks_ms of the last press, taken in irq handler
+        self.pressed_us = 0  # ... and its ticks_us, for tracer
+        self.woken_us = 0  # ticks_us of the last wake up, 0 is boot (wake from deep sleep)
+        self._last_edge = None
+        self._pressed = ThreadSafeFlag()
 
         self.button = stdlib.pin(config.BUTTON_PIN, "in")
+        self.button.irq(handler=self._on_edge, trigger=self.button.IRQ_FALLING | self.button.IRQ_RISING)
 
-    async def run(self):
-        """ main loop of app """
-        while True:
-            await self.wait_until_pressed()
-            logger.debug("button is pressed")
-            await self.dispenser_client.treat()
-            logger.debug("sent (or not) treat")
+    def _on_edge(self, pin):
+        """ irq handler. Press is a falling edge after at least debounce_ms of no edges,
+        so bouncing contacts (of both press and release) do not make more presses """
+        now = self.stdlib.ticks_ms()
+        last, self._last_edge = self._last_edge, now
+        if last is not None and self.stdlib.ticks_diff(now, last) < self.debounce_ms:
+            return
+        if pin.value() == 0:
+            self.pressed_at = now
+            if self.tracer:
+                self.pressed_us = self.stdlib.ticks_us()
+            self._pressed.set()
 
-    async def wait_until_pressed(self):
-        old_state = self.button.value()
+    async def run(self, woken_at=None):
+        """ main loop of app. woken_at is ticks_ms of wake up by press from deep sleep """
+        if woken_at is not None:
+            await self.treat(woken_at, "wake")
 
+        idle = self.config.SLEEP_IDLE if self.conn else None
         while True:
-            await asyncio.sleep(0.05)
-            new_state = self.button.value()
-            if new_state == 0 and old_state == 1:
-                return
-            old_state = new_state
+            pressed_at = await self.wait_until_pressed(timeout=idle)
+            if pressed_at is None:
+                if self._outbox_pending():
+                    logger.debug("presses wait in outbox, staying awake")
+                    continue
+                await self.treat(await self.sleep(), "wake")
+            else:
+                await self.treat(pressed_at, "press")
+
+    def _outbox_pending(self) -> bool:
+        """ True while presses wait in outbox (if dispenser_client is one). Sleep would stop
+        their retries, and the one being sent is dropped on boot after deep sleep """
+        return bool(getattr(self.dispenser_client, "entries", None))
+
+    async def treat(self, since: int, event: str):
+        """ send treat for press (or wake up by press), which happened at ticks_ms `since`.
+        With tracer, the treat is traced from the press (span named by `event`) on """
+        self.last_latency_ms = self.stdlib.ticks_diff(self.stdlib.ticks_ms(), since)
+        logger.info("sending treat %s ms after %s", self.last_latency_ms, event)
+        trace = None
+        if self.tracer:
+            trace = tracing.new_trace_id()
+            self.tracer.span(trace, event, self.pressed_us if event == "press" else self.woken_us)
+        await self.dispenser_client.treat(trace=trace)
+        logger.debug("sent (or not) treat")
+
+    async def wait_until_pressed(self, timeout=None):
+        """ wait for next press, return its ticks_ms (or None, if there was no press in
+        `timeout` seconds) """
+        if timeout is None:
+            await self._pressed.wait()
+        else:
+            try:
+                await asyncio.wait_for(self._pressed.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        return self.pressed_at
+
+    async def sleep(self) -> int:
+        """ sleep until the button is pressed, with wifi off. Return ticks_ms of the wake
+        up, after wifi is back. Deep sleep never returns, board boots again on wake up """
+        deep = self.config.SLEEP_MODE == "deep"
+        logger.info("no press for %s s, going to %s sleep", self.config.SLEEP_IDLE, self.config.SLEEP_MODE)
+        self.conn.suspend()
+
+        self.stdlib.sleep_until_pressed(self.button, deep=deep)
+
+        woken_at = self.stdlib.ticks_ms()
+        if self.tracer:
+            self.woken_us = self.stdlib.ticks_us()
+        # edge of the press which woke us up is not a new press
+        self._last_edge = woken_at
+        self._pressed.clear()
+        await self.conn.init_client(blink=False)
+        return woken_at
@@ -1,10 +1,68 @@
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio  # type: ignore
+
+
 class Blinker:
     FAST_DELAY = 0.125
     SLOW_DELAY = 0.25
 
+    # name -> (seconds on, seconds off, number of blinks - None is until other pattern comes)
+    PATTERNS = {"connecting": (0.05, 0.05, None),
+                "connected": (0.5, 0.5, 2),
+                "in-flight": (0.05, 0.05, None),
+                "ok": (0.1, 0.1, 3),
+                "error": (0.03, 0.03, 10)}
+
     def __init__(self, *, config, stdlib):
         self.config = config
         self.stdlib = stdlib
+        self.led = stdlib.pin(config.BLINK_LED_PIN, direction="out")
+
+        self.playing = None  # name of pattern being played
+        self._pending = None
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def show(self, name):
+        """ play pattern `name` in background task, instead of the one being played now.
+        Returns immediately """
+        self._pending = name
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        self._wake.set()
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+
+            while self._pending:
+                self.playing, self._pending = self._pending, None
+                on, off, count = self.PATTERNS[self.playing]
+                if count is None and self._start_periodic(on, off):
+                    break  # blinks on its own until other pattern comes
+
+                i = 0
+                while count is None or i < count:
+                    self._set(1)
+                    await asyncio.sleep(on)
+                    self._set(0)
+                    if self._pending:
+                        break
+                    await asyncio.sleep(off)
+                    if self._pending:
+                        break
+                    i += 1
+                self.playing = None
+
+    def _set(self, level):
+        self.led.value(level)
+
+    def _start_periodic(self, on, off) -> bool:
+        """ start blinking with no help of cpu, if it can be done """
+        return False
 
     async def blink_fast(self, time):
         await self.blink(time=time, delay=self.FAST_DELAY)
@@ -13,11 +71,33 @@ class Blinker:
         await self.blink(time=time, delay=self.SLOW_DELAY)
 
     async def blink(self, time, delay):
-        pin_number = self.config.BLINK_LED_PIN
-        pin = self.stdlib.pin(pin_number, direction="out")
-
+        """ blink for `time` seconds, returns when done """
         for i in range(int(time / (delay * 2))):
             await self.stdlib.sleep(delay)
-            pin.value(1)
+            self._set(1)
             await self.stdlib.sleep(delay)
-            pin.value(0)
+            self._set(0)
+
+
+class PWMBlinker(Blinker):
+    """ blinks endless patterns by PWM of the led pin (at frequency of the pattern), so
+    they take no cpu time. One-shot patterns are played by switching duty between full
+    and zero """
+    MAX_DUTY = 1023
+    MIN_FREQ = 1  # esp32 can not go lower
+
+    def __init__(self, *, config, stdlib):
+        super().__init__(config=config, stdlib=stdlib)
+        self.pwm = stdlib.pwm(config.BLINK_LED_PIN)
+
+    def _set(self, level):
+        self.pwm.duty(self.MAX_DUTY if level else 0)
+
+    def _start_periodic(self, on, off) -> bool:
+        freq = int(1 / (on + off) + 0.5)
+        if freq < self.MIN_FREQ:
+            return False
+
+        self.pwm.freq(freq)
+        self.pwm.duty(int(self.MAX_DUTY * on / (on + off)))
+        return True
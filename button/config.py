@@ -1,14 +1,84 @@
 BLINK_LED_PIN = 22
+# endless blinking (while connecting, while waiting for dispenser) is done by PWM of the
+# led pin, instead of waking the cpu up every half period
+BLINK_PWM = True
 BUTTON_PIN = 15
+# edges of button pin closer to each other than this (ms) are bouncing of contacts
+BUTTON_DEBOUNCE_MS = 30
 
 # TREAT_URL = "http://ustat.home:5060/foo/"
 # TREAT_URL = "http://192.168.1.118:5060/foo/"
 TREAT_URL = "http://treatme.home:2477/treat"
 PORTION_IDX = 1
+# after SLEEP_IDLE seconds with no press, button turns wifi off and sleeps until it is
+# pressed (that press is sent as treat, after wifi is back). SLEEP_MODE is "light" (wifi
+# comes back sooner) or "deep" (board boots again, less power). SLEEP_IDLE = None turns
+# sleeping off
+SLEEP_IDLE = 300
+SLEEP_MODE = "light"
+
+# seconds for the whole treat request (connecting included)
+HTTP_TIMEOUT = 5
+
+# kept-alive connection idle for this many seconds is not used again, keep it below
+# HTTP_KEEPALIVE_TIMEOUT of the dispenser (connection closed by it under a request leaves
+# the request neither dispensed for sure, nor safe to repeat)
+HTTP_KEEPALIVE = 4
+
+# presses wait in this file until dispenser takes them (None - press is sent once, and is
+# lost when that fails). Presses coming while one is being sent are joined into one request
+# of up to OUTBOX_MAX_COUNT portions (at most MAX_TREAT_COUNT of dispenser), at most
+# OUTBOX_CAPACITY requests wait. Failed request is repeated after OUTBOX_BACKOFF seconds,
+# the wait doubles with every failure up to OUTBOX_MAX_BACKOFF
+OUTBOX_FILE = "outbox.txt"
+OUTBOX_CAPACITY = 8
+OUTBOX_MAX_COUNT = 5
+OUTBOX_BACKOFF = 1
+OUTBOX_MAX_BACKOFF = 60
+
+# treats go as UDP datagrams to this port of TREAT_URL's host, set to None to use HTTP.
+# Datagram not acked in UDP_ACK_TIMEOUT seconds is sent again, up to UDP_RETRIES times,
+# waiting twice as long after every retry
+TREAT_UDP_PORT = 2478
+UDP_ACK_TIMEOUT = 0.05
+UDP_RETRIES = 5
+UDP_POLL_INTERVAL = 0.005
+
+# last access point and dhcp lease are stored here, so the next boot can connect without
+# searching for access point and asking dhcp server. Set to None to always connect cold
+WIFI_CACHE_FILE = "wifi.json"
+# seconds to wait for the fast connect before falling back to the full one
+WIFI_FAST_CONNECT_TIMEOUT = 3
+# dhcp lease is set statically for this many seconds after it was taken, then it is asked
+# for again. Keep it below half of the lease time of the dhcp server (when it renews leases)
+WIFI_LEASE_TIME = 3600
 
 LOGGING = {'id': 'button1',
            # 'rsyslog_host': 'ustat.home'
-           'rsyslog_host': '192.168.1.118'
+           'rsyslog_host': '192.168.1.118',
+           # log.log is written once this many bytes are buffered, this many seconds after
+           # the first buffered record, or right away for an error
+           'buffer_size': 1024,
+           'flush_interval': 5,
+           # log.log is one file of this size, the newest records overwriting the oldest.
+           # Set to 0 for log.log, log.log.1, ... rotated by renames
+           'ring_size': 64 * 1024,
+           # records waiting to be sent to rsyslog (the oldest are dropped when more come),
+           # and the most bytes sent in one datagram
+           'queue_size': 64,
+           'datagram_size': 1400,
+           # the same message of a logger is logged at most once in this many seconds, and
+           # every logger logs at most `rate` records per second, with bursts of `burst`
+           'repeat_interval': 10,
+           'rate': 5,
+           'burst': 20,
+           # production profile: INFO and up is logged, debug() calls do nothing (not even
+           # level check). `doit strip_debug=1 ...` removes them from sources sent to board
+           'production': False,
            }
 
+# log spans of every press (from the press to the answer of dispenser) as TRACE records,
+# utils/trace-report.py puts them together with spans of the dispenser
+TRACE = True
+
 from config_local import *  # noqa
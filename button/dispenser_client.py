@@ -1,58 +1,204 @@
-import uasyncio
 import logging
-import _thread
+import random
+import socket
+import struct
 
-import urequests as requests
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio  # type: ignore
+
+import ahttp
+import tracing
 
 
 logger = logging.getLogger(__name__)
 
+# UDP fast path, see TreatDatagramServer of the dispenser
+UDP_TREAT = "!2sIbB"
+UDP_ACK = "!2sIB"
+UDP_TRACE = "!I"  # trace id, may follow UDP_TREAT
+UDP_OK = 0
+UDP_BUSY = 1
+UDP_STATUSES = {0: "ok", 1: "busy", 2: "bad request"}
+
+
+class RetryLater(Exception):
+    """ treat has not been dispensed, or it is not known, but sending the same request
+    again can not dispense it twice """
+
+
+class DatagramSender:
+    """ sends treat request as one datagram and waits for ack. Not acked request is sent
+    again with doubled waiting time, dispenser recognizes retransmits by sequence number. """
+
+    def __init__(self, host: str, port: int, *, ack_timeout: float, retries: int, poll_interval: float):
+        self.host = host
+        self.port = port
+        self.ack_timeout = ack_timeout
+        self.retries = retries
+        self.poll_interval = poll_interval
+
+        self.seq = 0  # sequence number of request waiting for ack
+        self._addr = None
+        self._sock = None
+        self._ack_size = struct.calcsize(UDP_ACK)
+
+    def _socket(self):
+        if self._sock is None:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._sock.setblocking(False)
+        return self._sock
+
+    def _resolve(self):
+        if self._addr is None:
+            self._addr = socket.getaddrinfo(self.host, self.port)[0][-1]
+        return self._addr
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    async def treat(self, portion: int, count: int, seq: int, trace=None) -> int:
+        """ request `count` portions, return status from dispenser's ack. Raises OSError if
+        no ack came. Request sent again with the same seq is taken for a retransmit """
+        self.seq = seq
+        request = struct.pack(UDP_TREAT, b"TQ", seq, portion, count)
+        if trace:
+            request += struct.pack(UDP_TRACE, int(trace, 16))
+        sock = self._socket()
+
+        timeout = self.ack_timeout
+        for attempt in range(self.retries + 1):
+            try:
+                sock.sendto(request, self._resolve())
+            except OSError:
+                self._addr = None
+                raise
+
+            waited = 0.0
+            while True:
+                status = self._receive_ack()
+                if status is not None:
+                    logger.debug("treat #%s acked after %s sends", self.seq, attempt + 1)
+                    return status
+                if waited >= timeout:
+                    break
+                await asyncio.sleep(self.poll_interval)
+                waited += self.poll_interval
+
+            timeout *= 2
+
+        raise OSError("treat #%s not acked" % self.seq)
+
+    def _receive_ack(self):
+        """ status from ack of current request, None if it has not come (yet). Acks of earlier
+        requests are thrown away """
+        while True:
+            try:
+                data = self._sock.recv(16)
+            except OSError:
+                return None
+
+            if len(data) == self._ack_size:
+                magic, seq, status = struct.unpack(UDP_ACK, data)
+                if magic == b"TA" and seq == self.seq:
+                    return status
+
 
 class DispenserClient:
-    def __init__(self, *, config, blinker):
+    """ calls treat on the dispenser - over UDP if config.TREAT_UDP_PORT is set, over HTTP
+    otherwise. HTTP connection is kept open between presses, so a press costs just one
+    round trip either way. With `tracer`, traced requests carry their trace id (and
+    `stdlib` gives the ticks of "request" spans) """
+
+    def __init__(self, *, config, blinker, stdlib=None, tracer=None):
         self.config = config
         self.blinker = blinker
-        self.request_lock = None
-        self.request_exception = None
+        self.stdlib = stdlib
+        self.tracer = tracer
+        self.in_progress = False
+        # random start, so requests after reboot are not taken for retransmits
+        self._request_id = random.getrandbits(30)
 
-    def make_request(self, url, json):
-        with self.request_lock:
-            try:
-                self.request_exception = None
-                self.response = requests.post(self.config.TREAT_URL, json={'portion': self.config.PORTION_IDX})
-            except Exception as e:
-                self.request_exception = e
+        host, port, self.path = ahttp.split_url(config.TREAT_URL)
+        self.http = ahttp.KeepAliveClient(host, port, timeout=config.HTTP_TIMEOUT, keepalive=config.HTTP_KEEPALIVE,
+                                          clock=stdlib)
+        self.udp = None
+        if config.TREAT_UDP_PORT:
+            self.udp = DatagramSender(host, config.TREAT_UDP_PORT, ack_timeout=config.UDP_ACK_TIMEOUT,
+                                      retries=config.UDP_RETRIES, poll_interval=config.UDP_POLL_INTERVAL)
 
-    async def treat(self):
-        try:
-            if self.request_lock and self.request_lock.locked():
-                raise RuntimeError("request already in progress")
+    def new_request_id(self) -> int:
+        self._request_id = (self._request_id + 1) & 0xffffffff
+        return self._request_id
 
-            self.request_lock = _thread.allocate_lock()
+    async def treat(self, trace=None) -> bool:
+        """ send one press, return whether it has been dispensed. The trace is finished """
+        try:
+            await self.send(trace=trace)
+            return True
+        except Exception:
+            logger.exception("some error while calling %s", self.config.TREAT_URL)
+            return False
+        finally:
+            if trace and self.tracer:
+                self.tracer.finish(trace)
 
-            _thread.start_new_thread(self.make_request, (self.config.TREAT_URL,
-                                                         {'portion': self.config.PORTION_IDX}))
-            while not self.request_lock.locked():
-                await uasyncio.sleep(0.01)
+    async def send(self, count=1, request_id=None, trace=None):
+        """ dispense `count` portions. Raises RetryLater, if the same request (with the same
+        request_id) may be sent again, any other exception if that is not safe. Every call
+        adds "request" span to `trace` (and "connect" span, if a connection was opened for it),
+        finishing it is up to the caller """
+        if self.in_progress:
+            raise RetryLater("request already in progress")
+        if request_id is None:
+            request_id = self.new_request_id()
+        if not self.tracer:
+            trace = None
+        start = self.stdlib.ticks_us() if trace else 0
 
-            logger.info("request started, waiting for thread to finish")
+        self.in_progress = True
+        self.blinker.show("in-flight")
+        try:
+            if self.udp:
+                await self._send_udp(count, request_id, trace)
+            else:
+                await self._send_http(count, trace)
+        except Exception:
+            self.blinker.show("error")
+            raise
+        finally:
+            self.in_progress = False
+            if trace:
+                self.tracer.span(trace, "request", start)
 
-            i = 0
-            while self.request_lock.locked():
-                i += 1
-                logger.debug("thread is still alive, sleeping a while (%s) ", i)
-                await self.blinker.blink(0.1, 0.05)
+        self.blinker.show("ok")
 
-            if self.request_exception:
-                raise self.request_exception
+    async def _send_http(self, count, trace=None):
+        headers = {tracing.HEADER: trace} if trace else None
+        try:
+            status, _ = await self.http.post_json(self.path, {'portion': self.config.PORTION_IDX, 'count': count},
+                                                  headers)
+        except ahttp.ConnectError as e:
+            raise RetryLater("could not connect: %r" % e)
+        finally:
+            if trace and self.http.connect_span:
+                self.tracer.span(trace, "connect", *self.http.connect_span)
 
-            if self.response.status_code // 100 != 2:
-                raise RuntimeError("returned status %s" % self.response.status_code)
+        if status == 503:
+            raise RetryLater("dispenser is busy")
+        if status // 100 != 2:
+            raise RuntimeError("returned status %s" % status)
 
-            await self.blinker.blink(0.6, 0.1)
-            return True
+    async def _send_udp(self, count, request_id, trace=None):
+        try:
+            status = await self.udp.treat(self.config.PORTION_IDX, count, request_id, trace)
+        except OSError as e:
+            raise RetryLater("no answer: %r" % e)  # retransmit is recognized by dispenser
 
-        except Exception as e:
-            logger.exc(e, "some error while calling %s", self.config.TREAT_URL)
-            await self.blinker.blink(0.6, 0.03)
-            return False
+        if status == UDP_BUSY:
+            raise RetryLater("dispenser is busy")
+        if status != UDP_OK:
+            raise RuntimeError("dispenser answered %s" % UDP_STATUSES.get(status, status))
@@ -1,22 +1,32 @@
+import os
+
 from doit import get_var
 from doit.tools import Interactive, run_once, title_with_actions, config_changed
 from doit_api import cmdtask
 
 
 SRCS = {"aconn.py": None,
+        "ahttp.py": None,
         "blinker.py": None,
         "main.py": None,
         "config.py": None,
         "stdlib.py": None,
         "dispenser_client.py": None,
+        "outbox.py": None,
         "app.py": None,
         "config_local.py": None,
         '.micropython-lib/python-stdlib/logging/logging.py': 'lib/logging.py',
         '.usyslog/usyslog.py': 'lib/usyslog.py',
-        'logging_handlers.py': None}
+        'logging_handlers.py': None,
+        'logfilter.py': None,
+        'tracing.py': None}
 
 MPF_ADDR = get_var('MPF_ADDR', 'ttyUSB0')
 
+# `doit strip_debug=1 ...` sends our sources with debug logging calls removed, see strip_debug()
+STRIP_DEBUG = get_var('strip_debug', '')
+BUILD_DIR = '.build'
+
 
 REPOS = {'.micropython': get_var('MICROPYTHON_REPO', "git@github.com:micropython/micropython.git"),
          '.micropython-lib': get_var('MICROPYTHON_LIB_REPO', 'git@github.com:micropython/micropython-lib.git'),
@@ -39,13 +49,18 @@ def task_clone_external_repos():
 
 def task_send_to_esp32():
     for src, dst in SRCS.items():
+        actions = []
+        sent = src
         if not dst:
             dst = src
+            if STRIP_DEBUG:
+                sent = f"{BUILD_DIR}/{src}"
+                actions.append((strip_debug, [src, sent]))
 
         yield {'name': f"send_{src}",
-               'actions': [
+               'actions': actions + [
                         # f'mpfshell --loglevel=DEBUG --reset -n -o {MPF_ADDR}',
-                        f'mpfshell --loglevel=DEBUG -c "put {src} {dst}" -n -o {MPF_ADDR}'
+                        f'mpfshell --loglevel=DEBUG -c "put {sent} {dst}" -n -o {MPF_ADDR}'
                     ],
                'file_dep': [src],
                'task_dep': ['clone_external_repos'],
@@ -54,6 +69,35 @@ def task_send_to_esp32():
                }
 
 
+def strip_debug(src, dst):
+    """ copy python source `src` to `dst`, with logger.debug(...) and logging.debug(...)
+    statements replaced by `pass` (and empty lines, so line numbers in tracebacks stay) """
+    import ast
+
+    with open(src, "rb") as f:
+        source = f.read()
+    lines = source.split(b"\n")
+
+    calls = []
+    for node in ast.walk(ast.parse(source)):
+        call = node.value if isinstance(node, ast.Expr) else None
+        if (isinstance(call, ast.Call) and isinstance(call.func, ast.Attribute) and call.func.attr == "debug"
+                and isinstance(call.func.value, ast.Name) and call.func.value.id in ("logger", "logging")):
+            calls.append(node)
+
+    # from the end, so offsets of statements left to do do not move (ast offsets are in bytes)
+    for node in sorted(calls, key=lambda n: (n.lineno, n.col_offset), reverse=True):
+        first, last = node.lineno - 1, node.end_lineno - 1
+        head, tail = lines[first][:node.col_offset], lines[last][node.end_col_offset:]
+        for i in range(first + 1, last + 1):
+            lines[i] = b""
+        lines[first] = head + b"pass" + tail
+
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    with open(dst, "wb") as f:
+        f.write(b"\n".join(lines))
+
+
 @cmdtask(uptodate=[False], task_dep=["send_to_esp32"])
 def repl():
     return [
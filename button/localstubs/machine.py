@@ -1,4 +1,10 @@
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio  # type: ignore
+
 from common import traceme
+from pinbank import PinBank
 
 
 class ADC:
@@ -8,30 +14,128 @@ class ADC:
 class Pin:
     OUT = 'OUT'
     IN = 'IN'
+    IRQ_RISING = 1
+    IRQ_FALLING = 2
+
+    POLL_INTERVAL = 0.001  # seconds between looks into the bank for edges
+
+    # levels set by inject() (they take precedence over the bank), irq handlers and counts
+    # of edges in the bank already handled, per pin number
+    _levels = {}
+    _irqs = {}
+    _edges = {}
+    _bank = None  # PinBank of levels from outside, opened by the first pin which needs it
+    _poller = None  # task calling poll(), started by the first irq handler
 
     @traceme("Pin")
     def __init__(self, pin, dir_):
         self.pin_num = pin
 
+    @traceme("Pin")
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING):
+        self._irqs[self.pin_num] = (self, handler, trigger)
+        self._edges[self.pin_num] = self.bank().edges(self.pin_num)
+        if handler is not None:
+            self._start_poller()
+
+    @classmethod
+    def inject(cls, pin_num, val):
+        """ set level of input pin, call its irq handler if this is an edge it waits for """
+        old = cls._levels.get(pin_num, 0)
+        cls._levels[pin_num] = val
+        if pin_num not in cls._irqs or old == val:
+            return
+
+        pin, handler, trigger = cls._irqs[pin_num]
+        if trigger & (cls.IRQ_RISING if val else cls.IRQ_FALLING):
+            handler(pin)
+
+    @classmethod
+    def poll(cls):
+        """ call irq handlers for edges in the bank since the last poll, every one of them """
+        bank = cls.bank()
+        for pin_num, (pin, handler, trigger) in list(cls._irqs.items()):
+            edges = bank.edges(pin_num)
+            seen = cls._edges[pin_num]
+            while seen != edges:
+                seen = (seen + 1) & 0xffffffff
+                cls._edges[pin_num] = seen
+                if handler and trigger & (cls.IRQ_RISING if seen & 1 else cls.IRQ_FALLING):
+                    handler(pin)
+
+    @classmethod
+    def _start_poller(cls):
+        """ poll() in a task, so the handlers run in the thread of the event loop, as they do
+        on the board (soft irq) """
+        if cls._poller is not None:
+            return
+        poller = cls._poll_forever()
+        try:
+            cls._poller = asyncio.create_task(poller)
+        except RuntimeError:  # no event loop running (CPython), whoever drives the pins polls
+            poller.close()
+
+    @classmethod
+    async def _poll_forever(cls):
+        while True:
+            cls.poll()
+            await asyncio.sleep(cls.POLL_INTERVAL)
+
+    @classmethod
+    def reset(cls):
+        cls._levels.clear()
+        cls._irqs.clear()
+        cls._edges.clear()
+        if cls._poller is not None:
+            cls._poller.cancel()
+            cls._poller = None
+
+    @classmethod
+    def bank(cls):
+        if cls._bank is None:
+            cls._bank = PinBank()
+        return cls._bank
+
+    @classmethod
+    def use_bank(cls, bank):
+        """ read and write levels in `bank` instead of the default one """
+        cls._bank = bank
+
     @traceme("Pin")
     def value(self, val=None):
+        """ level of pin - injected, or from the bank. Level set is written to the bank """
         if val is None:
-            """ check if file exists, in such case return contents of file, otherwise return 0 """
-            try:
-                with open("/tmp/pins/%s" % self.pin_num, "r") as f:
-                    sval = f.read()
-                    val = int(sval)
-                    print("pin(%s) is %s" % (self.pin_num, val))
-                    return val
-            except Exception:
-                return 0
+            if self.pin_num in self._levels:
+                return self._levels[self.pin_num]
+            return self.bank().get(self.pin_num)
+        self.bank().set(self.pin_num, val)
 
 
 class PWM:
+    """ remembers its freq and duty, `changes` is list of ("freq" or "duty", value). Pin is
+    high in the bank while duty is not 0 (led is on) """
     @traceme("PWM")
-    def freq(self, *a, **kwa):
-        ...
+    def __init__(self, pin, freq=5000, duty=0):
+        self.pin = pin
+        self._freq = freq
+        self._duty = duty
+        self.changes = []
+
+    @traceme("PWM")
+    def freq(self, value=None):
+        if value is None:
+            return self._freq
+        self._freq = value
+        self.changes.append(("freq", value))
+
+    @traceme("PWM")
+    def duty(self, value=None):
+        if value is None:
+            return self._duty
+        self._duty = value
+        self.changes.append(("duty", value))
+        Pin.bank().set(self.pin.pin_num, 1 if value else 0)
 
     @traceme("PWM")
-    def duty(self, *a, **kwa):
+    def deinit(self):
         ...
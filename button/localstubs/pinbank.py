@@ -0,0 +1,109 @@
+""" levels of pins in one file, shared by machine.Pin stub (the app running in unix port of
+micropython) and whoever drives the pins from outside - tests, benchmarks, developer. Pin n
+has 4 bytes at 4*n of the file, count of its edges (level changes) as little-endian uint32,
+its level is the lowest bit of the count. The stub replays every edge, even if there were
+many of them since it last looked. Output pins (the led) are written there too:
+
+    python3 localstubs/pinbank.py set 15 0       # button pin low (pressed)
+    python3 localstubs/pinbank.py get 2          # is the led on?
+    python3 localstubs/pinbank.py press 15 -n 1000 --hold 0.05 --gap 0.05
+
+Where there is mmap (CPython), the file is mapped into memory: a count is 4 aligned bytes
+of shared memory, read and written with no syscall. Without mmap (micropython), the file is
+kept open and read and written in place.
+"""
+try:
+    import mmap
+except ImportError:
+    mmap = None  # type: ignore
+
+PATH = "/tmp/pinbank"
+SIZE = 64  # pins
+
+
+class PinBank:
+    def __init__(self, path=PATH, size=SIZE):
+        self.path = path
+        self.size = size
+        try:
+            self._file = open(path, "r+b")
+        except OSError:
+            self._file = open(path, "w+b")
+        length = self._file.seek(0, 2)
+        if length < 4 * size:
+            self._file.write(bytes(4 * size - length))
+            self._file.flush()
+
+        self._map = None
+        if mmap is not None:
+            self._map = mmap.mmap(self._file.fileno(), 4 * size)
+
+    def edges(self, pin_num: int) -> int:
+        """ count of level changes of the pin, wraps at 2**32 """
+        offset = 4 * pin_num
+        if self._map is not None:
+            return int.from_bytes(self._map[offset:offset + 4], "little")
+        self._file.seek(offset)
+        return int.from_bytes(self._file.read(4), "little")
+
+    def get(self, pin_num: int) -> int:
+        return self.edges(pin_num) & 1
+
+    def set(self, pin_num: int, level: int):
+        edges = self.edges(pin_num)
+        if edges & 1 == (1 if level else 0):
+            return
+        data = ((edges + 1) & 0xffffffff).to_bytes(4, "little")
+        offset = 4 * pin_num
+        if self._map is not None:
+            self._map[offset:offset + 4] = data
+            return
+        self._file.seek(offset)
+        self._file.write(data)
+        self._file.flush()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+
+def main():
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="read and drive pins of the stubbed machine")
+    parser.add_argument("--bank", default=PATH, help="file of the pins")
+    commands = parser.add_subparsers(dest="command", required=True)
+    get = commands.add_parser("get", help="print level of pin")
+    get.add_argument("pin", type=int)
+    set_ = commands.add_parser("set", help="set level of pin")
+    set_.add_argument("pin", type=int)
+    set_.add_argument("level", type=int, choices=[0, 1])
+    press = commands.add_parser("press", help="press (pull low) and release pin, n times")
+    press.add_argument("pin", type=int)
+    press.add_argument("-n", "--count", type=int, default=1)
+    press.add_argument("--hold", type=float, default=0.1, help="seconds the pin is low")
+    press.add_argument("--gap", type=float, default=0.5, help="seconds between presses")
+    args = parser.parse_args()
+
+    bank = PinBank(args.bank)
+    if args.command == "get":
+        print(bank.get(args.pin))
+    elif args.command == "set":
+        bank.set(args.pin, args.level)
+    else:
+        started = time.perf_counter()
+        for i in range(args.count):
+            if i:
+                time.sleep(args.gap)
+            bank.set(args.pin, 0)
+            time.sleep(args.hold)
+            bank.set(args.pin, 1)
+        print("%s presses in %.3f s" % (args.count, time.perf_counter() - started))
+    bank.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,16 @@
 # COPIED FROM pycopy-lib in vast part
 
 import os
+import struct
 from logging import Handler
 
-import usyslog as lus
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio  # type: ignore
+
+ERROR = 40  # logging.ERROR, not in every micropython logging
+SYSLOG_DEBUG = 7  # the least severe syslog severity, usyslog.S_DEBUG
 
 
 def try_remove(fn: str) -> None:
@@ -24,115 +31,439 @@ class RotatingFileHandler(Handler):
     A rotating file handler like RotatingFileHandler.
 
     Compatible with CPythons `logging.handlers.RotatingFileHandler` class.
+
+    Records are kept in RAM and written to file all at once (one open/close of the file)
+    when `bufferSize` bytes are buffered, `flushInterval` seconds after the first buffered
+    record, or when a record of `flushLevel` or above comes. Buffered records are lost on
+    reset, `bufferSize=0` writes every record right away.
     """
 
-    def __init__(self, filename, maxBytes=0, backupCount=0):
+    def __init__(self, filename, maxBytes=0, backupCount=0, bufferSize=0, flushInterval=0, flushLevel=ERROR):
         super().__init__()
         self.filename = filename
         self.maxBytes = maxBytes
         self.backupCount = backupCount
+        self.bufferSize = bufferSize
+        self.flushInterval = flushInterval
+        self.flushLevel = flushLevel
+
+        self._buffer = []  # lines waiting to be written
+        self._buffered = 0  # bytes in _buffer
+        self._timer = None  # task flushing after flushInterval
 
         try:
-            self._counter = get_filesize(self.filename)
+            self._counter = get_filesize(self.filename)  # size of file, with buffered lines
         except OSError:
             self._counter = 0
 
     def emit(self, record):
         """Write to file."""
-        msg = "%s: %s" % (record.levelname, record.message)
-        s_len = len(msg)
+        line = "%s: %s\n" % (record.levelname, record.message)
+        s_len = len(line.encode())
 
         if self.maxBytes and self.backupCount and self._counter + s_len > self.maxBytes:
-            # remove the last backup file if it is there
-            try_remove(self.filename + ".{0}".format(self.backupCount))
-
-            for i in range(self.backupCount - 1, 0, -1):
-                if i < self.backupCount:
-                    try:
-                        os.rename(
-                            self.filename + ".{0}".format(i),
-                            self.filename + ".{0}".format(i + 1),
-                        )
-                    except OSError:
-                        pass
+            self.flush()
+            self.rotate()
 
-            try:
-                os.rename(self.filename, self.filename + ".1")
-            except OSError:
-                pass
-            self._counter = 0
+        self._buffer.append(line)
+        self._buffered += s_len
+        self._counter += s_len
+
+        if self._buffered >= self.bufferSize or record.levelno >= self.flushLevel:
+            self.flush()
+        elif self.flushInterval and self._timer is None:
+            self._start_timer()
+
+    def rotate(self):
+        # remove the last backup file if it is there
+        try_remove(self.filename + ".{0}".format(self.backupCount))
+
+        for i in range(self.backupCount - 1, 0, -1):
+            if i < self.backupCount:
+                try:
+                    os.rename(
+                        self.filename + ".{0}".format(i),
+                        self.filename + ".{0}".format(i + 1),
+                    )
+                except OSError:
+                    pass
+
+        try:
+            os.rename(self.filename, self.filename + ".1")
+        except OSError:
+            pass
+        self._counter = 0
+
+    def flush(self):
+        """Write buffered records to file."""
+        if not self._buffer:
+            return
+
+        self._write(self._buffer)
+        self._buffer = []
+        self._buffered = 0
 
+    def _write(self, lines):
         with open(self.filename, "a") as f:
-            f.write(msg + "\n")
+            f.write("".join(lines))
 
-        self._counter += s_len
+    def lines(self):
+        """Iterate over logged lines, oldest first, with no newline. Lines logged while
+        iterating are not included."""
+        self.flush()
+        left = self._counter
+        try:
+            with open(self.filename, "r") as f:
+                for line in f:
+                    left -= len(line.encode())
+                    if left < 0:
+                        return
+                    yield line.rstrip("\n")
+        except OSError:
+            pass
+
+    def clear(self):
+        """Forget logged lines."""
+        self.flush()
+        try_remove(self.filename)
+        self._counter = 0
+
+    def _start_timer(self):
+        coro = self._flush_later()
+        try:
+            self._timer = asyncio.create_task(coro)
+        except RuntimeError:  # no event loop running (yet), next record tries again
+            coro.close()
 
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.flushInterval)
+        finally:
+            self._timer = None
+        self.flush()
+
+
+class RingFile:
+    """
+    Records (bytes) kept in one preallocated file of fixed size, oldest are overwritten.
 
-class RSyslogFileHandler(RotatingFileHandler):
-    """ handler which is mix of RotatingFileHandler and udp syslog client.  when trying to
-    emit first log, there is attempt to establish udp client. If it's not possible
-    (eg. no WIFI connection yet), then another attempt is made in next emit. """
+    The file starts with a header (magic, head and tail offsets), the rest is a ring of
+    records, each is 2 bytes of length and the record itself, wrapping over the end of the
+    file. `head` is the offset of the oldest record, `tail` where the next one goes, the
+    ring is empty when they are equal.
 
-    def __init__(self, filename, maxBytes, backupCount, remote_addr, identifier):
+    The file is never renamed, truncated or grown - an append writes the records and the
+    header in place. Records are written before the header which makes them visible, and
+    the oldest records are dropped in the header before their space is reused, so a power
+    loss loses at most the records being appended.
+    """
+    MAGIC = b"RLG1"
+    HEADER = "<4sII"
+    LENGTH = "<H"
+    CHUNK = 512
+
+    def __init__(self, filename, size):
+        self.filename = filename
+        self.header_size = struct.calcsize(self.HEADER)
+        self.capacity = size - self.header_size
+        self.head = self.tail = 0
+        self.f = None
+
+        try:
+            self.f = open(filename, "r+b")
+            header = self.f.read(self.header_size)
+            if get_filesize(filename) != size or len(header) != self.header_size:
+                raise ValueError("size changed")
+            magic, self.head, self.tail = struct.unpack(self.HEADER, header)
+            if magic != self.MAGIC or self.head >= self.capacity or self.tail >= self.capacity:
+                raise ValueError("not a ring file")
+        except (OSError, ValueError):
+            self._create()
+
+    def _create(self):
+        if self.f:
+            self.f.close()
+        zeros = bytes(self.CHUNK)
+        with open(self.filename, "wb") as f:
+            for start in range(0, self.header_size + self.capacity, self.CHUNK):
+                f.write(zeros[:self.header_size + self.capacity - start])
+        self.f = open(self.filename, "r+b")
+        self.head = self.tail = 0
+        self._write_header()
+
+    def close(self):
+        self.f.close()
+
+    def _write_header(self):
+        self.f.seek(0)
+        self.f.write(struct.pack(self.HEADER, self.MAGIC, self.head, self.tail))
+        self.f.flush()
+
+    def _read(self, offset, size):
+        """ read from data part, over the end of file to the start """
+        first = min(size, self.capacity - offset)
+        self.f.seek(self.header_size + offset)
+        data = self.f.read(first)
+        if first < size:
+            self.f.seek(self.header_size)
+            data += self.f.read(size - first)
+        return data
+
+    def _write(self, offset, data):
+        first = min(len(data), self.capacity - offset)
+        self.f.seek(self.header_size + offset)
+        self.f.write(data[:first])
+        if first < len(data):
+            self.f.seek(self.header_size)
+            self.f.write(data[first:])
+
+    def used(self) -> int:
+        return (self.tail - self.head) % self.capacity
+
+    def _next(self, offset, tail):
+        """ offset of record after the one at `offset`, None if the length is broken """
+        length = struct.unpack(self.LENGTH, self._read(offset, 2))[0]
+        if length + 2 > (tail - offset) % self.capacity:
+            return None
+        return (offset + 2 + length) % self.capacity
+
+    def append(self, records):
+        """ append records (bytes), in one write of data and header """
+        max_length = self.capacity - 3
+        data = b"".join(struct.pack(self.LENGTH, len(r[:max_length])) + r[:max_length] for r in records)
+        if len(data) > self.capacity - 1:
+            # more than the whole ring, keep the newest records which fit
+            kept = []
+            size = 0
+            for record in reversed(records):
+                size += 2 + len(record[:max_length])
+                if size > self.capacity - 1:
+                    break
+                kept.insert(0, record)
+            return self.append(kept) if kept else None
+
+        head = self.head
+        while self.capacity - 1 - (self.tail - head) % self.capacity < len(data):
+            head = self._next(head, self.tail)
+            if head is None:  # broken record, drop everything
+                head = self.tail
+        if head != self.head:
+            self.head = head
+            self._write_header()
+
+        self._write(self.tail, data)
+        self.tail = (self.tail + len(data)) % self.capacity
+        self._write_header()
+
+    def records(self):
+        """ iterate over records, oldest first. Records appended while iterating are not
+        included """
+        offset, tail = self.head, self.tail
+        while offset != tail:
+            next_ = self._next(offset, tail)
+            if next_ is None:
+                return
+            yield self._read((offset + 2) % self.capacity, (next_ - offset) % self.capacity - 2)
+            offset = next_
+
+    def clear(self):
+        self.head = self.tail
+        self._write_header()
+
+
+class RingFileHandler(RotatingFileHandler):
+    """
+    A handler writing to one file of fixed `size`, where the newest records overwrite the
+    oldest ones, see RingFile. Buffered like RotatingFileHandler.
+    """
+
+    def __init__(self, filename, size, bufferSize=0, flushInterval=0, flushLevel=ERROR):
+        super().__init__(filename, bufferSize=bufferSize, flushInterval=flushInterval, flushLevel=flushLevel)
+        self.ring = RingFile(filename, size)
+
+    def _write(self, lines):
+        self.ring.append([line[:-1].encode() for line in lines])
+
+    def lines(self):
+        self.flush()
+        for record in self.ring.records():
+            yield record.decode()
+
+    def clear(self):
+        self.flush()
+        self.ring.clear()
+
+    def close(self):
+        self.flush()
+        self.ring.close()
+
+
+class RSyslogFileHandler(Handler):
+    """ handler which is mix of a file handler and udp syslog client.
+
+    Records go to RingFileHandler of `ringSize` bytes, if it is set, to RotatingFileHandler
+    otherwise. For syslog, `emit` only puts them to a queue of `queueSize` records, the
+    oldest are dropped when it is full. Background task sends the queue, several records
+    (lines) in one datagram of at most `datagramSize` bytes.
+
+    The task starts with establishing udp client and sending the file (records logged
+    before the network was up). If it is not possible (eg. no WIFI connection yet), then
+    another attempt is made after the next emit. """
+
+    def __init__(self, filename, maxBytes, backupCount, remote_addr, identifier, bufferSize=0, flushInterval=0,
+                 ringSize=0, queueSize=64, datagramSize=1400):
         """ NOTE: it's good if remote_addr is an ip """
-        super().__init__(filename=filename, maxBytes=maxBytes, backupCount=backupCount)
+        super().__init__()
+        if ringSize:
+            self.file = RingFileHandler(filename, ringSize, bufferSize=bufferSize, flushInterval=flushInterval)
+        else:
+            self.file = RotatingFileHandler(filename, maxBytes=maxBytes, backupCount=backupCount,
+                                            bufferSize=bufferSize, flushInterval=flushInterval)
+        self.filename = filename
 
         self.remote_addr = remote_addr
         self.identifier = identifier
+        self.datagramSize = datagramSize
 
+        self.lus = None  # usyslog module, imported with the udp client
         self.udp_client = None
         self.file_flushed = False
 
+        # queue of (levelno, line), a ring of queueSize
+        self._queue = [None] * queueSize
+        self._first = 0
+        self._queued = 0
+        self.dropped = 0  # records dropped as the queue was full, not reported yet
+
+        self._batch = []  # lines of the datagram being packed
+        self._batch_size = 0
+        self._batch_severity = SYSLOG_DEBUG
+        self._wake = asyncio.Event()
+        self._task = None
+
     def init_rsyslog(self):
         import gc
         gc.collect()
         try:
+            import usyslog as lus
+
+            self.lus = lus
             self.udp_client = lus.UDPClient(ip=self.remote_addr)
         except Exception as e:
             print("     [WARNING: could not initialize udp syslog handler, postponing %s ]" % e)
             self.udp_client = None
 
-    def flush_file(self):
+    async def flush_file(self):
         try:
-            print("     [will flush file]")
-            self.udp_client.log(lus.S_INFO, "---- flushing file %s ----" % self.filename)
-            with open(self.filename, "r") as f:
-                for line in f:
-                    self.udp_client.log(lus.S_INFO, "%s: %s" % (self.identifier, line))
+            lus = self.lus
+            # records queued by now are in the file already
+            self._first = self._queued = self.dropped = 0
 
-            os.remove(self.filename)
-            self.udp_client.log(lus.S_INFO, "---- end of flush, %s removed ----" % self.filename)
-            print("     [end of flush]")
+            self._pack(lus.S_INFO, "---- flushing file %s ----" % self.filename)
+            for line in self.file.lines():
+                if self._pack(lus.S_INFO, "%s: %s" % (self.identifier, line)):
+                    await asyncio.sleep(0)
+
+            self.file.clear()
+            self._pack(lus.S_INFO, "---- end of flush, %s removed ----" % self.filename)
+            self._send_batch()
 
             self.file_flushed = True
         except Exception as e:
+            self._clear_batch()
             print("     [Could not flush file to UDP - will try later: %s]" % e)
 
-    def emit(self, record):
-        super().emit(record)
-
-        print(record.levelname, ":", record.name, ":", record.message)
-
-        if not self.udp_client:
-            self.init_rsyslog()
-
-        if not self.file_flushed:
-            self.flush_file()
-
-        if not self.file_flushed:
-            return  # no point to try send current log if archive was not sent
+    def flush(self):
+        self.file.flush()
 
+    def emit(self, record):
+        self.file.emit(record)
+
+        size = len(self._queue)
+        if self._queued == size:
+            self._first = (self._first + 1) % size
+            self._queued -= 1
+            self.dropped += 1
+        self._queue[(self._first + self._queued) % size] = (
+            record.levelno, "%s: %s: %s" % (self.identifier, record.levelname, record.message))
+        self._queued += 1
+
+        if self._task is None:
+            coro = self._run()
+            try:
+                self._task = asyncio.create_task(coro)
+            except RuntimeError:  # no event loop running (yet), next record tries again
+                coro.close()
+        self._wake.set()
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+
+            if not self.udp_client:
+                self.init_rsyslog()
+            if not self.udp_client:
+                continue
+
+            if not self.file_flushed:
+                await self.flush_file()
+            if not self.file_flushed:
+                continue  # no point to try send current log if archive was not sent
+
+            await self._send_queue()
+
+    async def _send_queue(self):
+        lus = self.lus
         try:
-
-            msg = "%s: %s: %s" % (self.identifier, record.levelname, record.message)
-
-            mapping = {'debug': lus.S_DEBUG,
-                       'info': lus.S_INFO,
-                       'warning': lus.S_WARN,
-                       'error': lus.S_ERR}
-
-            s_level = mapping.get(record.levelname, lus.S_INFO)
-            self.udp_client.log(s_level, msg)
-
+            while self._queued:
+                if self.dropped:
+                    self._pack(lus.S_WARN, "%s: WARNING: %s log records dropped" % (self.identifier, self.dropped))
+                    self.dropped = 0
+
+                levelno, line = self._queue[self._first]
+                self._queue[self._first] = None
+                self._first = (self._first + 1) % len(self._queue)
+                self._queued -= 1
+
+                if levelno >= 40:
+                    severity = lus.S_ERR
+                elif levelno >= 30:
+                    severity = lus.S_WARN
+                elif levelno >= 20:
+                    severity = lus.S_INFO
+                else:
+                    severity = lus.S_DEBUG
+                if self._pack(severity, line):
+                    await asyncio.sleep(0)  # let the app run between datagrams
+            self._send_batch()
         except Exception as e:
+            self._clear_batch()
             print("     [could not send msg to UDP rsyslog: %s]" % e)
+
+    def _pack(self, severity, line) -> bool:
+        """ add line to the datagram being packed, returns True if a full one has been sent """
+        line = line[:self.datagramSize]
+        sent = False
+        if self._batch and self._batch_size + 1 + len(line) > self.datagramSize:
+            self._send_batch()
+            sent = True
+
+        self._batch.append(line)
+        self._batch_size += len(line) + (1 if len(self._batch) > 1 else 0)
+        self._batch_severity = min(self._batch_severity, severity)
+        return sent
+
+    def _send_batch(self):
+        if not self._batch:
+            return
+
+        message = "\n".join(self._batch)
+        severity = self._batch_severity
+        self._clear_batch()
+        self.udp_client.log(severity, message)
+
+    def _clear_batch(self):
+        self._batch = []
+        self._batch_size = 0
+        self._batch_severity = SYSLOG_DEBUG
@@ -7,21 +7,30 @@ import aconn
 import blinker
 import config
 import dispenser_client as dispenser_client
+import outbox
+import tracing
 from stdlib import StdlibProvider
 
 
 async def main():
     stdlib = StdlibProvider(config=config)
+    # ticks are counted from boot, so this is the time of wake up
+    woken_at = 0 if stdlib.woken_by_press() else None
     stdlib.init_logging()
 
     wlan = network.WLAN(network.STA_IF)
-    b = blinker.Blinker(config=config, stdlib=stdlib)
-    conn = aconn.ConnProvider(config=config, wlan=wlan, stdlib=stdlib, blinker=b)
-    di = dispenser_client.DispenserClient(config=config, blinker=b)
-
-    await conn.init_client()
-    app_ = app.App(config=config, dispenser_client=di, stdlib=stdlib)
-    await app_.run()
+    b = (blinker.PWMBlinker if config.BLINK_PWM else blinker.Blinker)(config=config, stdlib=stdlib)
+    cache = aconn.WifiCache(config.WIFI_CACHE_FILE) if config.WIFI_CACHE_FILE else None
+    conn = aconn.ConnProvider(config=config, wlan=wlan, stdlib=stdlib, blinker=b, cache=cache)
+    tracer = tracing.Tracer(clock=stdlib, side="button") if config.TRACE else None
+    di = dispenser_client.DispenserClient(config=config, blinker=b, stdlib=stdlib, tracer=tracer)
+    box = outbox.Outbox(config=config, client=di, stdlib=stdlib, tracer=tracer) if config.OUTBOX_FILE else None
+
+    await conn.init_client(blink=woken_at is None)
+    if box:
+        box.start()  # presses left from before reboot
+    app_ = app.App(config=config, dispenser_client=box or di, stdlib=stdlib, conn=conn, tracer=tracer)
+    await app_.run(woken_at=woken_at)
 
 
 if __name__ == '__main__':
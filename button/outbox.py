@@ -0,0 +1,166 @@
+import logging
+import os
+import random
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio  # type: ignore
+
+from dispenser_client import RetryLater
+
+
+logger = logging.getLogger(__name__)
+
+
+class Outbox:
+    """ presses waiting to be dispensed, kept in append-only file on flash, so they survive
+    reboot. Every line of the file is one event:
+
+        A <id> <count>  entry added
+        C <id> <count>  count of entry changed (press coalesced into it)
+        S <id>          sending of entry started
+        D <id>          entry done (dispensed, or given up)
+
+    Background task sends entries in order. Every entry is dispensed at most once - failed
+    request is sent again (after exponential backoff with jitter) only if the client says
+    it is safe, and entry which was being sent when the board rebooted is dropped.
+
+    Trace of press (see tracing) goes with its entry and is finished when the entry is done.
+    Trace of press coalesced into other entry, or dropped, is finished right away.
+    """
+
+    def __init__(self, *, config, client, stdlib, tracer=None):
+        self.filename = config.OUTBOX_FILE
+        self.capacity = config.OUTBOX_CAPACITY
+        self.max_count = config.OUTBOX_MAX_COUNT
+        self.backoff = config.OUTBOX_BACKOFF
+        self.max_backoff = config.OUTBOX_MAX_BACKOFF
+        self.client = client
+        self.stdlib = stdlib
+        self.tracer = tracer
+
+        self.entries = []  # [id, count, started, request_id, trace], oldest first
+        self._next_id = 1
+        self._lines = 0
+        self._added = asyncio.Event()
+        self._task = None
+        self._load()
+
+    def _load(self):
+        entries = {}
+        try:
+            with open(self.filename, "r") as f:
+                for line in f:
+                    try:
+                        parts = line.split()
+                        op, id_ = parts[0], int(parts[1])
+                        if op == "A":
+                            entries[id_] = [id_, int(parts[2]), False, None, None]
+                        elif op == "C":
+                            entries[id_][1] = int(parts[2])
+                        elif op == "S":
+                            entries[id_][2] = True
+                        elif op == "D":
+                            del entries[id_]
+                        self._next_id = max(self._next_id, id_ + 1)
+                    except (ValueError, IndexError, KeyError):
+                        logger.info("skipping broken outbox line %r", line)
+        except OSError:
+            pass
+
+        for id_ in sorted(entries):
+            entry = entries[id_]
+            if entry[2]:
+                logger.warning("treat #%s (%s portions) was being sent on reboot, dropping it", id_, entry[1])
+            else:
+                self.entries.append(entry)
+
+        if self.entries:
+            logger.info("%s treats waiting in outbox", len(self.entries))
+        self._rewrite()
+
+    def _append(self, line):
+        with open(self.filename, "a") as f:
+            f.write(line + "\n")
+        self._lines += 1
+
+    def _rewrite(self):
+        """ write file anew, with pending entries only """
+        if not self.entries:
+            try:
+                os.remove(self.filename)
+            except OSError:
+                pass
+            self._lines = 0
+            return
+
+        with open(self.filename, "w") as f:
+            for id_, count, started, _, _ in self.entries:
+                f.write("A %s %s\n" % (id_, count))
+                if started:
+                    f.write("S %s\n" % id_)
+        self._lines = 2 * len(self.entries)
+
+    def start(self):
+        """ start sending in background """
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def treat(self, trace=None) -> bool:
+        """ record press, it is sent in background. Returns False if outbox is full """
+        self.start()
+
+        last = self.entries[-1] if self.entries else None
+        if last and not last[2] and last[1] < self.max_count:
+            last[1] += 1
+            self._append("C %s %s" % (last[0], last[1]))
+            self._finish(trace)
+        elif len(self.entries) >= self.capacity:
+            logger.warning("outbox is full, dropping press")
+            self._finish(trace)
+            return False
+        else:
+            self.entries.append([self._next_id, 1, False, None, trace])
+            self._append("A %s 1" % self._next_id)
+            self._next_id += 1
+
+        self._added.set()
+        return True
+
+    def _finish(self, trace):
+        if trace and self.tracer:
+            self.tracer.finish(trace)
+
+    async def run(self):
+        backoff = self.backoff
+        while True:
+            if not self.entries:
+                self._added.clear()
+                await self._added.wait()
+                continue
+
+            entry = self.entries[0]
+            if not entry[2]:
+                entry[2] = True
+                entry[3] = self.client.new_request_id()
+                self._append("S %s" % entry[0])
+
+            try:
+                await self.client.send(entry[1], entry[3], entry[4])
+            except RetryLater as e:
+                delay = backoff * (0.5 + random.random() / 2)
+                logger.info("treat #%s not dispensed (%s), next try in %s s", entry[0], e, delay)
+                await self.stdlib.sleep(delay)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+            except Exception:
+                logger.exception("treat #%s may or may not have been dispensed, giving up on it", entry[0])
+
+            backoff = self.backoff
+            self._finish(entry[4])
+            self.entries.pop(0)
+            if not self.entries or self._lines > 4 * self.capacity:
+                self._rewrite()
+            else:
+                self._append("D %s" % entry[0])
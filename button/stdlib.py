@@ -1,24 +1,42 @@
 import uasyncio
 
+from logfilter import LogLimiter, Mute
 from logging_handlers import RSyslogFileHandler
 
 
 class StdlibProvider:
     """ """
+    PWM_FREQ = 1000
+
     def __init__(self, *, config):
         # import esp
         # print("osdebug")
         # esp.osdebug(0)
         self.config = config.LOGGING
+        self.log_handler = None
+        self.log_limiter = None
 
     def init_logging(self):
         import logging
-        logging.basicConfig(level=logging.DEBUG)
+        production = self.config.get('production', False)
+        logging.basicConfig(level=logging.INFO if production else logging.DEBUG)
         root_logger = logging.getLogger(None)
 
-        root_logger.addHandler(RSyslogFileHandler("log.log", maxBytes=200*1024, backupCount=3,
-                                                  remote_addr=self.config['rsyslog_host'],
-                                                  identifier=self.config['id']))
+        self.log_handler = RSyslogFileHandler("log.log", maxBytes=200*1024, backupCount=3,
+                                              remote_addr=self.config['rsyslog_host'],
+                                              identifier=self.config['id'],
+                                              bufferSize=self.config.get('buffer_size', 0),
+                                              flushInterval=self.config.get('flush_interval', 0),
+                                              ringSize=self.config.get('ring_size', 0),
+                                              queueSize=self.config.get('queue_size', 64),
+                                              datagramSize=self.config.get('datagram_size', 1400))
+        root_logger.addHandler(self.log_handler)
+
+        self.log_limiter = LogLimiter(clock=self, repeat_interval=self.config.get('repeat_interval', 10),
+                                      rate=self.config.get('rate', 5), burst=self.config.get('burst', 20))
+        self.log_limiter.install()
+        if production:
+            Mute().mute()  # every module is imported by now, with its logger
 
     def pin(self, number: int, direction: str):
         """ returns machine.Pin """
@@ -29,5 +47,57 @@ class StdlibProvider:
 
         return Pin(number, pindir)
 
+    def pwm(self, number: int):
+        """ returns machine.PWM of output pin, turned off """
+        from machine import Pin, PWM
+
+        return PWM(Pin(number, Pin.OUT), freq=self.PWM_FREQ, duty=0)
+
     async def sleep(self, t):
         await uasyncio.sleep(t)
+
+    def ticks_ms(self) -> int:
+        import utime
+
+        return utime.ticks_ms()
+
+    def ticks_us(self) -> int:
+        import utime
+
+        return utime.ticks_us()
+
+    def ticks_diff(self, ticks1: int, ticks2: int) -> int:
+        import utime
+
+        return utime.ticks_diff(ticks1, ticks2)
+
+    def time(self) -> int:
+        """ seconds of the real time clock, which goes on in deep sleep (not with power off) """
+        import utime
+
+        return utime.time()
+
+    def sleep_until_pressed(self, pin, deep: bool):
+        """ light (or deep) sleep until pin goes low. Deep sleep never returns """
+        import esp32
+        import machine
+
+        esp32.wake_on_ext0(pin=pin, level=esp32.WAKEUP_ALL_LOW)
+        if deep:
+            if self.log_handler:
+                self.log_handler.flush()  # RAM is lost in deep sleep
+            machine.deepsleep()
+        machine.lightsleep()
+
+    def rtc_kept(self) -> bool:
+        """ True if the real time clock went on through the last reset (deep sleep, soft
+        reset), False after power on """
+        import machine
+
+        return machine.reset_cause() in (machine.DEEPSLEEP_RESET, machine.SOFT_RESET)
+
+    def woken_by_press(self) -> bool:
+        """ True if board boots after deep sleep, woken up by button (ext0) """
+        import machine
+
+        return machine.reset_cause() == machine.DEEPSLEEP_RESET and machine.wake_reason() == machine.EXT0_WAKE
@@ -12,10 +12,25 @@ class StdlibStub:
     def __init__(self, *, config):
         self.total_slept = 0.0
         self.pin_stub = PinStub()
+        self.pins_created = 0
         self.config = config
 
     def pin(self, number: int, direction: str) -> PinStub:
+        self.pins_created += 1
         return self.pin_stub
 
     async def sleep(self, seconds: float):
         self.total_slept += seconds
+
+    def ticks_ms(self) -> int:
+        """ virtual clock, time goes on only by sleeping """
+        return int(self.total_slept * 1000)
+
+    def ticks_us(self) -> int:
+        return int(self.total_slept * 1000000)
+
+    def ticks_diff(self, ticks1: int, ticks2: int) -> int:
+        return ticks1 - ticks2
+
+    def rtc_kept(self) -> bool:
+        return True
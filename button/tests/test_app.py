@@ -1,3 +1,5 @@
+import sys
+import time
 import unittest
 
 try:
@@ -5,78 +7,247 @@ try:
 except ImportError:
     import asyncio  # type: ignore
 
+try:
+    from machine import Pin
+except ImportError:  # not on esp32, use stub which can inject edges
+    sys.path.append("localstubs")
+    from machine import Pin
+
 from . import common
+from .test_pinbank import remove_temp_bank, use_temp_bank
 from .utils import run_until_complete
 
 from app import App
+from tracing import Tracer
 
 
 class ConfigStub:
     BLINK_LED_PIN = 2
     BUTTON_PIN = 15
+    BUTTON_DEBOUNCE_MS = 30
 
 
 class DispenserClientStub:
     def __init__(self, **kwargs):
         self.treat_called = 0
+        self.traces = []
+        self.treated = asyncio.Event()
 
-    async def treat(self):
+    async def treat(self, trace=None):
         self.treat_called += 1
+        self.traces.append(trace)
+        self.treated.set()
 
 
-class PinStub:
-    """ stub of pin which will return 0 at the beginning, then will return `1` 5x, then
-    will return `0` in all subsequent calls """
+class StdlibStub(common.StdlibStub):
+    def __init__(self, *, config):
+        super().__init__(config=config)
+        self.sleeps = []
 
-    def __init__(self):
-        self.remaining_values = [0] + 10*[1] + [0]
+    def pin(self, number: int, direction: str) -> Pin:  # type: ignore
+        return Pin(number, Pin.IN)
 
-    def value(self, val: int = 0):
-        if not self.remaining_values:
-            return 0
-        return self.remaining_values.pop(0)
+    def sleep_until_pressed(self, pin, deep: bool):
+        """ sleeps 10 minutes, then the button wakes it up """
+        self.sleeps.append((pin.pin_num, deep))
+        self.total_slept += 600
+        Pin.inject(pin.pin_num, 0)
 
 
-class StdlibStub(common.StdlibStub):
-    def __init__(self, *, config):
-        super().__init__(config=config)
-        self.pin_stub = None
+class ConnStub:
+    """ wifi, which takes 0.3 s to come back """
+    def __init__(self, stdlib):
+        self.stdlib = stdlib
+        self.suspended = 0
+        self.resumed = 0
+
+    def suspend(self):
+        self.suspended += 1
 
-    def pin(self, number: int, direction: str) -> PinStub:  # type: ignore
-        if self.pin_stub:
-            return self.pin_stub
+    async def init_client(self, blink=True):
+        assert not blink
+        await self.stdlib.sleep(0.3)
+        self.resumed += 1
 
-        self.pin_stub = PinStub()
-        return self.pin_stub
 
-    async def sleep(self, seconds: float):
-        await super().sleep(seconds)
-        await asyncio.sleep(0.01)  # to avoid extensive CPU usage
+class SleepyConfigStub(ConfigStub):
+    SLEEP_IDLE = 0.05
+    SLEEP_MODE = "light"
+
+
+def perf_ms():
+    """ real (not virtual) time in ms """
+    try:
+        return time.perf_counter() * 1000
+    except AttributeError:  # micropython
+        return time.ticks_ms()  # type: ignore
 
 
 class TestApp(unittest.TestCase):
 
     def setUp(self):
+        Pin.reset()
+        self.bank = use_temp_bank()
+        Pin.inject(ConfigStub.BUTTON_PIN, 1)  # button is released (pulled up)
         self.stdlib = StdlibStub(config=ConfigStub())
         self.dispenser_client = DispenserClientStub()
         self.app = App(config=ConfigStub(), stdlib=self.stdlib, dispenser_client=self.dispenser_client)
 
+    def tearDown(self):
+        remove_temp_bank(self.bank)
+
+    def press(self, *levels):
+        """ inject levels to button pin, all at the same (virtual) time """
+        for level in levels:
+            Pin.inject(ConfigStub.BUTTON_PIN, level)
+
     @run_until_complete
     async def test_pressing_treat(self):
         """ check if pressing button ends in sending treat in dispenser client """
-        # GIVEN: application which has stdlib stub, which has pin stub which will return
-        # 0, 10 * 1 and then zeros
+        # GIVEN: running App's loop
+        task = asyncio.create_task(self.app.run())
+        await asyncio.sleep(0)
+
+        # WHEN: button is pressed
+        pressed = perf_ms()
+        self.press(0)
+        await self.dispenser_client.treated.wait()
+
+        # THEN: dispenser treat has been called, with no polling delay
+        self.assertEqual(self.dispenser_client.treat_called, 1)
+        self.assertLess(perf_ms() - pressed, 20)
+        task.cancel()
 
-        # WHEN: run App's loop
-        asyncio.create_task(self.app.run())
+    @run_until_complete
+    async def test_press_time_is_taken_in_irq(self):
+        self.stdlib.total_slept = 1.5
+        self.press(0)
+        self.stdlib.total_slept = 2
 
-        # wait until in pin's remaining_values queue is exhausted
-        while self.stdlib.pin_stub.remaining_values:
-            await asyncio.sleep(0.1)
+        self.assertEqual(await self.app.wait_until_pressed(), 1500)
 
-        # THEN: dispenser treat has been called
+    @run_until_complete
+    async def test_traced_press(self):
+        self.app.tracer = Tracer(clock=self.stdlib, side="button")
+        task = asyncio.create_task(self.app.run())
+        await asyncio.sleep(0)
+
+        # WHEN: press is sent 20 ms after the irq
+        self.stdlib.total_slept = 1.5
+        self.press(0)
+        self.stdlib.total_slept = 1.52
+        await self.dispenser_client.treated.wait()
+        task.cancel()
+
+        # THEN: it is sent with new trace, which starts with the press
+        trace = self.dispenser_client.traces[0]
+        self.assertEqual(self.app.tracer.traces[trace], [("press", 1500000, 20000)])
+
+    @run_until_complete
+    async def test_bouncing(self):
+        task = asyncio.create_task(self.app.run())
+
+        # WHEN: contacts bounce on press and, 200 ms later, on release
+        self.press(0, 1, 0, 1, 0)
+        await asyncio.sleep(0.01)
+        self.stdlib.total_slept += 0.2
+        self.press(1, 0, 1)
+        await asyncio.sleep(0.01)
+
+        # THEN: it is just one press
         self.assertEqual(self.dispenser_client.treat_called, 1)
 
+        # WHEN: button is pressed again after a while
+        self.stdlib.total_slept += 0.2
+        self.press(0)
+        await asyncio.sleep(0.01)
+
+        # THEN: it is the second press
+        self.assertEqual(self.dispenser_client.treat_called, 2)
+        task.cancel()
+
+
+class TestSleep(unittest.TestCase):
+
+    def setUp(self):
+        Pin.reset()
+        self.bank = use_temp_bank()
+        Pin.inject(ConfigStub.BUTTON_PIN, 1)
+        self.stdlib = StdlibStub(config=SleepyConfigStub())
+        self.conn = ConnStub(self.stdlib)
+        self.dispenser_client = DispenserClientStub()
+        self.app = App(config=SleepyConfigStub(), stdlib=self.stdlib, dispenser_client=self.dispenser_client,
+                       conn=self.conn)
+
+    def tearDown(self):
+        remove_temp_bank(self.bank)
+
+    @run_until_complete
+    async def test_sleep_when_idle(self):
+        # WHEN: nobody presses the button for a while
+        task = asyncio.create_task(self.app.run())
+        await self.dispenser_client.treated.wait()
+        await asyncio.sleep(0.02)
+        task.cancel()
+
+        # THEN: button went to sleep with wifi off, woken up by the press
+        self.assertEqual(self.stdlib.sleeps, [(ConfigStub.BUTTON_PIN, False)])
+        self.assertEqual(self.conn.suspended, 1)
+
+        # ... and the press is sent as treat (once), right after wifi is back
+        self.assertEqual(self.conn.resumed, 1)
+        self.assertEqual(self.dispenser_client.treat_called, 1)
+        self.assertEqual(self.app.last_latency_ms, 300)
+
+    @run_until_complete
+    async def test_no_sleep_while_outbox_sends(self):
+        self.dispenser_client.entries = [[1, 1, True, None, None]]
+
+        # WHEN: nobody presses the button, but a press waits for retry in outbox
+        task = asyncio.create_task(self.app.run())
+        await asyncio.sleep(0.15)
+
+        # THEN: button stays awake, until the outbox is done
+        self.assertEqual(self.stdlib.sleeps, [])
+        self.dispenser_client.entries = []
+        await self.dispenser_client.treated.wait()
+        task.cancel()
+        self.assertEqual(self.stdlib.sleeps, [(ConfigStub.BUTTON_PIN, False)])
+
+    @run_until_complete
+    async def test_woken_from_deep_sleep(self):
+        # WHEN: app starts after wake up from deep sleep (wifi came up 250 ms after it)
+        self.stdlib.total_slept = 0.25
+        task = asyncio.create_task(self.app.run(woken_at=0))
+        await self.dispenser_client.treated.wait()
+        task.cancel()
+
+        # THEN: the press which woke the board up is sent right away
+        self.assertEqual(self.dispenser_client.treat_called, 1)
+        self.assertEqual(self.app.last_latency_ms, 250)
+        self.assertEqual(self.stdlib.sleeps, [])
+
+    @run_until_complete
+    async def test_traced_wake(self):
+        self.app.tracer = Tracer(clock=self.stdlib, side="button")
+        task = asyncio.create_task(self.app.run())
+        await self.dispenser_client.treated.wait()
+        task.cancel()
+
+        # THEN: trace of the press, which woke the button, starts with the wake up
+        trace = self.dispenser_client.traces[0]
+        self.assertEqual(self.app.tracer.traces[trace], [("wake", 600000000, 300000)])
+
+    @run_until_complete
+    async def test_no_sleep_without_conn(self):
+        app = App(config=ConfigStub(), stdlib=self.stdlib, dispenser_client=self.dispenser_client)
+        self.assertIsNone(await app.wait_until_pressed(timeout=0.01))
+
+        task = asyncio.create_task(app.run())
+        await asyncio.sleep(0.1)
+        task.cancel()
+        self.assertEqual(self.stdlib.sleeps, [])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,8 +1,21 @@
+import sys
 import unittest
 
-from blinker import Blinker
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio  # type: ignore
+
+try:
+    from machine import PWM, Pin
+except ImportError:  # not on esp32, use stub which records freq and duty
+    sys.path.append("localstubs")
+    from machine import PWM, Pin
+
+from blinker import Blinker, PWMBlinker
 
 from .common import StdlibStub
+from .test_pinbank import remove_temp_bank, use_temp_bank
 from .utils import run_until_complete
 
 
@@ -44,5 +57,116 @@ class TestBlinker(unittest.TestCase):
         self.assertEqual(led.values_called[1], 20)
 
 
+class ShortBlinker(Blinker):
+    PATTERNS = {"ok": (0.01, 0.01, 3),
+                "in-flight": (0.01, 0.01, None)}
+
+
+class TestPatterns(unittest.TestCase):
+
+    def setUp(self):
+        self.config = ConfigStub()
+        self.config.BLINK_LED_PIN = 15
+        self.stdlib = StdlibStub(config=ConfigStub())
+        self.blinker = ShortBlinker(config=self.config, stdlib=self.stdlib)
+        self.led = self.stdlib.pin_stub
+
+    def tearDown(self):
+        if self.blinker._task:
+            self.blinker._task.cancel()
+
+    @run_until_complete
+    async def test_pattern_plays_in_background(self):
+        # WHEN: pattern is shown
+        self.blinker.show("ok")
+
+        # THEN: it has not blinked yet - caller was not held up
+        self.assertEqual(self.led.values_called[1], 0)
+
+        # ... it blinks in background and stops after its 3 blinks
+        await asyncio.sleep(0)
+        self.assertEqual(self.blinker.playing, "ok")
+        await asyncio.sleep(0.15)
+        self.assertIsNone(self.blinker.playing)
+        self.assertEqual(self.led.values_called, {0: 3, 1: 3})
+
+    @run_until_complete
+    async def test_newer_pattern_preempts_older(self):
+        # GIVEN: pattern blinking until something else comes
+        self.blinker.show("in-flight")
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.blinker.playing, "in-flight")
+
+        # WHEN: other pattern is shown
+        self.blinker.show("ok")
+        await asyncio.sleep(0.03)
+
+        # THEN: it is played instead
+        self.assertEqual(self.blinker.playing, "ok")
+        await asyncio.sleep(0.1)
+        self.assertIsNone(self.blinker.playing)
+        self.assertEqual(self.led.values_called[0], self.led.values_called[1])
+
+    @run_until_complete
+    async def test_led_pin_is_created_once(self):
+        await self.blinker.blink(0.2, 0.05)
+        self.blinker.show("ok")
+        await asyncio.sleep(0.1)
+
+        self.assertEqual(self.stdlib.pins_created, 1)
+
+
+class PWMStdlibStub(StdlibStub):
+    def pwm(self, number: int):
+        return PWM(Pin(number, Pin.OUT), freq=1000, duty=0)
+
+
+class ShortPWMBlinker(PWMBlinker):
+    PATTERNS = dict(ShortBlinker.PATTERNS, slow=(1, 2, None))
+
+
+class TestPWMBlinker(unittest.TestCase):
+
+    def setUp(self):
+        self.config = ConfigStub()
+        self.config.BLINK_LED_PIN = 15
+        self.bank = use_temp_bank()
+        self.stdlib = PWMStdlibStub(config=ConfigStub())
+        self.blinker = ShortPWMBlinker(config=self.config, stdlib=self.stdlib)
+        self.pwm = self.blinker.pwm
+
+    def tearDown(self):
+        if self.blinker._task:
+            self.blinker._task.cancel()
+        remove_temp_bank(self.bank)
+
+    @run_until_complete
+    async def test_endless_pattern_is_done_by_pwm(self):
+        self.blinker.show("in-flight")
+        await asyncio.sleep(0.1)
+
+        # THEN: pwm was set to 50 Hz with duty of 50% once, cpu had nothing else to do
+        self.assertEqual(self.pwm.changes, [("freq", 50), ("duty", 511)])
+        self.assertEqual(self.blinker.playing, "in-flight")
+
+    @run_until_complete
+    async def test_one_shot_pattern_is_done_by_software(self):
+        self.blinker.show("in-flight")
+        await asyncio.sleep(0)
+        self.blinker.show("ok")
+        await asyncio.sleep(0.1)
+
+        self.assertEqual(self.pwm.changes[2:], [("duty", 1023), ("duty", 0)] * 3)
+        self.assertIsNone(self.blinker.playing)
+
+    @run_until_complete
+    async def test_too_slow_for_pwm(self):
+        self.blinker.show("slow")
+        await asyncio.sleep(0.05)
+
+        # THEN: led is turned on by software, as pwm can not go below 1 Hz
+        self.assertEqual(self.pwm.changes, [("duty", 1023)])
+
+
 if __name__ == '__main__':
     unittest.main()
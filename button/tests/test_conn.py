@@ -1,6 +1,6 @@
 import unittest
 
-from aconn import ConnProvider
+from aconn import ConnProvider, WifiCache
 from blinker import Blinker
 
 from .common import StdlibStub
@@ -9,17 +9,34 @@ from .utils import run_until_complete
 
 class ConfigStub:
     BLINK_LED_PIN = 2
+    WIFI_FAST_CONNECT_TIMEOUT = 1
+    WIFI_LEASE_TIME = 3600
+
+
+class RTCStdlibStub(StdlibStub):
+    """ real time clock shows `rtc` seconds at start, then goes on with the virtual time.
+    With `kept` False, the board was powered on (rtc started over) """
+
+    def __init__(self, *, config, rtc, kept=True):
+        super().__init__(config=config)
+        self.rtc = rtc
+        self.kept = kept
+
+    def time(self) -> int:
+        return self.rtc + int(self.total_slept)
+
+    def rtc_kept(self) -> bool:
+        return self.kept
 
 
 class BlinkerStub(Blinker):
     def __init__(self, config, stdlib):
         super().__init__(config=config, stdlib=stdlib)
 
-        self.ordered_blinks = []
+        self.shown = []
 
-    async def blink(self, time, delay):
-        self.ordered_blinks.append((time, delay))
-        await super().blink(time=time, delay=delay)
+    def show(self, name):
+        self.shown.append(name)
 
 
 class WLANStub:
@@ -28,24 +45,50 @@ class WLANStub:
         self.config_data = {}
         self.connected_ssid = self.connected_pass = None
         self.connect_attempts = 10
+        self.connected_bssid = None
         self.number_asked_for_isconnected = 0
         self._ifconfig_data = None
+        self.bssid_reachable = True
+        self.disconnected = False
+        self.dhcp_requested = False
+        self.scans = 0
+        self.bssid = b'\x0a\x0b\x0c\x0d\x0e\x0f'  # of the access point it connects to, None: not told
 
     def active(self, val):
         self.is_active = val
 
     def scan(self):
-        return [('something', 'something_else'),
-                ('something2', 'something_else_2')]
-
-    def config(self, **kwargs):
+        self.scans += 1
+        # (ssid, bssid, channel, RSSI, security, hidden)
+        return [(b'SSID', b'\x01\x02\x03\x04\x05\x06', 6, -70, 3, False),
+                (b'SSID', b'\x0a\x0b\x0c\x0d\x0e\x0f', 11, -50, 3, False),
+                (b'OTHER', b'\x11\x12\x13\x14\x15\x16', 1, -30, 3, False)]
+
+    def config(self, *args, **kwargs):
+        if args == ("channel",):
+            return 11  # of the strongest access point, it connects to that one
+        if args == ("bssid",):
+            if self.bssid is None:
+                raise ValueError("unknown config param")
+            return self.bssid
         self.config_data.update(kwargs)
 
-    def connect(self, ssid, pass_):
+    def connect(self, ssid, pass_, bssid=None):
         self.connected_ssid = ssid
         self.connected_pass = pass_
+        self.connected_bssid = bssid
+
+    def disconnect(self):
+        self.disconnected = True
 
     def isconnected(self):
+        if self.connected_bssid and not self.bssid_reachable:
+            return False
+
+        if self.connected_bssid:
+            # access point is known, no need to search for it
+            return True
+
         self.number_asked_for_isconnected += 1
 
         if self.number_asked_for_isconnected >= 10:
@@ -54,7 +97,9 @@ class WLANStub:
         return False
 
     def ifconfig(self, data_=None):
-        if data_:
+        if data_ == "dhcp":
+            self.dhcp_requested = True
+        elif data_:
             self._ifconfig_data = data_
         return self._ifconfig_data
 
@@ -90,20 +135,12 @@ class TestConn(unittest.TestCase):
 
         # sanity check
         self.assertEqual(self.wlan.number_asked_for_isconnected, 10)
-        # check if waited 2.8 (1 seconds at the beginning + 9*0.2) seconds
-        # and 2 more seconds for last blink
-        self.assertAlmostEqual(self.stdlib.total_slept, 4.8)
-
-        # check if at first we have fast blinking, then slow - after success
-        self.assertTrue(len(self.blinker.ordered_blinks) >= 2,
-                        msg="self.blinker.ordered_blinks should >= 2 but has %s" % len(self.blinker.ordered_blinks))
-        first_blinks = self.blinker.ordered_blinks[:-1]
-        last_blink = self.blinker.ordered_blinks[-1]
+        # check if waited 2.8 (1 seconds at the beginning + 9*0.2) seconds, blinking
+        # goes on in background
+        self.assertAlmostEqual(self.stdlib.total_slept, 2.8)
 
-        # first are fast
-        self.assertEqual(first_blinks[0], (0.2, 0.05))
-        # last is slow
-        self.assertEqual(last_blink, (2, 0.5))
+        # check if at first we have "connecting" blinking, then "connected" - after success
+        self.assertEqual(self.blinker.shown, ["connecting", "connected"])
 
     @run_until_complete
     async def test_init_client_with_ip(self):
@@ -119,5 +156,181 @@ class TestConn(unittest.TestCase):
                          ("12.12.12.12", "255.255.255.0", "10.10.10.10", "1.2.3.4"))
 
 
+class TestFastReconnect(unittest.TestCase):
+    LEASE = ("192.168.1.50", "255.255.255.0", "192.168.1.1", "192.168.1.1")
+
+    def setUp(self):
+        self.config = ConfigStub()
+        self.config.WIFI = {'client': {'dhcp': 'DHCPID', 'ssid': 'SSID', 'pass': 'PASS', 'dns': None}}
+
+        self.cache = WifiCache("test-wifi.json")
+        self.cache.clear()
+
+    def tearDown(self):
+        self.cache.clear()
+
+    def conn(self, rtc=100, kept=True):
+        self.wlan = WLANStub()
+        self.wlan._ifconfig_data = self.LEASE
+        self.stdlib = RTCStdlibStub(config=ConfigStub(), rtc=rtc, kept=kept)
+        self.blinker = BlinkerStub(config=self.config, stdlib=self.stdlib)
+        return ConnProvider(config=self.config, wlan=self.wlan, stdlib=self.stdlib, blinker=self.blinker,
+                            cache=self.cache)
+
+    async def connected_before(self):
+        """ lease saved by the previous boot, which went to sleep then """
+        conn = self.conn()
+        await conn.init_client()
+        conn.suspend()
+
+    @run_until_complete
+    async def test_cold_connect_saves_lease(self):
+        conn = self.conn()
+        await conn.init_client()
+
+        # THEN: dhcp lease, access point and channel are remembered, with no scan
+        self.assertEqual(self.cache.load(), {"bssid": "0a0b0c0d0e0f", "channel": 11, "ifconfig": list(self.LEASE),
+                                             "leased_at": 102})
+        conn.suspend()
+        self.assertEqual(self.wlan.scans, 0)
+
+    @run_until_complete
+    async def test_access_point_is_found_before_sleep(self):
+        # GIVEN: wifi, which does not tell the access point it connected to
+        conn = self.conn()
+        self.wlan.bssid = None
+        await conn.init_client()
+        self.assertEqual(self.cache.load()["bssid"], None)
+
+        # WHEN: it goes to sleep
+        conn.suspend()
+
+        # THEN: the strongest access point of our network on the channel is found, once
+        self.assertEqual(self.cache.load()["bssid"], "0a0b0c0d0e0f")
+        conn.suspend()
+        self.assertEqual(self.wlan.scans, 1)
+
+    @run_until_complete
+    async def test_warm_connect(self):
+        # GIVEN: lease saved by the previous boot
+        await self.connected_before()
+
+        # WHEN: connecting again (after reboot)
+        await self.conn(rtc=200).init_client()
+
+        # THEN: it connected straight to known access point, with no dhcp and no initial sleep
+        self.assertEqual(self.wlan.connected_bssid, b'\x0a\x0b\x0c\x0d\x0e\x0f')
+        self.assertEqual(self.wlan._ifconfig_data, self.LEASE)
+        self.assertFalse(self.wlan.dhcp_requested)
+        self.assertEqual(self.wlan.number_asked_for_isconnected, 0)
+        # ... on the channel it knows, so it took no time at all
+        self.assertEqual(self.wlan.config_data["channel"], 11)
+        self.assertEqual(self.stdlib.total_slept, 0)
+        self.assertEqual(self.cache.load()["leased_at"], 102)
+
+    @run_until_complete
+    async def test_lease_is_renewed_after_power_on(self):
+        # GIVEN: lease, which looks recent, but the clock started over since (power was off)
+        await self.connected_before()
+        conn = self.conn(rtc=200, kept=False)
+
+        # WHEN: connecting
+        await conn.init_client()
+
+        # THEN: it connected straight to known access point, asking dhcp for lease
+        self.assertEqual(self.wlan.connected_bssid, b'\x0a\x0b\x0c\x0d\x0e\x0f')
+        self.assertTrue(self.wlan.dhcp_requested)
+        self.assertEqual(self.cache.load()["leased_at"], 200)
+
+        # WHEN: it connects again after sleep, with the lease of this boot
+        conn.suspend()
+        self.wlan.dhcp_requested = False
+        await conn.init_client()
+
+        # THEN: the lease is used with no dhcp
+        self.assertFalse(self.wlan.dhcp_requested)
+
+    @run_until_complete
+    async def test_expired_lease_is_renewed(self):
+        await self.connected_before()
+
+        for rtc in [102 + 3600, 50]:  # lease is too old, or clock went back (power was off)
+            # WHEN: connecting again
+            await self.conn(rtc=rtc).init_client()
+
+            # THEN: it connected straight to known access point, asking dhcp for lease
+            self.assertEqual(self.wlan.connected_bssid, b'\x0a\x0b\x0c\x0d\x0e\x0f')
+            self.assertTrue(self.wlan.dhcp_requested)
+            self.assertEqual(self.stdlib.total_slept, 0)
+            self.assertEqual(self.wlan.scans, 0)
+            # ... and the new lease is remembered, with the access point
+            self.assertEqual(self.cache.load(), {"bssid": "0a0b0c0d0e0f", "channel": 11,
+                                                 "ifconfig": list(self.LEASE), "leased_at": rtc})
+
+    @run_until_complete
+    async def test_warm_connect_falls_back_to_cold(self):
+        # GIVEN: lease of access point which is not reachable anymore
+        await self.connected_before()
+        conn = self.conn(rtc=200)
+        self.wlan.bssid_reachable = False
+
+        # WHEN: connecting
+        await conn.init_client()
+
+        # THEN: after fast connect has timed out, client disconnected and connected the usual way
+        self.assertTrue(self.wlan.disconnected)
+        self.assertTrue(self.wlan.dhcp_requested)
+        self.assertEqual(self.wlan.number_asked_for_isconnected, 10)
+        # ... 1s of fast connect, 1s initial sleep and 9 * 0.2 waiting
+        self.assertAlmostEqual(self.stdlib.total_slept, 3.8)
+        # ... and the lease is saved again, with the access point it connected to now
+        self.assertEqual(self.cache.load(), {"bssid": "0a0b0c0d0e0f", "channel": 11, "ifconfig": list(self.LEASE),
+                                             "leased_at": 203})
+
+    @run_until_complete
+    async def test_unknown_access_point_is_cold(self):
+        # GIVEN: lease saved by wifi, which does not tell the access point, but no sleep (and
+        # scan) since
+        conn = self.conn()
+        self.wlan.bssid = None
+        await conn.init_client()
+
+        # WHEN: connecting again
+        await self.conn().init_client()
+
+        # THEN: it connects the usual way
+        self.assertIsNone(self.wlan.connected_bssid)
+        self.assertEqual(self.wlan.number_asked_for_isconnected, 10)
+
+    @run_until_complete
+    async def test_resume_after_sleep(self):
+        # GIVEN: connected client, which turned wifi off to sleep
+        await self.connected_before()
+        conn = self.conn(rtc=200)
+        await conn.init_client()
+        conn.suspend()
+        self.assertTrue(self.wlan.disconnected)
+        self.assertFalse(self.wlan.is_active)
+        slept = self.stdlib.total_slept
+
+        # WHEN: it resumes with no blinking (there is a press to send)
+        await conn.init_client(blink=False)
+
+        # THEN: it is connected to known access point right away
+        self.assertTrue(self.wlan.is_active)
+        self.assertEqual(self.wlan.connected_bssid, b'\x0a\x0b\x0c\x0d\x0e\x0f')
+        self.assertEqual(self.stdlib.total_slept, slept)
+        self.assertEqual(self.blinker.shown[-1], "connecting")
+
+    @run_until_complete
+    async def test_corrupted_cache(self):
+        with open(self.cache.filename, "w") as f:
+            f.write("{not a json")
+
+        await self.conn().init_client()
+
+        self.assertEqual(self.wlan.number_asked_for_isconnected, 10)
+
+
 if __name__ == '__main__':
     unittest.main()
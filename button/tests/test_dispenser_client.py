@@ -0,0 +1,420 @@
+import json
+import logging
+import socket
+import struct
+import time
+import unittest
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio  # type: ignore
+
+from . import common
+from .test_logfilter import ListHandler
+from .utils import run_until_complete
+
+import ahttp
+import dispenser_client
+import tracing
+from dispenser_client import DispenserClient
+
+
+PORT = 28477
+UDP_PORT = 28478
+
+
+class ConfigStub:
+    TREAT_URL = "http://127.0.0.1:%s/treat" % PORT
+    PORTION_IDX = 2
+    HTTP_TIMEOUT = 0.3
+    HTTP_KEEPALIVE = 0.03
+    TREAT_UDP_PORT = None
+
+
+class UDPConfigStub(ConfigStub):
+    TREAT_UDP_PORT = UDP_PORT  # type: ignore
+    UDP_ACK_TIMEOUT = 0.01
+    UDP_RETRIES = 3
+    UDP_POLL_INTERVAL = 0.001
+
+
+class BlinkerStub:
+    def __init__(self):
+        self.shown = []
+
+    def show(self, name):
+        self.shown.append(name)
+
+
+class ClockStub:
+    """ real clock, connections are idle in real time """
+
+    def ticks_ms(self) -> int:
+        try:
+            return time.ticks_ms()  # type: ignore
+        except AttributeError:
+            return int(time.monotonic() * 1000)
+
+    def ticks_us(self) -> int:
+        try:
+            return time.ticks_us()  # type: ignore
+        except AttributeError:
+            return int(time.monotonic() * 1000000)
+
+    def ticks_diff(self, ticks1: int, ticks2: int) -> int:
+        try:
+            return time.ticks_diff(ticks1, ticks2)  # type: ignore
+        except AttributeError:
+            return ticks1 - ticks2
+
+
+class DispenserServerStub:
+    """ minimal keep-alive HTTP server. `mode` says what to do with the next requests:
+    ok - respond and keep connection, close - respond and close connection, hang - never
+    respond, drop - close connection with no response, error - respond with status 500 """
+
+    def __init__(self):
+        self.mode = "ok"
+        self.connections = 0
+        self.requests = []
+        self.trace_ids = []  # X-Trace-Id header of every request (None, if not sent)
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", PORT)
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                length = 0
+                trace = None
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b""):
+                        break
+                    name, _, value = line.decode().partition(":")
+                    if name.lower() == "content-length":
+                        length = int(value)
+                    if name == tracing.HEADER:
+                        trace = value.strip()
+                body = await reader.readexactly(length)
+                self.requests.append((request_line, json.loads(body)))
+                self.trace_ids.append(trace)
+
+                if self.mode == "hang":
+                    await asyncio.sleep(1)
+                    break
+                if self.mode == "drop":
+                    break
+
+                status = {"error": b"500 Internal Server Error", "busy": b"503 Busy"}.get(self.mode, b"200 OK")
+                writer.write(b"HTTP/1.0 " + status + b"\r\nContent-Length: 2\r\n\r\nok")
+                await writer.drain()
+                if self.mode == "close":
+                    break
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+
+class TestDispenserClient(unittest.TestCase):
+
+    def setUp(self):
+        self.blinker = BlinkerStub()
+        self.client = DispenserClient(config=ConfigStub(), blinker=self.blinker, stdlib=ClockStub())
+        self.server = DispenserServerStub()
+
+    async def _run(self, coro):
+        await self.server.start()
+        try:
+            return await coro
+        finally:
+            await self.client.http.close()
+            await self.server.stop()
+
+    def test_split_url(self):
+        self.assertEqual(("treatme.home", 2477, "/treat"), ahttp.split_url("http://treatme.home:2477/treat"))
+        self.assertEqual(("host", 80, "/"), ahttp.split_url("http://host"))
+        with self.assertRaises(ValueError):
+            ahttp.split_url("https://host/")
+
+    @run_until_complete
+    async def test_connection_is_reused(self):
+        async def presses():
+            return [await self.client.treat() for _ in range(3)]
+
+        self.assertEqual([True] * 3, await self._run(presses()))
+        self.assertEqual(1, self.server.connections)
+        self.assertEqual(3, len(self.server.requests))
+        request_line, body = self.server.requests[0]
+        self.assertEqual(b"POST /treat HTTP/1.1\r\n", request_line)
+        self.assertEqual({"portion": 2, "count": 1}, body)
+        self.assertEqual(["in-flight", "ok"] * 3, self.blinker.shown)
+
+    @run_until_complete
+    async def test_reconnects_when_server_closes_connection(self):
+        self.server.mode = "close"
+
+        async def presses():
+            first = await self.client.treat()
+            # server has closed the connection by now, client does not use it after keepalive
+            await asyncio.sleep(0.05)
+            return first, await self.client.treat()
+
+        self.assertEqual((True, True), await self._run(presses()))
+        self.assertEqual(2, self.server.connections)
+        self.assertEqual(2, len(self.server.requests))
+
+    @run_until_complete
+    async def test_written_request_is_not_sent_again(self):
+        async def presses():
+            await self.client.send()
+            # server takes the next request, but the connection breaks before the response
+            self.server.mode = "drop"
+            await self.client.send()
+
+        with self.assertRaises(EOFError):
+            await self._run(presses())
+
+        # THEN: it is not repeated, as it may have been dispensed
+        self.assertEqual(1, self.server.connections)
+        self.assertEqual(2, len(self.server.requests))
+        self.assertFalse(self.client.http.connected)
+
+    @run_until_complete
+    async def test_connect_timeout_is_safe_to_repeat(self):
+        async def hang():
+            await asyncio.sleep(1)
+
+        self.client.http._connect = hang
+        with self.assertRaises(dispenser_client.RetryLater):
+            await self.client.send()
+
+    @run_until_complete
+    async def test_timeout(self):
+        self.server.mode = "hang"
+        self.assertFalse(await self._run(self.client.treat()))
+        self.assertEqual(["in-flight", "error"], self.blinker.shown)
+        self.assertFalse(self.client.http.connected)
+        self.assertFalse(self.client.in_progress)
+
+    @run_until_complete
+    async def test_error_status(self):
+        self.server.mode = "error"
+        self.assertFalse(await self._run(self.client.treat()))
+        self.assertEqual(["in-flight", "error"], self.blinker.shown)
+
+    @run_until_complete
+    async def test_dispenser_down(self):
+        self.assertFalse(await self.client.treat())
+        self.assertIsNone(self.client.http._ip)
+
+        self.assertTrue(await self._run(self.client.treat()))
+
+    @run_until_complete
+    async def test_failures_safe_to_repeat(self):
+        # dispenser is down - request has not been sent at all
+        with self.assertRaises(dispenser_client.RetryLater):
+            await self.client.send()
+
+        # dispenser is busy
+        self.server.mode = "busy"
+        with self.assertRaises(dispenser_client.RetryLater):
+            await self._run(self.client.send(count=2))
+        self.assertEqual(self.server.requests[0][1], {"portion": 2, "count": 2})
+
+    @run_until_complete
+    async def test_one_request_at_a_time(self):
+        async def presses():
+            return await asyncio.gather(self.client.treat(), self.client.treat())
+
+        self.assertEqual([True, False], list(await self._run(presses())))
+        self.assertEqual(1, len(self.server.requests))
+
+
+class TracingTestCase(unittest.TestCase):
+    """ client with tracer, which logs into self.handler """
+
+    def setUp(self):
+        self.handler = ListHandler()
+        tracing.logger.setLevel(logging.INFO)
+        tracing.logger.addHandler(self.handler)
+        tracing.logger.propagate = False
+
+        self.stdlib = common.StdlibStub(config=None)
+        self.tracer = tracing.Tracer(clock=self.stdlib, side="button")
+        self.blinker = BlinkerStub()
+        self.client = DispenserClient(config=self.config, blinker=self.blinker, stdlib=self.stdlib,
+                                      tracer=self.tracer)
+
+    def tearDown(self):
+        tracing.logger.handlers.remove(self.handler)
+
+
+class TestTracedRequest(TracingTestCase):
+    config = ConfigStub()
+
+    @run_until_complete
+    async def test_trace_id_is_sent(self):
+        self.server = DispenserServerStub()
+        await self.server.start()
+        try:
+            # WHEN: traced press and one with no trace are sent
+            self.stdlib.total_slept = 1
+            self.tracer.span("0000abcd", "press", 999000)
+            self.assertTrue(await self.client.treat(trace="0000abcd"))
+            self.assertTrue(await self.client.treat())
+            self.assertTrue(await self.client.treat(trace="0000abce"))
+        finally:
+            await self.client.http.close()
+            await self.server.stop()
+
+        # THEN: dispenser got trace ids of the traced ones, and the traces are finished. The
+        # first one opened the connection, the other one reused it
+        self.assertEqual(self.server.trace_ids, ["0000abcd", None, "0000abce"])
+        self.assertEqual(self.handler.messages, [
+            "TRACE 0000abcd button press:999000:1000 connect:1000000:0 request:1000000:0",
+            "TRACE 0000abce button request:1000000:0",
+        ])
+
+    @run_until_complete
+    async def test_failed_request_is_finished(self):
+        self.assertFalse(await self.client.treat(trace="0000abcd"))
+        self.assertEqual(self.handler.messages, ["TRACE 0000abcd button connect:0:0 request:0:0"])
+
+
+class DatagramDispenserStub:
+    """ answers treat datagrams with `status`, after ignoring the first `drop` of them """
+
+    def __init__(self, drop=0, status=0):
+        self.drop = drop
+        self.status = status
+        self.received = []
+        self.traces = []  # trace ids, which followed requests
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", UDP_PORT))
+        self.sock.setblocking(False)
+
+    async def serve(self):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(64)
+            except OSError:
+                await asyncio.sleep(0.001)
+                continue
+
+            size = struct.calcsize(dispenser_client.UDP_TREAT)
+            magic, seq, portion, count = struct.unpack(dispenser_client.UDP_TREAT, data[:size])
+            self.received.append((magic, seq, portion, count))
+            self.traces.append(struct.unpack(dispenser_client.UDP_TRACE, data[size:])[0] if data[size:] else None)
+            if self.drop:
+                self.drop -= 1
+                continue
+            # ack of some earlier request, which came late, goes first
+            self.sock.sendto(struct.pack(dispenser_client.UDP_ACK, b"TA", seq - 1, 0), addr)
+            self.sock.sendto(struct.pack(dispenser_client.UDP_ACK, b"TA", seq, self.status), addr)
+
+
+class TestDatagramTreat(unittest.TestCase):
+
+    def setUp(self):
+        self.blinker = BlinkerStub()
+        self.client = DispenserClient(config=UDPConfigStub(), blinker=self.blinker)
+
+    async def _run(self, dispenser, coro):
+        task = asyncio.create_task(dispenser.serve())
+        try:
+            return await coro
+        finally:
+            task.cancel()
+            dispenser.sock.close()
+            self.client.udp.close()
+
+    @run_until_complete
+    async def test_treat(self):
+        dispenser = DatagramDispenserStub()
+
+        async def presses():
+            return [await self.client.treat() for _ in range(2)]
+
+        self.assertEqual([True, True], await self._run(dispenser, presses()))
+        self.assertEqual(2, len(dispenser.received))
+        (magic, seq1, portion, count), (_, seq2, _, _) = dispenser.received
+        self.assertEqual((b"TQ", 2, 1), (magic, portion, count))
+        self.assertEqual(seq1 + 1, seq2)
+        self.assertEqual(["in-flight", "ok"] * 2, self.blinker.shown)
+
+    @run_until_complete
+    async def test_lost_datagrams_are_sent_again(self):
+        dispenser = DatagramDispenserStub(drop=2)
+
+        self.assertTrue(await self._run(dispenser, self.client.treat()))
+
+        # the same request, three times
+        self.assertEqual(3, len(dispenser.received))
+        self.assertEqual(1, len(set(dispenser.received)))
+
+    @run_until_complete
+    async def test_no_ack(self):
+        dispenser = DatagramDispenserStub(drop=100)
+
+        self.assertFalse(await self._run(dispenser, self.client.treat()))
+        self.assertEqual(1 + UDPConfigStub.UDP_RETRIES, len(dispenser.received))
+        self.assertEqual(["in-flight", "error"], self.blinker.shown)
+
+    @run_until_complete
+    async def test_busy(self):
+        dispenser = DatagramDispenserStub(status=1)
+
+        with self.assertRaises(dispenser_client.RetryLater):
+            await self._run(dispenser, self.client.send())
+        self.assertEqual(1, len(dispenser.received))
+        self.assertEqual(["in-flight", "error"], self.blinker.shown)
+
+    @run_until_complete
+    async def test_repeated_request_keeps_sequence_number(self):
+        dispenser = DatagramDispenserStub(drop=4)
+
+        async def send_twice():
+            request_id = self.client.new_request_id()
+            with self.assertRaises(dispenser_client.RetryLater):
+                await self.client.send(3, request_id)
+            await self.client.send(3, request_id)
+
+        await self._run(dispenser, send_twice())
+
+        # THEN: dispenser got the same request each time, so it dispenses it only once
+        self.assertEqual(5, len(dispenser.received))
+        self.assertEqual(1, len(set(dispenser.received)))
+
+
+class TestTracedDatagram(TracingTestCase):
+    config = UDPConfigStub()
+
+    @run_until_complete
+    async def test_trace_id_follows_request(self):
+        dispenser = DatagramDispenserStub(drop=1)
+        task = asyncio.create_task(dispenser.serve())
+        try:
+            self.assertTrue(await self.client.treat(trace="0000abcd"))
+        finally:
+            task.cancel()
+            dispenser.sock.close()
+            self.client.udp.close()
+
+        # THEN: retransmit carries the trace id as well
+        self.assertEqual(dispenser.traces, [0xabcd, 0xabcd])
+        self.assertEqual(len(self.handler.messages), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+import logging
+import unittest
+
+from . import common
+
+import logfilter
+from logfilter import LogLimiter
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        if hasattr(record, "getMessage"):  # CPython formats the message in handler
+            self.messages.append(record.getMessage())
+        else:
+            self.messages.append(record.message)
+
+
+class Formatted:
+    """ argument, which counts how many times it has been put into message """
+    def __init__(self):
+        self.formatted = 0
+
+    def __str__(self):
+        self.formatted += 1
+        return "arg"
+
+
+class TestLogLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = common.StdlibStub(config=None)
+        self.limiter = LogLimiter(clock=self.clock, repeat_interval=10, rate=2, burst=3)
+        self.limiter.install()
+
+        self.handler = ListHandler()
+        self.logger = logging.getLogger("test-limiter")
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.addHandler(self.handler)
+        self.logger.propagate = False
+
+    def tearDown(self):
+        self.limiter.uninstall()
+        self.logger.handlers.remove(self.handler)
+
+    def test_repeated_message(self):
+        arg = Formatted()
+
+        # WHEN: the same message is logged over and over
+        for i in range(5):
+            self.logger.debug("still waiting, %s", arg)
+            self.clock.total_slept += 1
+
+        # THEN: it is logged once, the others are not even formatted
+        self.assertEqual(self.handler.messages, ["still waiting, arg"])
+        self.assertEqual(arg.formatted, 1)
+
+        # WHEN: other message comes, repeats are told before it
+        self.logger.info("done")
+        self.assertEqual(self.handler.messages, ["still waiting, arg", "last message repeated 4 times", "done"])
+
+    def test_repeated_after_interval(self):
+        self.logger.debug("still waiting")
+        self.clock.total_slept += 5
+        self.logger.debug("still waiting")
+        self.clock.total_slept += 6
+
+        # WHEN: the message comes again after repeat interval
+        self.logger.debug("still waiting")
+
+        # THEN: it is logged, with summary of repeats
+        self.assertEqual(self.handler.messages, ["still waiting", "last message repeated 1 times", "still waiting"])
+
+    def test_rate_limit(self):
+        # WHEN: more (different) messages, than fit into a burst, come at once
+        for i in range(5):
+            self.logger.debug("message %s" % i)
+
+        # THEN: the burst is logged only
+        self.assertEqual(self.handler.messages, ["message 0", "message 1", "message 2"])
+
+        # WHEN: after a second (two more tokens), other messages come
+        self.clock.total_slept += 1
+        self.logger.debug("next")
+        self.logger.debug("after next")
+        self.logger.debug("dropped")
+
+        # THEN: they are logged, after the count of dropped ones
+        self.assertEqual(self.handler.messages[3:], ["2 messages dropped by rate limit", "next", "after next"])
+
+    def test_errors_are_not_dropped(self):
+        for i in range(5):
+            self.logger.error("failed")
+        self.assertEqual(self.handler.messages, ["failed"] * 5)
+
+    def test_disabled_level_takes_no_token(self):
+        self.logger.setLevel(logging.INFO)
+        for i in range(5):
+            self.logger.debug("message %s" % i)
+        self.logger.info("info")
+        self.assertEqual(self.handler.messages, ["info"])
+
+
+class TestMute(unittest.TestCase):
+
+    def setUp(self):
+        self.root = logging.getLogger()
+        self.root_level = self.root.level
+        self.root.setLevel(logging.INFO)
+
+        self.handler = ListHandler()
+        self.logger = logging.getLogger("test-mute")
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.addHandler(self.handler)
+        self.logger.propagate = False
+        self.mute = logfilter.Mute()
+
+    def tearDown(self):
+        self.mute.unmute()
+        self.root.setLevel(self.root_level)
+        self.logger.handlers.remove(self.handler)
+
+    def test_disabled_levels_are_muted(self):
+        arg = Formatted()
+        quiet = logging.getLogger("test-mute.quiet")
+        quiet.setLevel(logging.WARNING)
+        quiet.addHandler(self.handler)
+        quiet.propagate = False
+
+        self.mute.mute()
+        quiet.debug("muted %s", arg)
+        quiet.info("muted %s", arg)
+        quiet.warning("logged")
+        self.logger.debug("enabled %s", arg)
+        quiet.handlers.remove(self.handler)
+
+        # THEN: calls of disabled levels did nothing at all
+        self.assertEqual(self.handler.messages, ["logged", "enabled arg"])
+        self.assertEqual(arg.formatted, 1)
+        self.assertIs(logging.debug, logfilter._muted)  # root logs from INFO
+
+        # WHEN: unmuted, methods are back
+        self.mute.unmute()
+        self.assertIsNot(logging.debug, logfilter._muted)
+        self.root.setLevel(logging.DEBUG)
+        quiet.setLevel(logging.DEBUG)
+        quiet.addHandler(self.handler)
+        quiet.debug("back")
+        quiet.handlers.remove(self.handler)
+        self.assertEqual(self.handler.messages[-1], "back")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,309 @@
+import os
+import unittest
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio  # type: ignore
+
+from .utils import run_until_complete
+
+from logging_handlers import RingFile, RingFileHandler, RotatingFileHandler, RSyslogFileHandler, get_filesize, \
+    try_remove
+
+
+FILENAME = "test-log.log"
+
+
+class RecordStub:
+    def __init__(self, message, levelname="DEBUG", levelno=10):
+        self.message = message
+        self.levelname = levelname
+        self.levelno = levelno
+        self.name = "test"
+
+
+def file_lines(fn=FILENAME):
+    try:
+        with open(fn) as f:
+            return f.read().splitlines()
+    except OSError:
+        return []
+
+
+class TestRotatingFileHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.remove_files()
+        self.handlers = []
+
+    def tearDown(self):
+        for handler in self.handlers:
+            if handler._timer:
+                handler._timer.cancel()
+        self.remove_files()
+
+    def remove_files(self):
+        for fn in [FILENAME, FILENAME + ".1", FILENAME + ".2"]:
+            try_remove(fn)
+
+    def handler(self, **kwargs):
+        handler = RotatingFileHandler(FILENAME, **kwargs)
+        self.handlers.append(handler)
+        return handler
+
+    def test_unbuffered(self):
+        handler = self.handler()
+        handler.emit(RecordStub("one"))
+        self.assertEqual(file_lines(), ["DEBUG: one"])
+
+    def test_written_when_buffer_is_full(self):
+        handler = self.handler(bufferSize=30)
+
+        # WHEN: records, which do not fill the buffer, come
+        handler.emit(RecordStub("one"))
+        handler.emit(RecordStub("two"))
+
+        # THEN: nothing is written yet
+        self.assertFalse(file_lines())
+
+        # WHEN: buffer gets full
+        handler.emit(RecordStub("three"))
+
+        # THEN: all of the records are written
+        self.assertEqual(file_lines(), ["DEBUG: one", "DEBUG: two", "DEBUG: three"])
+
+    def test_error_is_written_right_away(self):
+        handler = self.handler(bufferSize=1024)
+        handler.emit(RecordStub("one"))
+        handler.emit(RecordStub("two", "ERROR", 40))
+        self.assertEqual(file_lines(), ["DEBUG: one", "ERROR: two"])
+
+    @run_until_complete
+    async def test_written_after_flush_interval(self):
+        handler = self.handler(bufferSize=1024, flushInterval=0.01)
+        handler.emit(RecordStub("one"))
+        await asyncio.sleep(0)
+        handler.emit(RecordStub("two"))
+        self.assertFalse(file_lines())
+
+        await asyncio.sleep(0.05)
+        self.assertEqual(file_lines(), ["DEBUG: one", "DEBUG: two"])
+        self.assertIsNone(handler._timer)
+
+    def test_rotation(self):
+        # GIVEN: log file, which is almost full already
+        with open(FILENAME, "w") as f:
+            f.write("DEBUG: old\n")
+        handler = self.handler(maxBytes=24, backupCount=2, bufferSize=1024)
+
+        # WHEN: records, which are more than the file can take, are buffered
+        for message in ["a", "b", "c", "d"]:
+            handler.emit(RecordStub(message))
+        handler.flush()
+
+        # THEN: every file is filled up to maxBytes (newline counted), not more
+        self.assertEqual(file_lines(FILENAME + ".2"), ["DEBUG: old", "DEBUG: a"])
+        self.assertEqual(file_lines(FILENAME + ".1"), ["DEBUG: b", "DEBUG: c"])
+        self.assertEqual(file_lines(), ["DEBUG: d"])
+        self.assertEqual(get_filesize(FILENAME + ".1"), 18)
+
+        # ... and the size of file is known to the handler
+        self.assertEqual(handler._counter, get_filesize(FILENAME))
+
+    def test_flush_without_records(self):
+        handler = self.handler(bufferSize=1024)
+        handler.flush()
+        self.assertFalse(FILENAME in os.listdir())
+
+    def test_lines_and_clear(self):
+        handler = self.handler(bufferSize=1024)
+        handler.emit(RecordStub("one"))
+        self.assertEqual(list(handler.lines()), ["DEBUG: one"])
+
+        handler.clear()
+        self.assertEqual(list(handler.lines()), [])
+        self.assertEqual(handler._counter, 0)
+
+
+class TestRingFile(unittest.TestCase):
+    SIZE = 12 + 20  # header and 20 bytes for records
+
+    def setUp(self):
+        try_remove(FILENAME)
+        self.rings = []
+
+    def tearDown(self):
+        for ring in self.rings:
+            ring.close()
+        try_remove(FILENAME)
+
+    def ring(self, size=SIZE):
+        ring = RingFile(FILENAME, size)
+        self.rings.append(ring)
+        return ring
+
+    def test_preallocated(self):
+        ring = self.ring()
+        self.assertEqual(list(ring.records()), [])
+        self.assertEqual(get_filesize(FILENAME), self.SIZE)
+
+    def test_oldest_are_overwritten(self):
+        ring = self.ring()
+
+        # WHEN: more is appended than the ring can take, wrapping over the end of file
+        for record in [b"one", b"two", b"three", b"four", b"five", b"six"]:
+            ring.append([record])
+
+        # THEN: the newest records are kept, in order, and the file has not grown
+        self.assertEqual(list(ring.records()), [b"four", b"five", b"six"])
+        self.assertEqual(get_filesize(FILENAME), self.SIZE)
+
+    def test_survives_reopening(self):
+        self.ring().append([b"one", b"two"])
+        self.rings.pop().close()
+
+        ring = self.ring()
+        ring.append([b"three"])
+        self.assertEqual(list(ring.records()), [b"one", b"two", b"three"])
+
+        # WHEN: it is cleared
+        ring.clear()
+        self.assertEqual(list(ring.records()), [])
+
+    def test_too_long(self):
+        ring = self.ring()
+        ring.append([b"one"])
+
+        # WHEN: batch longer than the ring comes, the newest records, which fit, are kept
+        ring.append([b"a" * 10, b"b" * 8, b"c" * 6])
+        self.assertEqual(list(ring.records()), [b"b" * 8, b"c" * 6])
+
+        # ... and too long record is cut
+        ring.append([b"d" * 30])
+        self.assertEqual(list(ring.records()), [b"d" * 17])
+
+    def test_other_file_is_replaced(self):
+        with open(FILENAME, "w") as f:
+            f.write("DEBUG: plain text log\n")
+
+        ring = self.ring()
+        self.assertEqual(list(ring.records()), [])
+        self.assertEqual(get_filesize(FILENAME), self.SIZE)
+
+        # ... as well as ring of other size
+        self.rings.pop().close()
+        self.ring(size=64)
+        self.assertEqual(get_filesize(FILENAME), 64)
+
+    def test_handler(self):
+        handler = RingFileHandler(FILENAME, 12 + 30, bufferSize=1024)
+        self.rings.append(handler.ring)
+        handler.emit(RecordStub("one"))
+        handler.emit(RecordStub("two", "ERROR", 40))
+        handler.emit(RecordStub("three"))
+
+        # THEN: lines of one flush are written at once
+        self.assertEqual(list(handler.ring.records()), [b"DEBUG: one", b"ERROR: two"])
+        self.assertEqual(list(handler.lines()), ["ERROR: two", "DEBUG: three"])
+
+        handler.clear()
+        self.assertEqual(list(handler.lines()), [])
+
+
+class UsyslogStub:
+    S_ERR = 3
+    S_WARN = 4
+    S_INFO = 6
+    S_DEBUG = 7
+
+
+class UDPClientStub:
+    def __init__(self):
+        self.datagrams = []  # (severity, message)
+
+    def log(self, severity, message):
+        self.datagrams.append((severity, message))
+
+
+class RSyslogHandlerStub(RSyslogFileHandler):
+    """ with udp client, which can be created once `network_up` is set """
+    def __init__(self, **kwargs):
+        super().__init__(FILENAME, maxBytes=0, backupCount=0, remote_addr="127.0.0.1", identifier="b1", **kwargs)
+        self.network_up = False
+        self.client = UDPClientStub()
+
+    def init_rsyslog(self):
+        if self.network_up:
+            self.lus = UsyslogStub
+            self.udp_client = self.client
+
+
+class TestRSyslogFileHandler(unittest.TestCase):
+
+    def setUp(self):
+        try_remove(FILENAME)
+        self.handler = RSyslogHandlerStub(datagramSize=60, queueSize=3)
+
+    def tearDown(self):
+        if self.handler._task:
+            self.handler._task.cancel()
+        try_remove(FILENAME)
+
+    async def settle(self):
+        for _ in range(10):
+            await asyncio.sleep(0)
+
+    def lines(self):
+        return [line for _, message in self.handler.client.datagrams for line in message.split("\n")]
+
+    @run_until_complete
+    async def test_file_is_sent_when_network_comes_up(self):
+        # GIVEN: records logged with no network
+        self.handler.emit(RecordStub("one"))
+        self.handler.emit(RecordStub("two"))
+        await self.settle()
+
+        # WHEN: network comes up, and another record is logged
+        self.handler.network_up = True
+        self.handler.emit(RecordStub("three"))
+
+        # THEN: it is not sent from emit, but in background
+        self.assertEqual(self.handler.client.datagrams, [])
+        await self.settle()
+
+        # ... the file is sent, every record once, several in one datagram
+        self.assertEqual(self.lines(), ["---- flushing file %s ----" % FILENAME,
+                                        "b1: DEBUG: one", "b1: DEBUG: two", "b1: DEBUG: three",
+                                        "---- end of flush, %s removed ----" % FILENAME])
+        self.assertEqual(len(self.handler.client.datagrams), 3)
+        for _, message in self.handler.client.datagrams:
+            self.assertLessEqual(len(message), 60)
+
+        # WHEN: more records come, they are sent in one datagram, of the most severe level
+        self.handler.client.datagrams = []
+        self.handler.emit(RecordStub("four"))
+        self.handler.emit(RecordStub("five", "ERROR", 40))
+        await self.settle()
+        self.assertEqual(self.handler.client.datagrams, [(3, "b1: DEBUG: four\nb1: ERROR: five")])
+
+    @run_until_complete
+    async def test_oldest_are_dropped_when_queue_is_full(self):
+        self.handler.network_up = True
+        self.handler.emit(RecordStub("zero"))
+        await self.settle()
+        self.handler.client.datagrams = []
+
+        # WHEN: more records come at once, than the queue takes
+        for message in ["one", "two", "three", "four"]:
+            self.handler.emit(RecordStub(message))
+        await self.settle()
+
+        # THEN: the oldest is dropped, and it is told
+        self.assertEqual(self.lines(), ["b1: WARNING: 1 log records dropped",
+                                        "b1: DEBUG: two", "b1: DEBUG: three", "b1: DEBUG: four"])
+        self.assertEqual(self.handler.dropped, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
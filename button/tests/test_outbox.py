@@ -0,0 +1,274 @@
+import os
+import unittest
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio  # type: ignore
+
+from . import common
+from .utils import run_until_complete
+
+from dispenser_client import RetryLater
+from outbox import Outbox
+from tracing import Tracer
+
+
+class ConfigStub:
+    OUTBOX_FILE = "test-outbox.txt"
+    OUTBOX_CAPACITY = 2
+    OUTBOX_MAX_COUNT = 3
+    OUTBOX_BACKOFF = 1
+    OUTBOX_MAX_BACKOFF = 3
+
+
+class StdlibStub(common.StdlibStub):
+    def __init__(self, *, config):
+        super().__init__(config=config)
+        self.delays = []
+
+    async def sleep(self, seconds: float):
+        await super().sleep(seconds)
+        self.delays.append(seconds)
+        await asyncio.sleep(0)
+
+
+class ClientStub:
+    """ answers send() with prepared `results` - None is success, exception is raised.
+    Every send waits until `gate` is set, with `step` the gate closes after each send """
+
+    def __init__(self, results=(), step=False):
+        self.results = list(results)
+        self.step = step
+        self.sent = []  # (count, request_id)
+        self.traces = []
+        self.gate = asyncio.Event()
+        self.gate.set()
+        self.request_id = 100
+
+    def new_request_id(self):
+        self.request_id += 1
+        return self.request_id
+
+    async def send(self, count, request_id, trace=None):
+        await self.gate.wait()
+        if self.step:
+            self.gate.clear()
+        self.sent.append((count, request_id))
+        self.traces.append(trace)
+        result = self.results.pop(0) if self.results else None
+        if result is not None:
+            raise result
+
+
+def file_lines():
+    try:
+        with open(ConfigStub.OUTBOX_FILE) as f:
+            return f.read().splitlines()
+    except OSError:
+        return []
+
+
+class TestOutbox(unittest.TestCase):
+
+    def setUp(self):
+        self.remove_file()
+        self.stdlib = StdlibStub(config=ConfigStub())
+        self.outboxes = []
+
+    def tearDown(self):
+        for outbox in self.outboxes:
+            if outbox._task:
+                outbox._task.cancel()
+        self.remove_file()
+
+    def remove_file(self):
+        try:
+            os.remove(ConfigStub.OUTBOX_FILE)
+        except OSError:
+            pass
+
+    def outbox(self, client, tracer=None):
+        outbox = Outbox(config=ConfigStub(), client=client, stdlib=self.stdlib, tracer=tracer)
+        self.outboxes.append(outbox)
+        return outbox
+
+    async def drain(self, outbox):
+        for _ in range(100):
+            if not outbox.entries:
+                return
+            await asyncio.sleep(0)
+        raise AssertionError("outbox has not been drained")
+
+    @run_until_complete
+    async def test_adjacent_presses_are_coalesced(self):
+        client = ClientStub()
+        client.gate.clear()
+        outbox = self.outbox(client)
+
+        # WHEN: button is pressed, and then three more times, while the first press is being sent
+        self.assertTrue(await outbox.treat())
+        await asyncio.sleep(0)
+        for _ in range(3):
+            self.assertTrue(await outbox.treat())
+        client.gate.set()
+        await self.drain(outbox)
+
+        # THEN: the later presses went together, in one request
+        self.assertEqual(client.sent, [(1, 101), (3, 102)])
+
+        # ... and outbox file is gone, as there is nothing left
+        self.assertEqual(file_lines(), [])
+
+    @run_until_complete
+    async def test_traces(self):
+        client = ClientStub([RetryLater("down")])
+        client.gate.clear()
+        tracer = Tracer(clock=self.stdlib, side="button")
+        outbox = self.outbox(client, tracer)
+
+        async def press(trace):
+            tracer.span(trace, "press", 0)
+            return await outbox.treat(trace=trace)
+
+        # WHEN: presses come while the first one is being sent, till the outbox is full
+        await press("t1")
+        await asyncio.sleep(0)
+        for trace in ["t2", "t3", "t4"]:
+            self.assertTrue(await press(trace))
+        self.assertFalse(await press("t5"))
+
+        # THEN: traces of presses coalesced into other entry, or dropped, are finished
+        self.assertEqual(list(tracer.traces), ["t1", "t2"])
+
+        # ... the others go with their requests, and are finished once they are done
+        client.gate.set()
+        await self.drain(outbox)
+        self.assertEqual(client.traces, ["t1", "t1", "t2"])
+        self.assertEqual(tracer.traces, {})
+
+    @run_until_complete
+    async def test_capacity(self):
+        client = ClientStub()
+        client.gate.clear()
+        outbox = self.outbox(client)
+
+        await outbox.treat()
+        await asyncio.sleep(0)
+        for _ in range(3):
+            self.assertTrue(await outbox.treat())
+
+        # WHEN: outbox has no room for another press (and the last request takes no more)
+        self.assertFalse(await outbox.treat())
+
+        # THEN: the press is dropped
+        client.gate.set()
+        await self.drain(outbox)
+        self.assertEqual(client.sent, [(1, 101), (3, 102)])
+
+    @run_until_complete
+    async def test_retry_with_backoff(self):
+        # GIVEN: dispenser, which is not reachable for a while
+        client = ClientStub([RetryLater("down")] * 3)
+        outbox = self.outbox(client)
+
+        await outbox.treat()
+        await self.drain(outbox)
+
+        # THEN: the same request (same request id) has been sent until it succeeded
+        self.assertEqual(client.sent, [(1, 101)] * 4)
+
+        # ... with waiting doubled (up to max) after every failure, shortened by random jitter
+        for delay, backoff in zip(self.stdlib.delays, [1, 2, 3]):
+            self.assertTrue(backoff / 2 <= delay <= backoff, msg="%s not in %s/2..%s" % (delay, backoff, backoff))
+        self.assertEqual(len(self.stdlib.delays), 3)
+
+    @run_until_complete
+    async def test_busy_dispenser_gets_the_same_request(self):
+        # GIVEN: dispenser with full treat queue, which answers busy (over udp) and then takes it
+        client = ClientStub([RetryLater("busy")])
+        client.gate.clear()
+        outbox = self.outbox(client)
+
+        # WHEN: press is sent, and another one comes while it waits for the retry
+        await outbox.treat()
+        await asyncio.sleep(0)
+        await outbox.treat()
+        client.gate.set()
+        await self.drain(outbox)
+
+        # THEN: the refused request went again after one backoff, under its request id (the
+        # dispenser does not remember refused ones, so it is not taken for a retransmit)
+        self.assertEqual(client.sent, [(1, 101), (1, 101), (1, 102)])
+        self.assertEqual(len(self.stdlib.delays), 1)
+        self.assertEqual(file_lines(), [])
+
+    @run_until_complete
+    async def test_unknown_result_is_not_repeated(self):
+        # GIVEN: request, which failed in a way, which does not tell if it was dispensed
+        client = ClientStub([OSError("timeout"), None])
+        outbox = self.outbox(client)
+        client.gate.clear()
+
+        await outbox.treat()
+        await asyncio.sleep(0)
+        await outbox.treat()
+        client.gate.set()
+        await self.drain(outbox)
+
+        # THEN: it is not sent again (not to dispense twice), the next press goes on
+        self.assertEqual(client.sent, [(1, 101), (1, 102)])
+        self.assertEqual(self.stdlib.delays, [])
+
+    def test_pending_presses_survive_reboot(self):
+        # GIVEN: presses recorded, but board rebooted before sending them
+        outbox = Outbox(config=ConfigStub(), client=ClientStub(), stdlib=self.stdlib)
+        outbox.entries = [[1, 2, False, None, None]]
+        outbox._next_id = 2
+        outbox._rewrite()
+        outbox._append("C 1 3")
+        outbox._append("A 2 1")
+
+        # WHEN: outbox is loaded after reboot
+        outbox = self.outbox(ClientStub())
+
+        # THEN: presses are waiting to be sent
+        self.assertEqual(outbox.entries, [[1, 3, False, None, None], [2, 1, False, None, None]])
+        self.assertEqual(file_lines(), ["A 1 3", "A 2 1"])
+
+    def test_entry_being_sent_on_reboot_is_dropped(self):
+        with open(ConfigStub.OUTBOX_FILE, "w") as f:
+            f.write("A 1 1\nS 1\nA 2 2\nA 3 1\nD 3\nbroken\nC 7 1\nA 4")
+
+        outbox = self.outbox(ClientStub())
+
+        # THEN: entry 1 may have been dispensed already, so it is not sent again
+        self.assertEqual(outbox.entries, [[2, 2, False, None, None]])
+        self.assertEqual(outbox._next_id, 4)
+        self.assertEqual(file_lines(), ["A 2 2"])
+
+    @run_until_complete
+    async def test_file_is_appended(self):
+        client = ClientStub(step=True)
+        client.gate.clear()
+        outbox = self.outbox(client)
+
+        await outbox.treat()
+        await asyncio.sleep(0)
+        await outbox.treat()
+        await outbox.treat()
+
+        self.assertEqual(file_lines(), ["A 1 1", "S 1", "A 2 1", "C 2 2"])
+
+        # WHEN: the first one is sent
+        client.gate.set()
+        for _ in range(3):
+            await asyncio.sleep(0)
+
+        # THEN: it is marked done in file, the next one is being sent
+        self.assertEqual(client.sent, [(1, 101)])
+        self.assertEqual(file_lines(), ["A 1 1", "S 1", "A 2 1", "C 2 2", "D 1", "S 2"])
+
+
+if __name__ == '__main__':
+    unittest.main()
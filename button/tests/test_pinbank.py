@@ -0,0 +1,158 @@
+import os
+import sys
+import unittest
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio  # type: ignore
+
+try:
+    import tempfile
+except ImportError:  # micropython
+    tempfile = None  # type: ignore
+
+try:
+    from machine import PWM, Pin
+except ImportError:  # not on esp32, use stub with its bank of levels
+    sys.path.append("localstubs")
+    from machine import PWM, Pin
+
+import pinbank
+from pinbank import PinBank
+
+from .utils import run_until_complete
+
+
+def bank_file():
+    """ new empty file for a bank - never the default one, which the running app may use """
+    if tempfile is None:
+        return "test-pinbank.bin"
+    fd, path = tempfile.mkstemp(suffix=".pinbank")
+    os.close(fd)
+    return path
+
+
+def use_temp_bank():
+    """ machine stub reads and writes levels in bank of its own, returns the bank """
+    bank = PinBank(bank_file())
+    Pin.use_bank(bank)
+    return bank
+
+
+def remove_temp_bank(bank):
+    Pin.reset()
+    Pin.use_bank(None)
+    bank.close()
+    os.remove(bank.path)
+
+
+class TestPinBank(unittest.TestCase):
+
+    def setUp(self):
+        self.path = bank_file()
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_levels_are_shared(self):
+        app_side = PinBank(self.path, size=16)
+        harness = PinBank(self.path, size=16)
+
+        # WHEN: harness sets levels
+        harness.set(15, 1)
+        harness.set(0, 1)
+        harness.set(0, 0)
+
+        # THEN: the other side reads them at once, with the edges
+        self.assertEqual([app_side.get(pin) for pin in (0, 1, 15)], [0, 0, 1])
+        self.assertEqual([app_side.edges(pin) for pin in (0, 1, 15)], [2, 0, 1])
+        app_side.close()
+        harness.close()
+        self.assertEqual(os.stat(self.path)[6], 4 * 16)
+
+    def test_same_level_is_no_edge(self):
+        bank = PinBank(self.path)
+        bank.set(4, 1)
+        bank.set(4, 1)
+        self.assertEqual((bank.get(4), bank.edges(4)), (1, 1))
+        bank.close()
+
+    def test_without_mmap(self):
+        mapped = PinBank(self.path)
+        saved, pinbank.mmap = pinbank.mmap, None
+        try:
+            kept_open = PinBank(self.path)
+        finally:
+            pinbank.mmap = saved
+
+        # THEN: bank with file kept open reads and writes the same levels
+        kept_open.set(2, 1)
+        self.assertEqual(mapped.get(2), 1)
+        mapped.set(3, 1)
+        self.assertEqual(kept_open.get(3), 1)
+        self.assertEqual(kept_open.edges(3), 1)
+        mapped.close()
+        kept_open.close()
+
+
+class TestPinStub(unittest.TestCase):
+
+    def setUp(self):
+        Pin.reset()
+        self.bank = use_temp_bank()
+
+    def tearDown(self):
+        remove_temp_bank(self.bank)
+
+    def test_level_from_bank(self):
+        pin = Pin(15, Pin.IN)
+        self.bank.set(15, 1)
+        self.assertEqual(pin.value(), 1)
+
+        # THEN: injected level takes precedence
+        Pin.inject(15, 0)
+        self.assertEqual(pin.value(), 0)
+
+    def test_edges_from_bank(self):
+        pin = Pin(15, Pin.IN)
+        presses = []
+        pin.irq(handler=presses.append, trigger=Pin.IRQ_FALLING)
+
+        # WHEN: harness presses and releases the button, faster than the pin is polled
+        for i in range(100):
+            self.bank.set(15, 1)
+            self.bank.set(15, 0)
+            if i % 10 == 0:
+                Pin.poll()
+        Pin.poll()
+
+        # THEN: every falling edge went to the handler, none of the rising ones
+        self.assertEqual(len(presses), 100)
+
+    @run_until_complete
+    async def test_edges_are_polled(self):
+        pin = Pin(15, Pin.IN)
+        edges = []
+        pin.irq(handler=edges.append)
+
+        # WHEN: harness presses the button while the event loop runs
+        self.bank.set(15, 1)
+        self.bank.set(15, 0)
+        await asyncio.sleep(0.05)
+
+        # THEN: irq handler has been called from the poller
+        self.assertEqual(edges, [pin, pin])
+
+    def test_outputs_in_bank(self):
+        Pin(4, Pin.OUT).value(1)
+        led = PWM(Pin(2, Pin.OUT), freq=1000, duty=0)
+        led.duty(511)
+        self.assertEqual((self.bank.get(4), self.bank.get(2)), (1, 1))
+
+        led.duty(0)
+        self.assertEqual(self.bank.get(2), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
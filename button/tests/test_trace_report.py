@@ -0,0 +1,40 @@
+import importlib.util
+import io
+import unittest
+
+# utils/trace-report.py is a script, not a module - cpython only, it runs on the developer's
+# machine
+spec = importlib.util.spec_from_file_location("trace_report", "utils/trace-report.py")
+trace_report = importlib.util.module_from_spec(spec)  # type: ignore
+spec.loader.exec_module(trace_report)  # type: ignore
+
+LOG = [
+    "INFO:trace:TRACE 0000abcd button press:1000:520 connect:1600:3000 request:1520:6000\n",
+    "<14>dispenser TRACE 0000abcd dispenser http:90000:2000 queue:92000:100 motor:92100:400000\n",
+    "some other record\n",
+]
+
+
+class TestTraceReport(unittest.TestCase):
+
+    def test_timeline(self):
+        spans = trace_report.timeline(trace_report.parse(LOG)["0000abcd"])
+
+        # THEN: spans start from the first one, the dispenser's are aligned to the request
+        self.assertEqual(spans[:3], [("button", "press", 0, 520), ("button", "connect", 600, 3000),
+                                     ("button", "request", 520, 6000)])
+        self.assertEqual(spans[3], ("dispenser", "http", 2520, 2000))
+
+    def test_summary(self):
+        out = io.StringIO()
+        trace_report.report(trace_report.parse(LOG), timelines=False, out=out)
+        lines = out.getvalue().splitlines()
+
+        # THEN: every span is summarized, in the order they happen
+        self.assertEqual([line.split()[0] for line in lines],
+                         ["span", "press", "request", "connect", "http", "queue", "motor", "total"])
+        self.assertEqual(lines[3].split(), ["connect", "1", "3.0", "3.0", "3.0"])
+
+
+if __name__ == '__main__':
+    unittest.main()
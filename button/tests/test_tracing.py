@@ -0,0 +1,63 @@
+import logging
+import unittest
+
+from . import common
+from .test_logfilter import ListHandler
+
+import tracing
+from tracing import Tracer
+
+
+class LockStub:
+    def __init__(self):
+        self.locked = False
+
+    def acquire(self):
+        assert not self.locked
+        self.locked = True
+
+    def release(self):
+        assert self.locked
+        self.locked = False
+
+
+class TestTracer(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = ListHandler()
+        tracing.logger.setLevel(logging.INFO)
+        tracing.logger.addHandler(self.handler)
+        tracing.logger.propagate = False
+        self.clock = common.StdlibStub(config=None)
+
+    def tearDown(self):
+        tracing.logger.handlers.remove(self.handler)
+
+    def test_spans_are_logged_when_finished(self):
+        tracer = Tracer(clock=self.clock, side="button", lock=LockStub())
+        tracer.span("t1", "press", 0, 1500)
+        self.clock.total_slept = 0.002
+        tracer.span("t1", "request", 1500)
+        self.assertEqual(self.handler.messages, [])
+
+        tracer.finish("t1")
+        tracer.finish("t1")  # nothing more to log
+        self.assertEqual(self.handler.messages, ["TRACE t1 button press:0:1500 request:1500:500"])
+        self.assertEqual(tracer.traces, {})
+
+    def test_oldest_is_logged_when_more_come(self):
+        tracer = Tracer(clock=self.clock, side="button", max_traces=2)
+        for trace in ["t1", "t2", "t3"]:
+            tracer.span(trace, "press", 0, 10)
+
+        self.assertEqual(self.handler.messages, ["TRACE t1 button press:0:10"])
+        self.assertEqual(list(tracer.traces), ["t2", "t3"])
+
+    def test_trace_id(self):
+        trace = tracing.new_trace_id()
+        self.assertEqual(len(trace), 8)
+        int(trace, 16)
+
+
+if __name__ == '__main__':
+    unittest.main()
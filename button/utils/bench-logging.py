@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+""" emit throughput of RotatingFileHandler, unbuffered (file opened for every record, as
+before buffering) and with buffers of a few sizes. Runs on host or on board:
+
+    cd button && python3 utils/bench-logging.py
+    mpremote run utils/bench-logging.py  # logging_handlers.py has to be on board
+"""
+import sys
+import time
+
+sys.path.append(".")
+
+from logging_handlers import RotatingFileHandler, try_remove  # noqa: E402
+
+FILENAME = "bench-log.log"
+RECORDS = 500
+
+
+class Record:
+    levelname = "DEBUG"
+    levelno = 10
+    message = "waiting for treat response, 12 ms so far"
+
+
+def now_ms():
+    try:
+        return time.ticks_ms()  # type: ignore
+    except AttributeError:
+        return int(time.time() * 1000)
+
+
+def bench(buffer_size):
+    try_remove(FILENAME)
+    handler = RotatingFileHandler(FILENAME, maxBytes=16 * 1024, backupCount=1, bufferSize=buffer_size)
+    record = Record()
+
+    started = now_ms()
+    for _ in range(RECORDS):
+        handler.emit(record)
+    handler.flush()
+    elapsed = max(now_ms() - started, 1)
+
+    try_remove(FILENAME)
+    try_remove(FILENAME + ".1")
+    return elapsed
+
+
+def main():
+    for buffer_size in [0, 256, 1024, 4096]:
+        elapsed = bench(buffer_size)
+        print("buffer %5d B: %5d ms for %d records, %d records/s" % (
+            buffer_size, elapsed, RECORDS, RECORDS * 1000 // elapsed))
+
+
+if __name__ == "__main__":
+    main()
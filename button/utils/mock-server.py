@@ -1,17 +1,294 @@
 #!/usr/bin/env python3
-from flask import Flask, request, jsonify
+""" mock dispenser, which answers POST /treat as the real one does (see TreatApp.treat of
+the dispenser), keeps connections alive as it does - and misbehaves on demand. Point
+TREAT_URL of a button to it:
 
+    cd button && python3 utils/mock-server.py serve --latency lognormal:20:0.5 --busy-rate 0.1
 
-app = Flask(__name__)
+or benchmark DispenserClient against it, with many buttons sending at once:
 
+    cd button && python3 utils/mock-server.py load --clients 50 --requests 20 --reset-rate 0.02
 
-@app.route("/foo/", methods=['POST'])
-def index():
+Latency of a response (ms) is "fixed:MS", "uniform:LOW:HIGH", "exp:MEAN" or
+"lognormal:MEDIAN:SIGMA". Faults, each with its probability per request:
 
-    print("request=", request.json)
+    --error-rate    500 response
+    --busy-rate     503 with Retry-After, as when treat queue is full
+    --reset-rate    connection reset instead of response (request may have been dispensed)
+    --slow-rate     slow loris - response trickles out, a byte every --slow-interval
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import socket
+import struct
+import sys
+import time
+import types
 
-    return jsonify("ok"), 202
+sys.path.append(".")
 
+from dispenser_client import DispenserClient, RetryLater  # noqa: E402
 
-if __name__ == '__main__':
-    app.run(host="0.0.0.0", port=5060)
+logger = logging.getLogger("mock-server")
+
+MAX_TREAT_COUNT = 5
+KEEPALIVE_TIMEOUT = 5
+PERCENTILES = (50, 95, 99)
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error",
+               503: "Service Unavailable"}
+
+
+def parse_latency(spec):
+    """ "kind:params" (ms) -> function returning latency in seconds """
+    kind, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(":")] if params else []
+    distributions = {
+        "fixed": (1, lambda rng, ms: ms),
+        "uniform": (2, lambda rng, low, high: rng.uniform(low, high)),
+        "exp": (1, lambda rng, mean: rng.expovariate(1 / mean) if mean else 0),
+        "lognormal": (2, lambda rng, median, sigma: rng.lognormvariate(0, sigma) * median),
+    }
+    if kind not in distributions or len(values) != distributions[kind][0]:
+        raise argparse.ArgumentTypeError("latency is fixed:MS, uniform:LOW:HIGH, exp:MEAN or "
+                                         "lognormal:MEDIAN:SIGMA, got %r" % spec)
+    sample = distributions[kind][1]
+    return lambda rng: sample(rng, *values) / 1000
+
+
+def percentile(values, p):
+    """ nearest-rank percentile of sorted values """
+    return values[max(0, -(-len(values) * p // 100) - 1)]
+
+
+class MockDispenser:
+    def __init__(self, *, latency, error_rate=0.0, busy_rate=0.0, reset_rate=0.0, slow_rate=0.0,
+                 slow_interval=0.5, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.busy_rate = busy_rate
+        self.reset_rate = reset_rate
+        self.slow_rate = slow_rate
+        self.slow_interval = slow_interval
+        self.rng = random.Random(seed)
+
+        self.outcomes = {}  # outcome -> count
+        self.dispensed = 0  # portions
+        self.server = None
+
+    async def start(self, host, port):
+        self.server = await asyncio.start_server(self._serve, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    def close(self):
+        self.server.close()
+
+    def _count(self, outcome):
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), KEEPALIVE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                if request is None:
+                    break
+                if not await self._respond(writer, *request):
+                    break
+        except (OSError, ValueError) as e:
+            logger.debug("connection lost: %r", e)
+        writer.close()
+
+    async def _read_request(self, reader):
+        """ (method, path, headers, body) of the next request, None if connection is closed """
+        line = await reader.readline()
+        if not line:
+            return None
+        method, path, _ = line.decode().split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode().partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get("content-length", 0)))
+        return method, path, headers, body
+
+    async def _respond(self, writer, method, path, headers, body):
+        """ answer the request, return False if connection has to be closed """
+        await asyncio.sleep(self.latency(self.rng))
+        trace = headers.get("x-trace-id")
+
+        fault = self.rng.random()
+        if fault < self.reset_rate:
+            self._count("reset")
+            logger.debug("resetting connection, trace %s", trace)
+            sock = writer.get_extra_info("socket")
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+            writer.transport.abort()
+            return False
+        fault -= self.reset_rate
+
+        try:
+            count = int(json.loads(body or b"{}").get("count", 1))
+        except ValueError:
+            count = 0
+
+        headers_out = {}
+        if path != "/treat" or method != "POST":
+            status, result = 404, {"result": "not found"}
+        elif not 1 <= count <= MAX_TREAT_COUNT:
+            status, result = 400, {"result": "bad request", "max_count": MAX_TREAT_COUNT}
+        elif fault < self.error_rate:
+            status, result = 500, {"result": "error"}
+        elif fault - self.error_rate < self.busy_rate:
+            wait = self.rng.uniform(0.5, 5)
+            status, result = 503, {"result": "busy", "queue_depth": 4, "wait": wait}
+            headers_out["Retry-After"] = str(int(wait + 0.999))
+        else:
+            status, result = 200, {"result": "ok"}
+            self.dispensed += count
+        self._count(str(status))
+        logger.debug("%s %s -> %s, trace %s", method, path, status, trace)
+
+        keep_alive = headers.get("connection", "").lower() != "close"
+        response = self._encode(status, result, headers_out, keep_alive)
+        if self.rng.random() < self.slow_rate:
+            self._count("slow")
+            for i in range(len(response)):
+                writer.write(response[i:i + 1])
+                await writer.drain()
+                await asyncio.sleep(self.slow_interval)
+        else:
+            writer.write(response)
+            await writer.drain()
+        return keep_alive
+
+    @staticmethod
+    def _encode(status, result, headers, keep_alive):
+        body = json.dumps(result).encode()
+        headers = dict(headers, **{"Content-Type": "application/json", "Content-Length": str(len(body)),
+                                   "Connection": "keep-alive" if keep_alive else "close"})
+        head = "HTTP/1.1 %s %s\r\n" % (status, STATUS_TEXT[status])
+        head += "".join("%s: %s\r\n" % item for item in headers.items())
+        return (head + "\r\n").encode() + body
+
+
+class BlinkerStub:
+    def show(self, pattern):
+        pass
+
+
+class Stdlib:
+    """ StdlibProvider of DispenserClient, just the clocks """
+
+    def ticks_ms(self):
+        return time.perf_counter_ns() // 1000000
+
+    def ticks_us(self):
+        return time.perf_counter_ns() // 1000
+
+    def ticks_diff(self, ticks1, ticks2):
+        return ticks1 - ticks2
+
+
+async def button(url, *, requests, interval, timeout, rng, results):
+    """ one simulated button, sending `requests` treats over its own kept-alive connection """
+    config = types.SimpleNamespace(TREAT_URL=url, PORTION_IDX=1, HTTP_TIMEOUT=timeout,
+                                   HTTP_KEEPALIVE=KEEPALIVE_TIMEOUT - 1, TREAT_UDP_PORT=None)
+    client = DispenserClient(config=config, blinker=BlinkerStub(), stdlib=Stdlib())
+    await asyncio.sleep(rng.uniform(0, interval))  # presses of buttons do not come all at once
+    for _ in range(requests):
+        started = time.perf_counter()
+        try:
+            await client.send()
+            outcome = "ok"
+        except RetryLater:
+            outcome = "retry"
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+        except Exception:
+            outcome = "error"
+        results.append((outcome, time.perf_counter() - started))
+        await asyncio.sleep(rng.uniform(0, 2 * interval))
+    await client.http.close()
+
+
+async def load(args, dispenser):
+    port = await dispenser.start("127.0.0.1", 0)
+    url = "http://127.0.0.1:%s/treat" % port
+    rng = random.Random(args.seed)
+    results = []
+
+    started = time.perf_counter()
+    await asyncio.gather(*[button(url, requests=args.requests, interval=args.interval, timeout=args.timeout,
+                                  rng=random.Random(rng.random()), results=results)
+                           for _ in range(args.clients)])
+    elapsed = time.perf_counter() - started
+    dispenser.close()
+
+    outcomes = {}
+    for outcome, _ in results:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    print("%s requests of %s clients in %.1f s (%.0f per second), %s portions dispensed"
+          % (len(results), args.clients, elapsed, len(results) / elapsed, dispenser.dispensed))
+    print("client: %s" % " ".join("%s=%s" % item for item in sorted(outcomes.items())))
+    print("server: %s" % " ".join("%s=%s" % item for item in sorted(dispenser.outcomes.items())))
+    print("%-8s %6s" % ("(ms)", "count") + "".join("%10s" % ("p%s" % p) for p in PERCENTILES) + "%10s" % "max")
+    for name in ["ok", "all"]:
+        latencies = sorted(latency for outcome, latency in results if name == "all" or outcome == name)
+        if latencies:
+            print("%-8s %6s" % (name, len(latencies))
+                  + "".join("%10.1f" % (percentile(latencies, p) * 1000) for p in PERCENTILES)
+                  + "%10.1f" % (latencies[-1] * 1000))
+
+
+async def serve(args, dispenser):
+    port = await dispenser.start(args.host, args.port)
+    logger.info("mock dispenser listening on %s:%s", args.host, port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        logger.info("served: %s, %s portions dispensed",
+                    " ".join("%s=%s" % item for item in sorted(dispenser.outcomes.items())), dispenser.dispensed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="mock dispenser with latency and faults, and load generator")
+    parser.add_argument("mode", choices=["serve", "load"])
+    parser.add_argument("--host", default="0.0.0.0", help="to listen on (serve)")
+    parser.add_argument("--port", type=int, default=2477, help="to listen on (serve)")
+    parser.add_argument("--latency", type=parse_latency, default=parse_latency("fixed:0"),
+                        help="distribution of response latency, ms (default fixed:0)")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--busy-rate", type=float, default=0.0)
+    parser.add_argument("--reset-rate", type=float, default=0.0)
+    parser.add_argument("--slow-rate", type=float, default=0.0)
+    parser.add_argument("--slow-interval", type=float, default=0.5, help="seconds between bytes of slow response")
+    parser.add_argument("--clients", type=int, default=20, help="buttons sending at once (load)")
+    parser.add_argument("--requests", type=int, default=50, help="treats sent by every button (load)")
+    parser.add_argument("--interval", type=float, default=0.05, help="mean seconds between treats (load)")
+    parser.add_argument("--timeout", type=float, default=5, help="HTTP_TIMEOUT of buttons (load)")
+    parser.add_argument("--seed", type=int, help="of faults and latencies")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    # clients of load mode would log a line each, their outcomes are in the report
+    level = logging.INFO if args.mode == "serve" else logging.WARNING
+    logging.basicConfig(level=logging.DEBUG if args.verbose else level)
+    dispenser = MockDispenser(latency=args.latency, error_rate=args.error_rate, busy_rate=args.busy_rate,
+                              reset_rate=args.reset_rate, slow_rate=args.slow_rate,
+                              slow_interval=args.slow_interval, seed=args.seed)
+    try:
+        asyncio.run(load(args, dispenser) if args.mode == "load" else serve(args, dispenser))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
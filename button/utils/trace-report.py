@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+""" timelines of treats, from TRACE records (see tracing.py) of the button and of the
+dispenser. Give it any logs, which have the records in them - rsyslog file of the button,
+captured console of the dispenser, ... - records are matched by trace id:
+
+    cd button && python3 utils/trace-report.py /var/log/button1.log dispenser-console.log
+    python3 utils/trace-report.py -q logs/*.log  # percentiles only
+
+Clocks of the two boards are not synchronized. Dispenser spans are shifted so that the
+middle of its "http" (or "udp") span falls on the middle of the button's "request" span,
+as if the way there took as long as the way back.
+"""
+import argparse
+import re
+import sys
+
+TICKS_PERIOD = 1 << 30  # micropython ticks wrap around
+TRACE_RE = re.compile(r"TRACE ([0-9a-zA-Z]+) (\w+) (.*)$")
+PERCENTILES = (50, 95, 99)
+# spans, which are summarized, in the order they happen
+SUMMARY = ("press", "wake", "request", "connect", "http", "udp", "queue", "motor")
+
+
+def ticks_diff(ticks1, ticks2):
+    """ signed ticks1 - ticks2, as utime.ticks_diff """
+    return (ticks1 - ticks2 + TICKS_PERIOD // 2) % TICKS_PERIOD - TICKS_PERIOD // 2
+
+
+def parse(lines):
+    """ {trace id: {side: [(name, start, duration)]}} from log lines """
+    traces = {}
+    for line in lines:
+        match = TRACE_RE.search(line.rstrip())
+        if not match:
+            continue
+        trace, side, spans = match.groups()
+        parsed = []
+        for span in spans.split():
+            try:
+                name, start, duration = span.rsplit(":", 2)
+                parsed.append((name, int(start), int(duration)))
+            except ValueError:
+                print("skipping broken span %r of trace %s" % (span, trace), file=sys.stderr)
+        traces.setdefault(trace, {}).setdefault(side, []).extend(parsed)
+    return traces
+
+
+def _find(spans, names):
+    for span in spans:
+        if span[0] in names:
+            return span
+    return None
+
+
+def timeline(sides):
+    """ [(side, name, start, duration)] of one trace, start in us from its first span,
+    dispenser spans aligned to the button ones (if there are both) """
+    button = sides.get("button", [])
+    dispenser = sides.get("dispenser", [])
+    spans = [("button", name, start, duration) for name, start, duration in button]
+
+    if dispenser:
+        request = _find(button, ("request",))
+        arrival = _find(dispenser, ("http", "udp"))
+        if request and arrival:
+            # ticks of dispenser + shift = ticks of button
+            shift = ticks_diff(request[1] + request[2] // 2, arrival[1] + arrival[2] // 2)
+        elif button:  # can not be aligned, dispenser spans are shown after the button ones
+            end = max(ticks_diff(start + duration, button[0][1]) for _, start, duration in button)
+            shift = button[0][1] + end - dispenser[0][1]
+        else:
+            shift = 0
+        spans += [("dispenser", name, start + shift, duration) for name, start, duration in dispenser]
+
+    if not spans:
+        return []
+    origin = spans[0][2]
+    return [(side, name, ticks_diff(start, origin), duration) for side, name, start, duration in spans]
+
+
+def percentile(values, p):
+    """ nearest-rank percentile of sorted values """
+    return values[max(0, -(-len(values) * p // 100) - 1)]
+
+
+def report(traces, timelines=True, out=sys.stdout):
+    durations = {}  # span name -> [us]
+    for trace, sides in traces.items():
+        spans = timeline(sides)
+        if not spans:
+            continue
+        total = max(start + duration for _, _, start, duration in spans)
+        durations.setdefault("total", []).append(total)
+        for _, name, _, duration in spans:
+            if name in SUMMARY:
+                durations.setdefault(name, []).append(duration)
+
+        if timelines:
+            only = "" if len(sides) > 1 else " (%s only)" % list(sides)[0]
+            print("trace %s, %.1f ms%s" % (trace, total / 1000, only), file=out)
+            for side, name, start, duration in sorted(spans, key=lambda span: span[2]):
+                print("  %-9s %-10s %9.1f ms  +%.1f ms" % (side, name, start / 1000, duration / 1000), file=out)
+            print(file=out)
+
+    print("%-8s %6s" % ("span", "count") + "".join("%10s" % ("p%s" % p) for p in PERCENTILES) + " (ms)", file=out)
+    for name in SUMMARY + ("total",):
+        values = sorted(durations.get(name, []))
+        if values:
+            print("%-8s %6s" % (name, len(values))
+                  + "".join("%10.1f" % (percentile(values, p) / 1000) for p in PERCENTILES), file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="timelines and percentiles of traced treats")
+    parser.add_argument("logs", nargs="+", help="log files with TRACE records")
+    parser.add_argument("-q", "--quiet", action="store_true", help="percentiles only, no timelines")
+    args = parser.parse_args()
+
+    lines = []
+    for fn in args.logs:
+        with open(fn, errors="replace") as f:
+            lines.extend(f)
+    report(parse(lines), timelines=not args.quiet)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+asyncio flavour of microdot, which keeps HTTP/1.1 connections open between requests
+"""
+import logging
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio  # type: ignore
+
+try:
+    from microdot_asyncio import Microdot, Request, Response  # noqa: F401 microdot 1.x
+except ImportError:
+    from microdot import Microdot, Request, Response  # noqa: F401 microdot >= 2.0 is asyncio only
+
+
+logger = logging.getLogger(__name__)
+
+
+class KeepAliveMicrodot(Microdot):
+    """ Microdot which serves more requests over one connection. Connection is closed when
+    client asks for it, when it stays idle for `keepalive_timeout` seconds, or when the
+    response length is not known in advance (streamed body). """
+
+    keepalive_timeout = 5
+    max_keepalive_requests = 100
+
+    async def handle_request(self, reader, writer):
+        addr = writer.get_extra_info('peername')
+        served = 0
+
+        try:
+            while True:
+                try:
+                    req = await asyncio.wait_for(Request.create(self, reader, writer, addr),
+                                                 self.keepalive_timeout)
+                except asyncio.TimeoutError:
+                    break
+                except Exception as e:
+                    logger.info("could not parse request from %s: %r", addr, e)
+                    await self._write(await self.dispatch_request(None), writer, keep_alive=False)
+                    break
+
+                if req is None:  # client closed connection
+                    break
+
+                served += 1
+                res = await self.dispatch_request(req)
+                keep_alive = served < self.max_keepalive_requests and self._wants_keep_alive(req)
+                if not await self._write(res, writer, keep_alive):
+                    break
+        except OSError as e:  # pragma: no cover
+            logger.debug("connection with %s lost: %r", addr, e)
+
+        try:
+            await writer.aclose()
+        except OSError:  # pragma: no cover
+            pass
+
+    @staticmethod
+    def _wants_keep_alive(req) -> bool:
+        connection = req.headers.get('Connection', '').lower()
+        if req.http_version == '1.0':
+            return connection == 'keep-alive'
+        # body not read by handler would be taken as the next request
+        return connection != 'close' and req.content_length <= Request.max_body_length
+
+    @staticmethod
+    async def _write(res, writer, keep_alive) -> bool:
+        """ write response, return True if connection can be reused """
+        res.complete()
+        keep_alive = keep_alive and 'Content-Length' in res.headers
+        res.headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+        await res.write(writer)
+        return keep_alive
+
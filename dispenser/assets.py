@@ -0,0 +1,71 @@
+"""
+static assets (css, js) stored gzipped on flash and streamed to client in small chunks
+"""
+import binascii
+import hashlib
+import logging
+import os
+
+from aserver import Response
+
+
+logger = logging.getLogger(__name__)
+
+
+CONTENT_TYPES = {"css": "text/css",
+                 "js": "application/javascript"}
+
+
+class StaticAssets:
+    """ serves `<directory>/<name>.gz` files as `<name>`. Only files present at startup are
+    served, their sizes and etags are computed once. Files are never loaded whole into
+    RAM, they are sent in `chunk_size` pieces. Clients get them gzipped, every browser
+    accepts it. """
+
+    def __init__(self, directory, *, max_age, chunk_size=512):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.cache_control = "max-age=%s" % max_age
+        self.assets = {}
+
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            logger.warning("no static assets directory %s", directory)
+            names = []
+
+        for name in names:
+            if name.endswith(".gz"):
+                self._add(name[:-3])
+
+    def _add(self, name):
+        path = "%s/%s.gz" % (self.directory, name)
+        size = 0
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                digest.update(chunk)
+
+        etag = '"%s"' % binascii.hexlify(digest.digest()[:8]).decode()
+        content_type = CONTENT_TYPES.get(name.rsplit(".", 1)[-1], "application/octet-stream")
+        self.assets[name] = (path, {"Content-Type": content_type, "Content-Encoding": "gzip",
+                                    "Content-Length": str(size), "ETag": etag,
+                                    "Cache-Control": self.cache_control})
+
+    def response(self, req, name):
+        asset = self.assets.get(name, None)
+        if asset is None:
+            return Response(body=b"", status_code=404)
+
+        path, headers = asset
+        if headers["ETag"] in req.headers.get("If-None-Match", ""):
+            return Response(body=b"", status_code=304, reason="Not Modified",
+                            headers={"ETag": headers["ETag"], "Cache-Control": self.cache_control})
+
+        res = Response(body=open(path, "rb"), headers=headers)
+        res.send_file_buffer_size = self.chunk_size
+        return res
@@ -7,12 +7,20 @@ WIFI = {'ap': {'ssid': 'dispenser',
         'client': {'ssid': 'some_network',
                    'pass': 'some_pass',
                    'dhcp': 'treatme',
+                   # scan (and log) networks around before connecting, slows boot down
+                   'scan': False,
                    # if set to None, no ip is set
                    'ip': None,
                    'dns': None}}
 
 SERVO_PIN = 19
 
+# how servo plans are executed:
+#  "thread" - in a worker thread, sleeping between steps
+#  "timer" - from callbacks of hardware timer SERVO_TIMER, no thread needed
+SERVO_EXECUTOR = "timer"
+SERVO_TIMER = 0
+
 TURN_SPEED = 1
 
 FULL_ANGLE_TIME = 2
@@ -23,9 +31,48 @@ PORTION_SIZES = {1: [0.2, -0.3],
                  3: [0.2, -1.6],
                 -1: [2]}
 
+# every turn accelerates and decelerates in RAMP_STEPS steps, each step lasts
+# RAMP_TIME/RAMP_STEPS seconds. Set RAMP_STEPS to 0 to turn ramps off
+RAMP_STEPS = 3
+RAMP_TIME = 0.15
+
+# how many plans of ad-hoc sizes (not from PORTION_SIZES) are kept compiled
+PLAN_CACHE_SIZE = 4
+
 
 LISTEN_PORT = 2477
 
+# directory with gzipped css/js (built by `doit static_bundle`) and how long browsers
+# may keep them without asking again
+STATIC_DIR = "static"
+STATIC_MAX_AGE = 7 * 24 * 3600
+
+# idle keep-alive connection is closed after this many seconds
+HTTP_KEEPALIVE_TIMEOUT = 5
+
+# UDP fast path for treats (used by the button), None turns it off. Answers of the last
+# UDP_DEDUPE_WINDOW requests are kept, so retransmits are not dispensed twice
+UDP_PORT = 2478
+UDP_DEDUPE_WINDOW = 16
+
+# how many treat jobs can wait for the servo, more requests are answered with 503
+TREAT_QUEUE_SIZE = 4
+# most portions one request may ask for (button sends presses, which queued up while
+# dispenser was unreachable, together)
+MAX_TREAT_COUNT = 5
+
+# the same message of a logger is logged at most once in LOG_REPEAT_INTERVAL seconds, and
+# every logger logs at most LOG_RATE records per second, with bursts of LOG_BURST
+LOG_REPEAT_INTERVAL = 10
+LOG_RATE = 5
+LOG_BURST = 20
+# production profile: INFO and up is logged, debug() calls do nothing (not even level
+# check). `doit strip_debug=1` removes them from sources sent to board altogether
+LOG_PRODUCTION = False
+# log spans of every treat (from the button press to the servo stop) as TRACE records,
+# button/utils/trace-report.py makes timelines of them
+TRACE = True
+
 try:
     from config_local import *   # noqa:
 except Exception:
@@ -2,36 +2,40 @@ import logging
 import utime
 
 import network
+import uasyncio as asyncio
 
 import config
 
 logger = logging.getLogger(__name__)
 
-def init_wifi():
-    """ returns ap,client wifi objects"""
-    cli = None
+async def init_wifi():
+    """ bring AP up and start client association in background.
+
+    returns ap wifi object and task, which results in client wifi object """
+    cli_task = None
     ap = None
-    print("print config.WIFI=", config.WIFI)
-    logger.debug("logger.debug config.WIFI=%r", config.WIFI)
+    logger.debug("config.WIFI=%r", config.WIFI)
     if config.WIFI['ap']:
-        ap = init_ap()
+        ap = await init_ap()
 
     if config.WIFI['client']:
-        cli = init_client()
+        cli_task = asyncio.create_task(init_client())
 
-    return ap, cli
+    return ap, cli_task
 
 
-def init_client():
+async def init_client():
+    started = utime.ticks_ms()
     logger.info("init client")
     conf = config.WIFI['client']
     wi = network.WLAN(network.STA_IF)
     wi.active(True)
     logger.debug("sleep 1 sec after active(True)")
-    utime.sleep(1)
-    logger.debug("wi.scan()")
-    for x in wi.scan():
-        logger.debug(" -> %r", x)
+    await asyncio.sleep(1)
+    if conf.get("scan", False):
+        logger.debug("wi.scan()")
+        for x in wi.scan():
+            logger.debug(" -> %r", x)
     wi.config(dhcp_hostname=conf["dhcp"])
     wi.connect(conf["ssid"], conf["pass"])
     logger.debug("asked to connect to ssid/pass")
@@ -43,20 +47,21 @@ def init_client():
         logger.info("ifconfig set")
 
     while not wi.isconnected():
-        utime.sleep(0.2)
+        await asyncio.sleep(0.2)
         logger.debug("cli is not connected yet, sleeping")
 
-    logger.info("client connected. ifconfig is cli=%s", wi.ifconfig())
+    logger.info("client connected in %s ms. ifconfig is cli=%s", utime.ticks_diff(utime.ticks_ms(), started),
+                wi.ifconfig())
 
     return wi
 
-def init_ap():
+async def init_ap():
     logger.info("init ap")
     conf = config.WIFI['ap']
     wi = network.WLAN(network.AP_IF)
     wi.active(True)
     logger.debug("sleep 0.2 sec after active(True)")
-    utime.sleep(0.2)
+    await asyncio.sleep(0.2)
     wi.config(essid=conf["ssid"])
     wi.config(authmode=network.AUTH_WPA_WPA2_PSK, password=conf["pass"])
     logger.debug("configured ssid/pass")
@@ -23,10 +23,18 @@ MPF_ADDR = 'ttyUSB0'
 MPFSHELLi = f"mpfshell -o {MPF_ADDR} --loglevel=DEBUG"
 MPFSHELL = f"{MPFSHELLi} -n"
 
-SRCS=["main.py", "servo.py", "config.py", "config_local.py", "conn.py", "template.py", "webrepl_cfg.py", "lib/microdot.py"]
+STATIC_ASSETS = ["static/app.css", "static/app.js"]
+SRCS=["main.py", "aserver.py", "respcache.py", "assets.py", "metrics.py", "motion.py", "executor.py", "servo.py",
+      "logfilter.py", "tracing.py", "config.py", "config_local.py", "conn.py", "template.py", "webrepl_cfg.py", "lib/microdot.py",
+      "lib/microdot_asyncio.py"]
+SRCS += [f"{asset}.gz" for asset in STATIC_ASSETS]
 UPIPS = [ "micropython-logging" ]
 UPIPS_TESTS = []
 
+# `doit strip_debug=1` sends our sources with debug logging calls removed, see strip_debug()
+STRIP_DEBUG = get_var('strip_debug', '')
+BUILD_DIR = '.build'
+
 MICROPYTHON_LIB_REPO = get_var('MICROPYTHON_LIB_REPO', 'git@github.com:micropython/micropython-lib.git')
 
 
@@ -41,11 +49,12 @@ class actions_to_send:
     task_names: Set[str] = set()
 
     @classmethod
-    def add_file(cls, f):
+    def add_file(cls, f, local=None):
+        """ send `f`, from file `local` if it is given """
         dirname = os.path.dirname(f)
         if dirname and dirname != "lib":
             cls.before.add(f"md {dirname}")
-        cls.middle.add(f"put {f} {f}")
+        cls.middle.add(f"put {local or f} {f}")
         cls.task_names.add(f"send_{f}")
 
     @classmethod
@@ -65,16 +74,28 @@ def local_micropython(cmd):
 
 
 
-@cmdtask(uptodate=[timeout(timedelta(days=1))], targets=['lib/microdot.py'])
+@cmdtask(uptodate=[timeout(timedelta(days=1))], targets=['lib/microdot.py', 'lib/microdot_asyncio.py'])
 def checkout_microdot():
     """ checkout microdot from github (it has problems with it's pypi package """
     return [
         'rm -rfv .microdot',
         'git clone https://github.com/miguelgrinberg/microdot .microdot',
-        'install -v -D .microdot/src/microdot.py lib/microdot.py'
+        'install -v -D .microdot/src/microdot.py lib/microdot.py',
+        'install -v -D .microdot/src/microdot_asyncio.py lib/microdot_asyncio.py'
     ]
 
 
+def task_static_bundle():
+    """ gzip static assets, so they are stored on flash compressed """
+    for asset in STATIC_ASSETS:
+        yield {
+            'basename': f'static_bundle:{asset}',
+            'actions': [f'gzip -9 -n -c {asset} > {asset}.gz'],
+            'file_dep': [asset],
+            'targets': [f'{asset}.gz'],
+        }
+
+
 def uptodate_sendpyfiles(task, values):
     dman = doit.globals.Globals.dep_manager
 
@@ -87,13 +108,47 @@ def uptodate_sendpyfiles(task, values):
     return True
 
 
+def strip_debug(src, dst):
+    """ copy python source `src` to `dst`, with logger.debug(...) and logging.debug(...)
+    statements replaced by `pass` (and empty lines, so line numbers in tracebacks stay) """
+    import ast
+
+    with open(src, "rb") as f:
+        source = f.read()
+    lines = source.split(b"\n")
+
+    calls = []
+    for node in ast.walk(ast.parse(source)):
+        call = node.value if isinstance(node, ast.Expr) else None
+        if (isinstance(call, ast.Call) and isinstance(call.func, ast.Attribute) and call.func.attr == "debug"
+                and isinstance(call.func.value, ast.Name) and call.func.value.id in ("logger", "logging")):
+            calls.append(node)
+
+    # from the end, so offsets of statements left to do do not move (ast offsets are in bytes)
+    for node in sorted(calls, key=lambda n: (n.lineno, n.col_offset), reverse=True):
+        first, last = node.lineno - 1, node.end_lineno - 1
+        head, tail = lines[first][:node.col_offset], lines[last][node.end_col_offset:]
+        for i in range(first + 1, last + 1):
+            lines[i] = b""
+        lines[first] = head + b"pass" + tail
+
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    with open(dst, "wb") as f:
+        f.write(b"\n".join(lines))
+
+
 def task_send_pyfiles():
     """ send files to ESP """
 
     for src in SRCS:
+        actions = [(actions_to_send.add_file, [src])]
+        if STRIP_DEBUG and src.endswith(".py") and not src.startswith("lib/"):
+            local = f"{BUILD_DIR}/{src}"
+            actions = [(strip_debug, [src, local]), (actions_to_send.add_file, [src, local])]
+
         yield {
             'basename': f'send_{src}',
-            'actions': [(actions_to_send.add_file, [src])],
+            'actions': actions,
             'file_dep': [src],
             'uptodate': [uptodate_sendpyfiles],
         }
@@ -173,9 +228,10 @@ def task_wipe():
 def task_local_microdot():
     """ copy microdot to local lib directory, """
     return {'actions': ['mkdir -p upy-local-lib',
-                        'cp -v lib/microdot.py upy-local-lib/microdot.py'],
-            'file_dep': ['lib/microdot.py'],
-            'targets': ['upy-local-lib/microdot.py']}
+                        'cp -v lib/microdot.py upy-local-lib/microdot.py',
+                        'cp -v lib/microdot_asyncio.py upy-local-lib/microdot_asyncio.py'],
+            'file_dep': ['lib/microdot.py', 'lib/microdot_asyncio.py'],
+            'targets': ['upy-local-lib/microdot.py', 'upy-local-lib/microdot_asyncio.py']}
 
 
 def task_local_upip():
@@ -0,0 +1,60 @@
+"""
+executor of motion plans, which needs no thread - servo is driven from one-shot
+machine.Timer callbacks
+"""
+
+
+class TimerExecutor:
+    """ runs motion plan as state machine. Every timer callback sets duty of the next plan
+    step and arms the timer for the step's duration. Deadlines are kept in microseconds
+    (`clock.ticks_us`) and counted from the start of the plan, so lateness of one callback
+    is not carried over to the next steps. """
+
+    def __init__(self, *, servo, timer, clock):
+        self.servo = servo
+        self.timer = timer
+        self.clock = clock
+
+        self.busy = False
+        self.plan = None
+        self.repeat = 0
+        self.on_done = None
+        self._idx = 0
+        self._deadline = 0
+        self._step_cb = self._step  # bound method allocated once, not in every callback
+
+    def start(self, plan, repeat, on_done):
+        """ start executing plan `repeat` times, call on_done() when finished """
+        assert not self.busy, "executor is still running other plan"
+
+        self.busy = True
+        self.plan = plan
+        self.repeat = repeat
+        self.on_done = on_done
+        self._idx = 0
+        self._deadline = self.clock.ticks_us()
+        self._step(None)
+
+    def _step(self, _timer):
+        plan = self.plan
+        clock = self.clock
+
+        while True:
+            if self._idx >= len(plan):
+                self.repeat -= 1
+                if self.repeat <= 0:
+                    self.busy = False
+                    self.on_done()
+                    return
+                self._idx = 0
+
+            duty, duration = plan[self._idx], plan[self._idx + 1]
+            self._idx += 2
+            self.servo.duty(duty)
+
+            if duration:
+                self._deadline = clock.ticks_add(self._deadline, duration)
+                delay_us = clock.ticks_diff(self._deadline, clock.ticks_us())
+                period_ms = max(0, (delay_us + 500) // 1000)
+                self.timer.init(mode=self.timer.ONE_SHOT, period=period_ms, callback=self._step_cb)
+                return
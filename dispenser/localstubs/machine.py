@@ -15,3 +15,62 @@ class PWM:
     @traceme("PWM")
     def duty(self, *a, **kwa):
         ...
+
+
+class Timer:
+    """ timer driven by virtual clock instead of hardware. Time goes on only when
+    Timer.advance() is called, which fires all the callbacks due in order of their
+    deadlines. """
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    now_us = 0
+    _armed = []
+
+    def __init__(self, id_=-1):
+        self.id = id_
+        self.mode = None
+        self.period_us = 0
+        self.deadline_us = None
+        self.callback = None
+
+    @traceme("Timer")
+    def init(self, *, mode=PERIODIC, period=-1, callback=None):
+        self.mode = mode
+        self.period_us = period * 1000
+        self.callback = callback
+        self.deadline_us = Timer.now_us + self.period_us
+        if self not in Timer._armed:
+            Timer._armed.append(self)
+
+    @traceme("Timer")
+    def deinit(self):
+        if self in Timer._armed:
+            Timer._armed.remove(self)
+
+    @classmethod
+    def ticks_us(cls):
+        return cls.now_us
+
+    @classmethod
+    def advance(cls, us):
+        """ move virtual clock `us` microseconds forward, firing due timers """
+        target = cls.now_us + us
+        while True:
+            due = [timer for timer in cls._armed if timer.deadline_us <= target]
+            if not due:
+                break
+            timer = min(due, key=lambda t: t.deadline_us)
+            cls.now_us = max(cls.now_us, timer.deadline_us)
+            if timer.mode == cls.ONE_SHOT:
+                cls._armed.remove(timer)
+            else:
+                timer.deadline_us += max(1, timer.period_us)
+            timer.callback(timer)
+        cls.now_us = target
+
+    @classmethod
+    def reset(cls):
+        """ disarm all timers and set virtual clock to zero """
+        cls.now_us = 0
+        cls._armed = []
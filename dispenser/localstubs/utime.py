@@ -0,0 +1,22 @@
+""" utime of micropython, on top of time of python. Ticks do not wrap around """
+import time
+
+
+def sleep(seconds):
+    time.sleep(seconds)
+
+
+def ticks_ms():
+    return time.perf_counter_ns() // 1000000
+
+
+def ticks_us():
+    return time.perf_counter_ns() // 1000
+
+
+def ticks_add(ticks, delta):
+    return ticks + delta
+
+
+def ticks_diff(ticks1, ticks2):
+    return ticks1 - ticks2
@@ -0,0 +1,143 @@
+import logging
+
+WARNING = 30  # logging.WARNING and ERROR, not in every micropython logging
+ERROR = 40
+
+# methods of logger, which mute() may replace, with their levels
+MUTABLE = (("debug", 10), ("info", 20), ("warning", WARNING))
+
+
+def _muted(*args, **kwargs):
+    pass
+
+
+def _loggers():
+    """ all loggers created so far, root included """
+    root = logging.getLogger()
+    manager = getattr(logging.Logger, "manager", None)  # CPython has it, micropython has _loggers
+    loggers = manager.loggerDict.values() if manager else logging._loggers.values()
+    return [root] + [logger for logger in loggers if isinstance(logger, logging.Logger) and logger is not root]
+
+
+class Mute:
+    """ production profile of logging: every level check is done once, in mute(). Methods
+    (and module functions, for root logger) of disabled levels are replaced by function
+    doing nothing - a call to them does not even check the level and its arguments are not
+    formatted. Loggers created after mute(), and levels set after it, are not taken into
+    account until it is called again """
+
+    def __init__(self):
+        self.muted = []  # (logger or logging module, name of method)
+        self._module_functions = {name: getattr(logging, name) for name, _ in MUTABLE}
+
+    def mute(self):
+        self.unmute()
+        root = logging.getLogger()
+        for logger in _loggers():
+            for name, level in MUTABLE:
+                if not logger.isEnabledFor(level):
+                    setattr(logger, name, _muted)
+                    self.muted.append((logger, name))
+                    if logger is root:
+                        setattr(logging, name, _muted)
+                        self.muted.append((logging, name))
+
+    def unmute(self):
+        for obj, name in self.muted:
+            if obj is logging:
+                setattr(logging, name, self._module_functions[name])
+            else:
+                delattr(obj, name)
+        self.muted = []
+
+
+class _LoggerState:
+    def __init__(self, now, tokens):
+        self.msg = None  # the last message passed (template, with no arguments put in)
+        self.level = 0
+        self.since = now  # when it passed
+        self.repeats = 0  # how many times it came again since, dropped
+        self.tokens = tokens
+        self.refilled = now
+        self.dropped = 0  # dropped by rate limit
+
+
+class LogLimiter:
+    """ drops log records before they are formatted, written to file or sent:
+
+    - a message repeated by the same logger within `repeat_interval` seconds is dropped,
+      "last message repeated N times" is logged before the next message of the logger
+    - every logger may log `rate` records per second, with bursts of up to `burst` records
+      (token bucket), the count of dropped records is logged before the next one
+
+    Errors are never dropped. Messages are compared as templates, with no arguments put in,
+    so logger.debug("waited %s ms", ms) is the same message for every `ms`.
+
+    `install()` puts it in front of every logging.Logger.
+    """
+
+    def __init__(self, *, clock, repeat_interval, rate, burst):
+        self.clock = clock
+        self.repeat_interval_us = int(repeat_interval * 1000000)
+        self.rate = rate
+        self.burst = burst
+
+        self.loggers = {}  # logger name -> _LoggerState
+        self._patched = None  # (name of Logger method, the original method)
+        self._no_args = ()  # what the original method takes for no arguments of message
+
+    def install(self):
+        Logger = logging.Logger
+        # debug() and the others of CPython do not go through log(), but all go through _log()
+        name = "_log" if hasattr(Logger, "_log") else "log"
+        original = getattr(Logger, name)
+        limiter = self
+
+        def log(logger, level, msg, *args, **kwargs):
+            if logger.isEnabledFor(level) and limiter.allow(logger, level, msg):
+                original(logger, level, msg, *args, **kwargs)
+
+        self._patched = (name, original)
+        self._no_args = ((),) if name == "_log" else ()
+        setattr(Logger, name, log)
+
+    def uninstall(self):
+        if self._patched:
+            setattr(logging.Logger, self._patched[0], self._patched[1])
+            self._patched = None
+
+    def _log(self, logger, level, msg):
+        self._patched[1](logger, level, msg, *self._no_args)
+
+    def allow(self, logger, level, msg) -> bool:
+        """ whether record of `logger` is logged. Summaries of dropped records are logged
+        before the record """
+        now = self.clock.ticks_us()
+        state = self.loggers.get(logger.name)
+        if state is None:
+            state = self.loggers[logger.name] = _LoggerState(now, self.burst)
+
+        if level < ERROR:
+            if msg == state.msg and self.clock.ticks_diff(now, state.since) < self.repeat_interval_us:
+                state.repeats += 1
+                return False
+
+            elapsed = self.clock.ticks_diff(now, state.refilled)
+            state.tokens = min(self.burst, state.tokens + elapsed * self.rate / 1000000)
+            state.refilled = now
+            if state.tokens < 1:
+                state.dropped += 1
+                return False
+            state.tokens -= 1
+
+        if state.repeats:
+            self._log(logger, state.level, "last message repeated %s times" % state.repeats)
+            state.repeats = 0
+        if state.dropped:
+            self._log(logger, WARNING, "%s messages dropped by rate limit" % state.dropped)
+            state.dropped = 0
+
+        state.msg = msg
+        state.level = level
+        state.since = now
+        return True
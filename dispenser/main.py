@@ -1,18 +1,58 @@
+import gc
 import logging
 import math
-import os
+import socket
+import struct
 import _thread as th
 
-from microdot import Microdot, Response, redirect
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio  # type: ignore
 
+from aserver import KeepAliveMicrodot, Response
 
 import config as conf_mod
+import motion
 import template
+import tracing
+from respcache import CachedResponse
+from assets import StaticAssets
+from metrics import ADHOC_PORTION, Metrics
 
 
 logger = logging.getLogger(__name__)
 
 
+# UDP fast path. Button sends b"TQ" + sequence number (uint32) + portion index (int8) +
+# count of portions (uint8), dispenser answers b"TA" + the same sequence number + status
+# (uint8). Duplicates (retransmits of already handled requests) get the same answer,
+# without dispensing again
+UDP_TREAT = "!2sIbB"
+UDP_ACK = "!2sIB"
+# request may go on with trace id (uint32), see tracing
+UDP_TRACE = "!I"
+UDP_OK = 0
+UDP_BUSY = 1
+UDP_BAD_REQUEST = 2
+
+
+class _EventFlag:
+    """ ThreadSafeFlag for asyncio without it (CPython, older uasyncio). Good enough, when
+    timer callbacks run in the thread of event loop """
+    def __init__(self):
+        self._event = asyncio.Event()
+
+    def set(self):
+        self._event.set()
+
+    async def wait(self):
+        await self._event.wait()
+        self._event.clear()
+
+
+ThreadSafeFlag = getattr(asyncio, "ThreadSafeFlag", _EventFlag)
+
 
 class StdlibProvider:  # pragma: no cover
     """ class providing various stdlib things """
@@ -21,15 +61,43 @@ class StdlibProvider:  # pragma: no cover
 
         utime.sleep(time_)
 
-    def init_wifi(self):
+    def ticks_us(self):
+        import utime
+
+        return utime.ticks_us()
+
+    def ticks_add(self, ticks, delta):
+        import utime
+
+        return utime.ticks_add(ticks, delta)
+
+    def ticks_diff(self, ticks1, ticks2):
+        import utime
+
+        return utime.ticks_diff(ticks1, ticks2)
+
+    def schedule(self, fn, arg):
+        """ run fn(arg) from micropython scheduler, serialized with timer callbacks """
+        import micropython
+
+        micropython.schedule(fn, arg)
+
+    async def init_wifi(self):
+        """ bring AP up, client wifi connects in background task """
         import webrepl  # module exists only on esp32
         import conn  # module uses code which exists only on esp32
 
         webrepl.start()
-        conn.init_wifi()
+        return await conn.init_wifi()
+
+    def init_logging(self, config):
+        from logfilter import LogLimiter, Mute
 
-    def init_logging(self):
-        logging.basicConfig(level=logging.DEBUG)
+        logging.basicConfig(level=logging.INFO if config.LOG_PRODUCTION else logging.DEBUG)
+        LogLimiter(clock=self, repeat_interval=config.LOG_REPEAT_INTERVAL, rate=config.LOG_RATE,
+                   burst=config.LOG_BURST).install()
+        if config.LOG_PRODUCTION:
+            Mute().mute()  # every module is imported by now, with its logger
 
 
 class TreatmeContainer:  # pragma: no cover
@@ -39,98 +107,549 @@ class TreatmeContainer:  # pragma: no cover
 
         self.config = conf_mod
         self.threads = th
-        self.servo = Servo(self.config.SERVO_PIN)
         self.stdlib = StdlibProvider()
+        self.tracer = None
+        self.servo = Servo(self.config.SERVO_PIN)
+        if self.config.TRACE:
+            # servo thread records spans too (timer callbacks do not, see TracingServo)
+            self.tracer = tracing.Tracer(clock=self.stdlib, side="dispenser", lock=self.threads.allocate_lock())
+            self.servo = TracingServo(servo=self.servo, tracer=self.tracer, clock=self.stdlib)
         self.templates = template
-        self.treat_logic = TreatLogic(config=self.config, threads=self.threads, servo=self.servo, stdlib=self.stdlib)
-        self.app = TreatApp(treat_logic=self.treat_logic, config=self.config, stdlib=self.stdlib, templates=self.templates)
+        self.executor = None
+        if self.config.SERVO_EXECUTOR == "timer":
+            import machine
+            from executor import TimerExecutor
+
+            self.executor = TimerExecutor(servo=self.servo, timer=machine.Timer(self.config.SERVO_TIMER),
+                                          clock=self.stdlib)
+        self.metrics = Metrics(routes=TreatApp.ROUTES, portions=self.config.PORTION_SIZES)
+        self.treat_logic = TreatLogic(config=self.config, threads=self.threads, servo=self.servo, stdlib=self.stdlib,
+                                      executor=self.executor, metrics=self.metrics, tracer=self.tracer)
+        self.assets = StaticAssets(self.config.STATIC_DIR, max_age=self.config.STATIC_MAX_AGE)
+        self.datagrams = None
+        if self.config.UDP_PORT:
+            self.datagrams = TreatDatagramServer(treat_logic=self.treat_logic, config=self.config,
+                                                 metrics=self.metrics, stdlib=self.stdlib, tracer=self.tracer)
+        self.app = TreatApp(treat_logic=self.treat_logic, config=self.config, stdlib=self.stdlib,
+                            templates=self.templates, assets=self.assets, metrics=self.metrics,
+                            datagrams=self.datagrams, tracer=self.tracer)
+
+
+class QueueFullError(Exception):
+    """ raised when there is no free slot in TreatQueue """
+    def __init__(self, depth, wait):
+        super().__init__("treat queue is full (depth=%s, wait=%ss)" % (depth, wait))
+        self.depth = depth
+        self.wait = wait
+
+
+class TreatQueue:
+    """ fixed capacity FIFO of treat jobs, shared by http handlers (producers) and single
+    servo worker (consumer).
+
+    Slots are preallocated, so putting a job never grows memory. Back-to-back jobs with
+    the same (precompiled or cached) plan are merged into one slot with increased repeat
+    count. Merged or not, at most `max_portions` portions (repeats) are queued.
+    """
+    def __init__(self, *, threads, capacity, max_portions):
+        self.capacity = capacity
+        self.max_portions = max_portions
+        self._jobs = [None] * capacity
+        self._repeats = [0] * capacity
+        self._durations = [0.0] * capacity
+        self._traces = [()] * capacity
+        self._head = 0
+        self._count = 0
+        self._portions = 0
+        self.pending_time = 0.0
+
+        self._lock = threads.allocate_lock()
+        # _ready is unlocked if and only if there is something in queue
+        self._ready = threads.allocate_lock()
+        self._ready.acquire()
+
+    def __len__(self):
+        return self._count
+
+    def put(self, job, duration: float, repeat=1, trace=None):
+        """ append job to be done `repeat` times (or merge it with the last one), raise
+        QueueFullError if there is no space left. `trace` is kept with the job, merged job
+        keeps traces of all of its parts """
+        with self._lock:
+            if self._portions + repeat > self.max_portions:
+                raise QueueFullError(self._count, self.pending_time)
+            if self._count:
+                last = (self._head + self._count - 1) % self.capacity
+                if self._jobs[last] is job:
+                    self._repeats[last] += repeat
+                    self._portions += repeat
+                    self.pending_time += duration * repeat
+                    if trace:
+                        self._traces[last] += (trace,)
+                    return
+
+            if self._count == self.capacity:
+                raise QueueFullError(self._count, self.pending_time)
+
+            idx = (self._head + self._count) % self.capacity
+            self._jobs[idx] = job
+            self._repeats[idx] = repeat
+            self._durations[idx] = duration
+            self._traces[idx] = (trace,) if trace else ()
+            self._count += 1
+            self._portions += repeat
+            self.pending_time += duration * repeat
+
+            if self._count == 1:
+                self._ready.release()
+
+    def get(self, block=True):
+        """ pop oldest job as (job, repeat, duration, traces) tuple. Returns None if queue is
+        empty and block is False """
+        if block:
+            self._ready.acquire()
+        elif not self._ready.acquire(0):
+            return None
+
+        with self._lock:
+            idx = self._head
+            job, repeat, traces = self._jobs[idx], self._repeats[idx], self._traces[idx]
+            duration = self._durations[idx] * repeat
+            self._jobs[idx] = None
+            self._traces[idx] = ()
+            self._head = (idx + 1) % self.capacity
+            self._count -= 1
+            self._portions -= repeat
+            self.pending_time -= duration
+
+            if self._count:
+                self._ready.release()
+
+        return job, repeat, duration, traces
 
 
 class TreatLogic:
-    def __init__(self, *,  config, threads, servo, stdlib):
+    """ dispenses queued treats, either in servo worker thread, or - if executor is given -
+    by executor's timer callbacks with no thread at all. With `tracer`, servo has to be
+    TracingServo """
+    def __init__(self, *,  config, threads, servo, stdlib, executor=None, metrics=None, tracer=None):
         self.config = config
         self.threads = threads
         self.servo = servo
         self.stdlib = stdlib
-
-    def treat(self, sizes: list):
-        speedtimes = self._sizes_to_speedtimes(sizes)
-        self.threads.start_new_thread(self.turnmany, (speedtimes,), {})
-
-    def _sizes_to_speedtimes(self, sizes):
-        speed = self.config.TURN_SPEED
-        return [
-            (speed * math.copysign(1, size), abs(size * self.config.FULL_ANGLE_TIME / speed))
-            for size in sizes
-        ]
-
-    def turnmany(self, speed_times: list):
-        """ 
-        function called inside thread. turn servo at speed/time according to speed_times
-
-        speed_times - list of (speed, time) tuple
-        """
-        for speed, time_ in speed_times:
-            self.turn(speed, time_)
-
-    def turn(self, speed, time):
-
+        self.executor = executor
+        self.metrics = metrics
+        self.tracer = tracer
+
+        self.queue = TreatQueue(threads=threads, capacity=config.TREAT_QUEUE_SIZE,
+                                max_portions=config.TREAT_QUEUE_SIZE * config.MAX_TREAT_COUNT)
+        self.current_time = 0.0  # duration of job being dispensed right now
+        self._traces = ()  # (trace id, ticks_us when queued) of job being dispensed
+        self._started = 0  # ticks_us when it started
+
+        self.plans = {idx: self._compile(sizes) for idx, sizes in config.PORTION_SIZES.items()}
+        self.plan_cache = motion.PlanCache(config.PLAN_CACHE_SIZE)
+        self._executor_done = ThreadSafeFlag() if executor else None
+
+    def start(self):  # pragma: no cover
+        """ start the servo worker thread, or executor task (with executor) """
+        if self.executor:
+            asyncio.create_task(self.run_executor())
+        else:
+            self.threads.start_new_thread(self.worker, ())
+
+    def worker(self):  # pragma: no cover
+        """ function called inside the (only) servo thread, dispense jobs forever """
+        while True:
+            self.work_once(block=True)
+
+    def work_once(self, block=False) -> bool:
+        """ dispense one queued job, return False if there was nothing to do """
+        item = self.queue.get(block)
+        if item is None:
+            return False
+
+        plan, repeat, duration, traces = item
+        self._job_started(plan, repeat, duration, traces)
+        for _ in range(repeat):
+            self.turn(plan)
+        self._job_done()
+        self.current_time = 0.0
+        return True
+
+    def _job_started(self, plan, repeat, duration, traces):
+        self.current_time = duration
+        if self.metrics:
+            self.metrics.add_servo_time(motion.plan_on_ms(plan) * repeat)
+        if traces:
+            now = self.stdlib.ticks_us()
+            for trace, queued in traces:
+                self.tracer.span(trace, "queue", queued, now)
+            self._traces = traces
+            self._started = now
+            self.servo.begin(traces[0][0])
+
+    def _job_done(self):
+        if not self._traces:
+            return
+
+        now = self.stdlib.ticks_us()
+        self.servo.end()
+        for trace, _ in self._traces:
+            self.tracer.span(trace, "motor", self._started, now)
+            self.tracer.finish(trace)
+        self._traces = ()
+
+    def wait_time(self) -> float:
+        """ estimated time (in seconds) after which newly queued job will start """
+        return self.queue.pending_time + self.current_time
+
+    def in_flight(self) -> int:
+        """ number of jobs queued or being dispensed """
+        return len(self.queue) + (1 if self.current_time else 0)
+
+    def treat(self, plan, count=1, trace=None):
+        """ enqueue motion plan to be done `count` times, raise QueueFullError when worker
+        is too busy. Spans of the job are recorded under `trace` (id), the trace is finished
+        when the job is done, or right away when it is not queued """
+        queued = (trace, self.stdlib.ticks_us()) if trace and self.tracer else None
+        try:
+            self.queue.put(plan, motion.plan_duration(plan), count, queued)
+        except QueueFullError as e:
+            if queued:
+                self.tracer.finish(trace)
+            raise QueueFullError(e.depth, self.wait_time())
+
+        if self.executor:
+            try:
+                self.stdlib.schedule(self._execute_next, None)
+            except RuntimeError:  # schedule queue is full, the job is queued already
+                self._executor_done.set()
+
+    async def run_executor(self):
+        """ event loop task, which hands the next job to executor when it finished one. Timer
+        callback only wakes it up - queue lock is not reentrant, and the callback may come
+        while a handler holds it """
+        while True:
+            await self._executor_done.wait()
+            self._execute_next()
+
+    def _execute_next(self, _=None):
+        """ hand the next queued job to executor, if it is idle. Called from scheduler (after
+        treat) or executor task only, so it never runs twice at once """
+        if self.executor.busy:
+            return
+
+        self._job_done()
+        item = self.queue.get(False)
+        if item is None:
+            self.current_time = 0.0
+            return
+
+        plan, repeat, duration, traces = item
+        self._job_started(plan, repeat, duration, traces)
+        self.executor.start(plan, repeat, self._executor_done.set)
+
+    def _compile(self, sizes: list):
+        config = self.config
+        return motion.compile_sizes(sizes, turn_speed=config.TURN_SPEED, full_angle_time=config.FULL_ANGLE_TIME,
+                                    ramp_steps=config.RAMP_STEPS, ramp_time=config.RAMP_TIME)
+
+    def plan_for_portion(self, portion_idx: int):
+        """ precompiled plan for portion from PORTION_SIZES """
+        return self.plans[portion_idx]
+
+    def plan_for_sizes(self, sizes: str):
+        """ plan for comma separated sizes, eg. "0.2,-0.5" """
+        plan = self.plan_cache.get(sizes)
+        if plan is None:
+            plan = self._compile([float(size) for size in sizes.split(",")])
+            self.plan_cache.put(sizes, plan)
+        return plan
+
+    def turn(self, plan):
+        """ called inside servo thread. turn servo according to motion plan """
         servo = self.servo
         stdlib = self.stdlib
 
-        logger.debug("turn(speed=%s, time=%s)", speed, time)
-        logger.debug("set speed to %s", speed)
-        servo.speed(speed)
+        logger.debug("turn(plan=%s)", plan)
+        for i in range(0, len(plan), 2):
+            servo.duty(plan[i])
+            if plan[i + 1]:
+                stdlib.sleep(plan[i + 1] / 1000000)
 
-        logger.debug("wait %s seconds", time)
-        stdlib.sleep(time)
 
-        logger.debug("set speed to 0")
-        servo.speed(0)
+class TracingServo:
+    """ servo, which records span of every duty (as "duty<value>") set while a trace is
+    begun, so the trace shows how long the servo was driven at which duty. Duties may be
+    set from timer callbacks, which must not take tracer's lock - spans are recorded at
+    end() """
+
+    def __init__(self, *, servo, tracer, clock):
+        self.servo = servo
+        self.tracer = tracer
+        self.clock = clock
+        self.trace = None
+        self._duties = []  # (duty, ticks_us when it was set)
+
+    def begin(self, trace):
+        self.trace = trace
+        self._duties = []
+
+    def end(self):
+        duties = self._duties
+        until = self.clock.ticks_us()
+        for i in range(len(duties) - 1, -1, -1):
+            duty, since = duties[i]
+            duties[i] = ("duty%s" % duty, since, until)
+            until = since
+        for span in duties:
+            self.tracer.span(self.trace, *span)
+        self._duties = []
+        self.trace = None
+
+    def duty(self, duty):
+        if self.trace is not None:
+            self._duties.append((duty, self.clock.ticks_us()))
+        self.servo.duty(duty)
+
+
+if hasattr(asyncio, "core"):  # pragma: no cover
+    def _readable(sock):
+        """ wait until non-blocking socket has something to read, uasyncio polls it with
+        the other streams """
+        yield asyncio.core._io_queue.queue_read(sock)
+else:
+    async def _readable(sock):
+        loop = asyncio.get_event_loop()
+        ready = loop.create_future()
+        loop.add_reader(sock, ready.set_result, None)
+        try:
+            await ready
+        finally:
+            loop.remove_reader(sock)
+
+
+class TreatDatagramServer:
+    """ treats requested over UDP (see UDP_TREAT). Answers of the last `config.UDP_DEDUPE_WINDOW`
+    accepted requests are remembered, so retransmitted request is answered, but not dispensed
+    again. Refused one (busy, bad request) is not remembered - its retransmit is tried again.
+    Request with trace id (UDP_TRACE) is traced with `tracer` """
+
+    def __init__(self, *, treat_logic, config, metrics=None, stdlib=None, tracer=None):
+        self.treat_logic = treat_logic
+        self.config = config
+        self.metrics = metrics
+        self.stdlib = stdlib
+        self.tracer = tracer
+        self.sock = None
+
+        self._keys = [None] * config.UDP_DEDUPE_WINDOW  # (address, seq) of handled requests
+        self._acks = [None] * config.UDP_DEDUPE_WINDOW
+        self._next = 0
+        self._request_size = struct.calcsize(UDP_TREAT)
+        self._trace_size = struct.calcsize(UDP_TRACE)
+
+    def bind(self, host="0.0.0.0", port=None):
+        """ open non-blocking socket, return address it is bound to """
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(socket.getaddrinfo(host, port or self.config.UDP_PORT)[0][-1])
+        self.sock.setblocking(False)
+        return self.sock.getsockname()
+
+    async def serve(self):
+        sock = self.sock
+        while True:
+            try:
+                data, addr = sock.recvfrom(64)
+            except OSError:  # nothing received
+                await _readable(sock)
+            else:
+                ack = self.handle(data, addr)
+                if ack is not None:
+                    try:
+                        sock.sendto(ack, addr)
+                    except OSError as e:  # pragma: no cover
+                        logger.info("could not send ack to %s: %r", addr, e)
+
+    def handle(self, data: bytes, addr):
+        """ handle one datagram, return answer to be sent back (or None) """
+        size = self._request_size
+        if len(data) not in (size, size + self._trace_size):
+            logger.info("ignoring datagram of %s bytes from %s", len(data), addr)
+            return None
+
+        start = self.stdlib.ticks_us() if self.tracer else 0
+        magic, seq, portion, count = struct.unpack(UDP_TREAT, data[:size])
+        if magic != b"TQ":
+            logger.info("ignoring datagram %r from %s", magic, addr)
+            return None
+
+        key = (addr, seq)
+        for i, known in enumerate(self._keys):
+            if known == key:
+                logger.debug("duplicate treat #%s from %s", seq, addr)
+                return self._acks[i]
+
+        trace = None
+        if self.tracer and len(data) > size:
+            trace = "%08x" % struct.unpack(UDP_TRACE, data[size:])[0]
+            self.tracer.span(trace, "udp", start)
+
+        status = self._treat(portion, count, trace)
+        if trace and status == UDP_BAD_REQUEST:
+            self.tracer.finish(trace)
+        ack = struct.pack(UDP_ACK, b"TA", seq, status)
+        if status == UDP_OK:
+            self._keys[self._next] = key
+            self._acks[self._next] = ack
+            self._next = (self._next + 1) % len(self._keys)
+        return ack
+
+    def _treat(self, portion: int, count: int, trace=None) -> int:
+        try:
+            plan = self.treat_logic.plan_for_portion(portion)
+        except KeyError:
+            logger.info("unknown portion %s requested over udp", portion)
+            return UDP_BAD_REQUEST
+        if not 1 <= count <= self.config.MAX_TREAT_COUNT:
+            logger.info("bad count %s requested over udp", count)
+            return UDP_BAD_REQUEST
+
+        try:
+            self.treat_logic.treat(plan, count, trace)
+        except QueueFullError as e:
+            logger.info("treat queue is full: %s", e)
+            return UDP_BUSY
+
+        if self.metrics:
+            self.metrics.count_treat(portion, count)
+        return UDP_OK
 
 
 class TreatApp:
-    def __init__(self, treat_logic, config, stdlib, templates):
+    ROUTES = ("/", "/treat", "/static/<name>", "/metrics")
+
+    def __init__(self, treat_logic, config, stdlib, templates, assets=None, metrics=None, datagrams=None,
+                 tracer=None):
         self.treat_logic = treat_logic
         self.config = config
         self.stdlib = stdlib
         self.templates = templates
+        self.assets = assets
+        self.metrics = metrics
+        self.datagrams = datagrams
+        self.tracer = tracer
+        # ticks_us are counted from reset, so this is time from power-on to first request
+        self.first_request_us = None
+
+        self.index_response = CachedResponse(templates.INDEX.encode(), "text/html; charset=UTF-8")
+        self.ok_response = CachedResponse(b'{"result": "ok"}', "application/json", compress=False)
+
+        self.app = KeepAliveMicrodot()
+        self.app.before_request(self._first_request)
+        self._route("/", self.index)
+        self._route("/treat", self.treat, methods=["POST"])
+        if assets:
+            self._route("/static/<name>", self.static)
+        if metrics:
+            self._route("/metrics", self.export_metrics)
+
+    def _route(self, url, handler, methods=None):
+        if self.metrics:
+            handler = self._timed(self.metrics.route_idx(url), handler)
+        self.app.route(url, methods=methods or ["GET"])(handler)
+
+    def _timed(self, route_idx, handler):
+        """ wrap handler, so its latency is observed in metrics """
+        metrics = self.metrics
+        stdlib = self.stdlib
 
-        self.app = Microdot()
-        self.app.route("/")(self.index)
-        self.app.route("/treat", methods=["POST"])(self.treat)
-
-    def run(self):  # pragma: no cover
-        self.stdlib.init_logging()
-        self.stdlib.init_wifi()
-        self.app.run(debug=True, port=self.config.LISTEN_PORT)
+        async def timed(req, **kwargs):
+            start = stdlib.ticks_us()
+            try:
+                return await handler(req, **kwargs)
+            finally:
+                metrics.observe_request(route_idx, stdlib.ticks_diff(stdlib.ticks_us(), start) // 1000)
 
-    def index(self, req):
-        return Response(body=self.templates.INDEX, headers={"Content-Type": "text/html"})
+        return timed
 
-    def _parse_sizes(self, req) -> list:
-        """ return sizes from portion and sizes POST parameters 
-        """
+    def run(self):  # pragma: no cover
+        asyncio.run(self.serve())
+
+    async def serve(self):  # pragma: no cover
+        """ start serving right away, wifi (client) comes up in background """
+        self.stdlib.init_logging(self.config)
+        self.treat_logic.start()
+        self.app.keepalive_timeout = self.config.HTTP_KEEPALIVE_TIMEOUT
+        server = asyncio.create_task(self.app.start_server(debug=True, port=self.config.LISTEN_PORT))
+        if self.datagrams:
+            self.datagrams.bind()
+            asyncio.create_task(self.datagrams.serve())
+        self.wifi = await self.stdlib.init_wifi()
+        await server
+
+    def _first_request(self, req):
+        if self.first_request_us is None:
+            self.first_request_us = self.stdlib.ticks_us()
+            logger.info("first request %s ms after boot", self.first_request_us // 1000)
+
+    async def index(self, req):
+        return self.index_response.response(req)
+
+    async def static(self, req, name):
+        return self.assets.response(req, name)
+
+    async def export_metrics(self, req):
+        gauges = [("jobs_in_flight", "Treat jobs queued or being dispensed.", self.treat_logic.in_flight())]
+        if self.first_request_us is not None:
+            gauges.append(("boot_to_first_request_seconds", "Time from boot to the first HTTP request.",
+                           self.first_request_us / 1000000))
+        if hasattr(gc, "mem_free"):  # pragma: no cover (micropython only)
+            gauges.append(("mem_free_bytes", "Free heap.", gc.mem_free()))
+            gauges.append(("mem_alloc_bytes", "Allocated heap.", gc.mem_alloc()))
+
+        return Response(body=self.metrics.render(gauges), headers={"Content-Type": "text/plain; version=0.0.4"})
+
+    def _parse_plan(self, req):
+        """ return (portion, motion plan) from portion and sizes POST parameters. Raises
+        ValueError if they are not numbers """
         sizes = req.json.get("sizes", None)
-        portion_idx = float(req.json.get("portion", 2))
-
-        logger.debug("portion_idx=%s (%s)", portion_idx, type(portion_idx))
-
         if sizes:
-            sizes = [float(size) for size in sizes.split(",")]
-        else:
-            sizes = self.config.PORTION_SIZES[portion_idx]
-
-        logger.debug("sizes=%s", sizes)
-        return sizes
-
-    def treat(self, req):
-
-        sizes = self._parse_sizes(req)
-
-        self.treat_logic.treat(sizes)
-
-        return Response(body={"result": "ok"})
+            return ADHOC_PORTION, self.treat_logic.plan_for_sizes(sizes)
+
+        portion_idx = int(float(req.json.get("portion", 2)))  # "2.0" is portion 2 too
+        return portion_idx, self.treat_logic.plan_for_portion(portion_idx)
+
+    async def treat(self, req):
+        trace = req.headers.get(tracing.HEADER) if self.tracer else None
+        start = self.stdlib.ticks_us() if trace else 0
+
+        try:
+            portion, plan = self._parse_plan(req)
+            count = int(req.json.get("count", 1))
+        except ValueError as e:
+            logger.info("bad treat request: %r", e)
+            return Response(body={"result": "bad request"}, status_code=400)
+        if trace:
+            self.tracer.span(trace, "http", start)  # the rest of it is recorded by treat_logic
+        if not 1 <= count <= self.config.MAX_TREAT_COUNT:
+            if trace:
+                self.tracer.finish(trace)
+            return Response(body={"result": "bad request", "max_count": self.config.MAX_TREAT_COUNT},
+                            status_code=400)
+
+        try:
+            self.treat_logic.treat(plan, count, trace)
+        except QueueFullError as e:
+            logger.info("treat queue is full: %s", e)
+            return Response(body={"result": "busy", "queue_depth": e.depth, "wait": e.wait},
+                            status_code=503, headers={"Retry-After": str(math.ceil(e.wait))})
+
+        if self.metrics:
+            self.metrics.count_treat(portion, count)
+
+        return self.ok_response.response()
 
 
 if __name__ == '__main__':  # pragma: no cover
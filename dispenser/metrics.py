@@ -0,0 +1,81 @@
+"""
+prometheus-style metrics of the dispenser. All counters live in arrays preallocated at
+startup, so updating them allocates nothing.
+"""
+from array import array
+
+# upper bounds of request latency histogram buckets (+Inf bucket is implicit)
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+ADHOC_PORTION = "sizes"  # label of treats with sizes given in request instead of portion
+
+
+class Metrics:
+    def __init__(self, *, routes, portions):
+        self.routes = tuple(routes)
+        self.portions = tuple(portions) + (ADHOC_PORTION,)
+        self._portion_idx = {portion: i for i, portion in enumerate(self.portions)}
+
+        buckets = len(LATENCY_BUCKETS_MS) + 1
+        self.requests = array('L', [0] * len(self.routes))
+        self.latency_sum_ms = array('L', [0] * len(self.routes))
+        self.latency_buckets = array('L', [0] * (len(self.routes) * buckets))  # not cumulative
+        self.treats = array('L', [0] * len(self.portions))
+        self.servo_on_ms = array('L', [0])
+
+    def route_idx(self, route) -> int:
+        """ index of route, to be resolved once (when registering handlers) """
+        return self.routes.index(route)
+
+    def observe_request(self, route_idx: int, latency_ms: int):
+        self.requests[route_idx] += 1
+        self.latency_sum_ms[route_idx] += latency_ms
+
+        bucket = 0
+        for bound in LATENCY_BUCKETS_MS:
+            if latency_ms <= bound:
+                break
+            bucket += 1
+        self.latency_buckets[route_idx * (len(LATENCY_BUCKETS_MS) + 1) + bucket] += 1
+
+    def count_treat(self, portion, count=1):
+        """ count treat(s) of portion index (or ADHOC_PORTION) """
+        self.treats[self._portion_idx[portion]] += count
+
+    def add_servo_time(self, on_ms: int):
+        self.servo_on_ms[0] += on_ms
+
+    def render(self, gauges):
+        """ generate lines of text exposition format. gauges are (name, help, value) """
+        yield "# HELP dispenser_http_requests_total Handled HTTP requests.\n"
+        yield "# TYPE dispenser_http_requests_total counter\n"
+        for i, route in enumerate(self.routes):
+            yield 'dispenser_http_requests_total{route="%s"} %s\n' % (route, self.requests[i])
+
+        yield "# HELP dispenser_http_request_duration_seconds Time spent in request handler.\n"
+        yield "# TYPE dispenser_http_request_duration_seconds histogram\n"
+        buckets = len(LATENCY_BUCKETS_MS) + 1
+        for i, route in enumerate(self.routes):
+            cumulative = 0
+            for b in range(buckets):
+                cumulative += self.latency_buckets[i * buckets + b]
+                le = "%s" % (LATENCY_BUCKETS_MS[b] / 1000) if b < len(LATENCY_BUCKETS_MS) else "+Inf"
+                yield 'dispenser_http_request_duration_seconds_bucket{route="%s",le="%s"} %s\n' % (
+                    route, le, cumulative)
+            yield 'dispenser_http_request_duration_seconds_sum{route="%s"} %s\n' % (
+                route, self.latency_sum_ms[i] / 1000)
+            yield 'dispenser_http_request_duration_seconds_count{route="%s"} %s\n' % (route, self.requests[i])
+
+        yield "# HELP dispenser_treats_total Treats accepted, per portion.\n"
+        yield "# TYPE dispenser_treats_total counter\n"
+        for i, portion in enumerate(self.portions):
+            yield 'dispenser_treats_total{portion="%s"} %s\n' % (portion, self.treats[i])
+
+        yield "# HELP dispenser_servo_on_seconds_total Time the servo has been turning.\n"
+        yield "# TYPE dispenser_servo_on_seconds_total counter\n"
+        yield "dispenser_servo_on_seconds_total %s\n" % (self.servo_on_ms[0] / 1000)
+
+        for name, help_, value in gauges:
+            yield "# HELP dispenser_%s %s\n" % (name, help_)
+            yield "# TYPE dispenser_%s gauge\n" % name
+            yield "dispenser_%s %s\n" % (name, value)
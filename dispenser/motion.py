@@ -0,0 +1,100 @@
+"""
+motion plans - servo moves precompiled into flat array of (duty, duration in us) pairs
+"""
+import math
+from array import array
+
+# max rotation is for duty 38 clockwise  and 8 anticlockwise.
+# 23 is no rotation (middle point)
+MIDDLE_DUTY = 23
+SPEED_RANGE = 15  # 38 - 23
+
+
+def speed_to_duty(speed) -> int:
+    """ duty for servo speed, speed 1 is one turn per two seconds. Speed 0 switches pwm
+    off (duty 0) """
+    if speed == 0:
+        return 0
+
+    speed = max(min(speed, 1.0), -1.0)
+    return MIDDLE_DUTY + int(speed * SPEED_RANGE)
+
+
+def duty_to_speed(duty) -> float:
+    """ real speed of servo for given (non zero) duty, inverse of speed_to_duty """
+    return (duty - MIDDLE_DUTY) / SPEED_RANGE
+
+
+def compile_sizes(sizes, *, turn_speed, full_angle_time, ramp_steps=0, ramp_time=0.0):
+    """ compile list of turn sizes (in full angles, negative is backward) to plan.
+
+    Every turn is cruise at turn_speed, optionally surrounded by `ramp_steps` steps of
+    acceleration and deceleration, each step `ramp_time / ramp_steps` long. Cruise is
+    shortened by what ramps cover, so the turn angle stays the same. Turns too short for
+    ramps are done without them. Every turn ends with stop.
+    """
+    plan = array('l')
+    for size in sizes:
+        speed = turn_speed * math.copysign(1, size)
+        cruise_duty = speed_to_duty(speed)
+        total = abs(size * full_angle_time / turn_speed)
+
+        ramp = []
+        cruise = total
+        if ramp_steps:
+            step_time = ramp_time / ramp_steps
+            cruise_speed = duty_to_speed(cruise_duty)
+            for i in range(1, ramp_steps + 1):
+                ramp.append(speed_to_duty(speed * i / (ramp_steps + 1)))
+            # angle covered by ramps up and down, in seconds of cruise
+            covered = 2 * sum(duty_to_speed(duty) for duty in ramp) * step_time / cruise_speed
+            if covered <= total:
+                cruise = total - covered
+            else:
+                ramp = []
+
+        for duty in ramp:
+            plan.extend((duty, int(step_time * 1000000)))
+        plan.extend((cruise_duty, int(cruise * 1000000)))
+        for duty in reversed(ramp):
+            plan.extend((duty, int(step_time * 1000000)))
+        plan.extend((0, 0))
+
+    return plan
+
+
+def plan_duration(plan) -> float:
+    """ time in seconds needed to execute the plan """
+    return sum(plan[i] for i in range(1, len(plan), 2)) / 1000000
+
+
+def plan_on_ms(plan) -> int:
+    """ time in milliseconds, for which servo turns during the plan """
+    on_us = 0
+    for i in range(0, len(plan), 2):
+        if plan[i]:
+            on_us += plan[i + 1]
+    return on_us // 1000
+
+
+class PlanCache:
+    """ small LRU cache of compiled plans """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._plans = {}
+        self._order = []  # least recently used first
+
+    def get(self, key):
+        plan = self._plans.get(key, None)
+        if plan is not None:
+            self._order.remove(key)
+            self._order.append(key)
+        return plan
+
+    def put(self, key, plan):
+        if key not in self._plans and len(self._order) >= self.capacity:
+            del self._plans[self._order.pop(0)]
+        elif key in self._plans:
+            self._order.remove(key)
+        self._plans[key] = plan
+        self._order.append(key)
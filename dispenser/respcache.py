@@ -0,0 +1,84 @@
+"""
+responses with constant bodies - encoded, gzipped and hashed once at startup
+"""
+import binascii
+import hashlib
+import io
+
+from aserver import Response
+
+
+# bodies shorter than this are not worth compressing
+MIN_GZIP_SIZE = 256
+
+
+def gzip_compress(data: bytes):
+    """ return gzipped data, or None if there is no way to compress here """
+    try:
+        import gzip
+    except ImportError:  # pragma: no cover
+        return _deflate_compress(data)
+
+    return gzip.compress(data, mtime=0)
+
+
+def _deflate_compress(data: bytes):  # pragma: no cover
+    try:
+        import deflate  # micropython >= 1.21
+    except ImportError:
+        return None
+
+    buf = io.BytesIO()
+    try:
+        with deflate.DeflateIO(buf, deflate.GZIP) as f:
+            f.write(data)
+    except OSError:  # firmware built without compression support
+        return None
+    return buf.getvalue()
+
+
+class CachedResponse:
+    """ response with constant body. Supports conditional GET (ETag / If-None-Match) and
+    gzip for clients, which accept it. Gzipped body is other representation, it has ETag
+    of its own (with "-gz"), and both vary on Accept-Encoding.
+
+    max_age - seconds for Cache-Control, None means client has to revalidate every time
+    """
+    def __init__(self, body: bytes, content_type: str, max_age=None, compress=True):
+        self.body = body
+        self.etag = '"%s"' % binascii.hexlify(hashlib.sha256(body).digest()[:8]).decode()
+
+        cache_control = "no-cache" if max_age is None else "max-age=%s" % max_age
+        self.headers = {"Content-Type": content_type, "Content-Length": str(len(body)),
+                        "ETag": self.etag, "Cache-Control": cache_control}
+        self.not_modified_headers = {"ETag": self.etag, "Cache-Control": cache_control}
+
+        self.gz_body = gzip_compress(body) if compress and len(body) >= MIN_GZIP_SIZE else None
+        if self.gz_body is not None and len(self.gz_body) >= len(body):
+            self.gz_body = None
+
+        self.gz_etag = None
+        self.gz_headers = None
+        self.gz_not_modified_headers = None
+        if self.gz_body is not None:
+            self.gz_etag = self.etag[:-1] + '-gz"'
+            self.headers["Vary"] = self.not_modified_headers["Vary"] = "Accept-Encoding"
+            self.gz_headers = dict(self.headers, **{"Content-Encoding": "gzip", "ETag": self.gz_etag,
+                                                    "Content-Length": str(len(self.gz_body))})
+            self.gz_not_modified_headers = dict(self.not_modified_headers, ETag=self.gz_etag)
+
+    def response(self, req=None):
+        """ Response for request req (or plain response if req is None) """
+        if req is not None:
+            headers = req.headers
+            if_none_match = headers.get("If-None-Match", "")
+            if self.gz_etag is not None and self.gz_etag in if_none_match:
+                return Response(body=b"", status_code=304, reason="Not Modified",
+                                headers=self.gz_not_modified_headers)
+            if self.etag in if_none_match:
+                return Response(body=b"", status_code=304, reason="Not Modified",
+                                headers=self.not_modified_headers)
+            if self.gz_body is not None and "gzip" in headers.get("Accept-Encoding", ""):
+                return Response(body=self.gz_body, headers=self.gz_headers)
+
+        return Response(body=self.body, headers=self.headers)
@@ -4,6 +4,8 @@ import math
 import utime
 from random import random
 
+import motion
+
 
 class Servo:
     def __init__(self, pin_num):
@@ -23,13 +25,14 @@ class Servo:
         
         logging.debug("speed after reduction=%s", speed)
 
-        # max rotation is for duty 38 clockwise  and 8 anticlockwise. 
-        # 23 is no rotation (middle point)
-        speed_range = 15  # 38 - 23
-        duty = 23 + int(speed * speed_range)
+        duty = motion.speed_to_duty(speed)
         logging.debug("duty=%s", duty)
         self.pwm.duty(duty)
 
+    def duty(self, duty):
+        """ set raw pwm duty, as precompiled in motion plan """
+        self.pwm.duty(duty)
+
     # debug things, #TODO: remove this function
     def pm(self, speed):
         self.speed(speed)
@@ -0,0 +1,8 @@
+// treat buttons, no jQuery needed
+document.querySelectorAll("button[name=portion]").forEach(function (button) {
+    button.addEventListener("click", function () {
+        fetch("/treat", {method: "POST",
+                         headers: {"Content-Type": "application/json"},
+                         body: JSON.stringify({"portion": button.value})});
+    });
+});
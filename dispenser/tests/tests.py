@@ -1,25 +1,91 @@
+import json
+import logging
+import os
+import socket
+import struct
+import sys
+import time
 import unittest
 
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio  # type: ignore
+
+try:
+    import gzip
+except ImportError:  # micropython, tests of gzipped bodies are skipped
+    gzip = None  # type: ignore
+
+try:
+    import tempfile
+except ImportError:  # micropython, tests of assets directory are skipped
+    tempfile = None  # type: ignore
+
 import config
+import executor
+import logfilter
 import main
+import metrics
+import motion
+import respcache
+import assets
+import tracing
+
+try:
+    import machine
+except ImportError:  # not in micropython, use stubs with virtual Timer
+    sys.path.append("localstubs")
+    import machine
+
+from .utils import run_until_complete
 
 class RequestStub:
-    def __init__(self, json):
+    def __init__(self, json=None, headers=None):
         self.json = json
+        self.headers = headers or {}
+
+
+class LockStub:
+    def __init__(self):
+        self._locked = False
+
+    def acquire(self, waitflag=1):
+        if self._locked:
+            assert not waitflag, "blocking acquire of locked LockStub would never return"
+            return False
+        self._locked = True
+        return True
+
+    def release(self):
+        assert self._locked
+        self._locked = False
+
+    def locked(self):
+        return self._locked
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, *args):
+        self.release()
 
 
 class ThreadsStub:
     def start_new_thread(self, fn, args, kwargs):
         fn(*args, **kwargs)
 
+    def allocate_lock(self):
+        return LockStub()
+
 
 class TemplatesStub:
-    ...
+    INDEX = ""
 
 
 class ConfigStub:
     """ just empty object, to be filled ad-hoc """
-    pass
+    MAX_TREAT_COUNT = 5
 
 
 class ServoStub:
@@ -27,37 +93,95 @@ class ServoStub:
         self.init_args = args
         self.init_kwargs = kwargs
         self.used_speeds = []
+        self.used_duties = []
 
     def speed(self, speed):
         self.used_speeds.append(speed)
 
+    def duty(self, duty):
+        self.used_duties.append(duty)
+
 
 class StdlibStub:
     def __init__(self):
         self.uslept = []
+        self.now_us = 0
 
     def sleep(self, time_: float):
         self.uslept.append(time_)
 
-    def init_wifi(self):
+    def ticks_us(self):
+        return self.now_us
+
+    def ticks_diff(self, ticks1, ticks2):
+        return ticks1 - ticks2
+
+    async def init_wifi(self):
         pass  # do nothing in tests
 
-    def init_logging(self):
+    def init_logging(self, config):
         pass  # do nothing in tests
 
+    def schedule(self, fn, arg):
+        fn(arg)
+
+
+class ClockStub:
+    """ utime ticks over virtual clock of machine.Timer stub """
+    def ticks_us(self):
+        return machine.Timer.ticks_us()
+
+    def ticks_add(self, ticks, delta):
+        return ticks + delta
+
+    def ticks_diff(self, ticks1, ticks2):
+        return ticks1 - ticks2
+
 
 class TreatLogicStub:
     def __init__(self):
         self.sizes = []
+        self.counts = []
+
+    def plan_for_portion(self, portion_idx: int):
+        return ("portion", portion_idx)
+
+    def plan_for_sizes(self, sizes: str):
+        return [float(size) for size in sizes.split(",")]
 
-    def treat(self, sizes: list):
-        self.sizes.extend(sizes)
+    def treat(self, plan, count=1, trace=None):
+        self.sizes.extend(plan)
+        self.counts.append(count)
+
+    def in_flight(self):
+        return 3
+
+
+class BusyTreatLogicStub(TreatLogicStub):
+    def treat(self, plan, count=1, trace=None):
+        raise main.QueueFullError(4, 7.5)
+
+
+def logic_config(**kwargs):
+    """ ConfigStub with the configuration TreatLogic needs """
+    config = ConfigStub()
+    config.TURN_SPEED = 1
+    config.FULL_ANGLE_TIME = 2
+    config.TREAT_QUEUE_SIZE = 2
+    config.PORTION_SIZES = {1: [1], 2: [-0.5]}
+    config.RAMP_STEPS = 0
+    config.RAMP_TIME = 0
+    config.PLAN_CACHE_SIZE = 2
+    for key, value in kwargs.items():
+        setattr(config, key, value)
+    return config
 
 
 #  TreatApp.treat(POST) -> 
-#       TurnLogic.treat(sizes: list of turn sizes) -> 
-#           TurnLogic.turn((speed: int, time:float)) -> 
-#               Servo.speed(...)
+#       TurnLogic.plan_for_portion / plan_for_sizes (motion plan) ->
+#       TurnLogic.treat(plan) -> queue -> worker ->
+#           TurnLogic.turn(plan: (duty, time in us) pairs) ->
+#               Servo.duty(...)
 
 
 class TestTreatApp(unittest.TestCase):
@@ -77,26 +201,100 @@ class TestTreatApp(unittest.TestCase):
         templates.INDEX = "Cest un index"
         
         app = self.treatApp(templates=templates)
-        ret = app.index(req=...)
+        ret = run_until_complete(app.index)(req=RequestStub())
         self.assertEqual(ret.body, b"Cest un index")
+
+    @unittest.skipIf(gzip is None, "no gzip to check the body with")
+    def test_index_is_cached(self):
+        templates = TemplatesStub()
+        templates.INDEX = "<p>Cest un index</p>" * 50
+
+        app = self.treatApp(templates=templates)
+        index = run_until_complete(app.index)
+
+        # WHEN: client accepting gzip asks for index
+        ret = index(req=RequestStub(headers={"Accept-Encoding": "gzip, deflate"}))
+
+        # THEN: it gets compressed body, which has been prepared in advance
+        self.assertEqual(ret.headers["Content-Encoding"], "gzip")
+        self.assertIs(ret.body, app.index_response.gz_body)
+        self.assertEqual(gzip.decompress(ret.body), templates.INDEX.encode())
+        self.assertEqual(ret.headers["Cache-Control"], "no-cache")
+        self.assertEqual(ret.headers["Vary"], "Accept-Encoding")
+        etag = ret.headers["ETag"]
+
+        # WHEN: client asks again with etag it has
+        ret = index(req=RequestStub(headers={"If-None-Match": etag, "Accept-Encoding": "gzip"}))
+
+        # THEN: the answer is just "not modified"
+        self.assertEqual(ret.status_code, 304)
+        self.assertEqual(ret.body, b"")
+        self.assertEqual(ret.headers, {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"})
+
+        # WHEN: client with no gzip support asks for index
+        ret = index(req=RequestStub(headers={"If-None-Match": '"other"'}))
+
+        # THEN: it gets plain body, which has etag of its own
+        self.assertEqual(ret.status_code, 200)
+        self.assertNotIn("Content-Encoding", ret.headers)
+        self.assertIs(ret.body, app.index_response.body)
+        self.assertEqual(ret.headers["Vary"], "Accept-Encoding")
+        plain_etag = ret.headers["ETag"]
+        self.assertEqual(plain_etag[:-1] + '-gz"', etag)
+
+        # WHEN: it asks again with the etag
+        ret = index(req=RequestStub(headers={"If-None-Match": plain_etag}))
+
+        # THEN: plain body is not modified
+        self.assertEqual(ret.status_code, 304)
+        self.assertEqual(ret.headers["ETag"], plain_etag)
+
+    def test_cached_response_not_compressed_if_not_worth_it(self):
+        self.assertIsNone(respcache.CachedResponse(b"x" * 10, "text/plain").gz_body)
+        self.assertNotIn("Vary", respcache.CachedResponse(b"x" * 10, "text/plain").headers)
+        self.assertIsNone(respcache.CachedResponse(os.urandom(1000), "text/plain").gz_body)
+        self.assertEqual(respcache.CachedResponse(b"x", "text/plain", max_age=60).headers["Cache-Control"],
+                         "max-age=60")
     
     def test_treat_with_portion(self):
-        """ check if treating with portion will run TurnLogic.treat(sizes) """
-        
-
-        # GIVEN: predefined portion with index '2'
-        config = ConfigStub()
-        config.PORTION_SIZES = {2: [0.5, 1.0]}
+        """ check if treating with portion will run TurnLogic.treat(plan) with precompiled plan """
         
         # GIVEN: application with stubbed TreadLogic
         treat_logic = TreatLogicStub()
-        app = self.treatApp(treat_logic=treat_logic, config=config)
+        app = self.treatApp(treat_logic=treat_logic)
 
         # WHEN: asking app for treat with portion=2
-        app.treat(RequestStub(json={'portion': 2}))
+        run_until_complete(app.treat)(RequestStub(json={'portion': "2"}))
+
+        # THEN: treat logic is called with plan of portion 2
+        self.assertEqual(treat_logic.sizes, ["portion", 2])
+        self.assertEqual(treat_logic.counts, [1])
+
+        # WHEN: portion comes as float number, or it is not a number at all
+        run_until_complete(app.treat)(RequestStub(json={'portion': "2.0"}))
+        ret = run_until_complete(app.treat)(RequestStub(json={'portion': "two"}))
+
+        # THEN: the float one is portion 2 as well, the other one is refused
+        self.assertEqual(treat_logic.sizes, ["portion", 2, "portion", 2])
+        self.assertEqual(ret.status_code, 400)
+        self.assertEqual(json.loads(ret.body), {"result": "bad request"})
 
-        # THEN: treat logic is called according to sizes configured in config
-        self.assertEqual(treat_logic.sizes, [0.5, 1.0])
+    def test_treat_with_count(self):
+        """ more portions (presses, which have waited on the button) in one request """
+        treat_logic = TreatLogicStub()
+        app = self.treatApp(treat_logic=treat_logic)
+
+        ret = run_until_complete(app.treat)(RequestStub(json={'portion': 2, 'count': 3}))
+        self.assertEqual(ret.status_code, 200)
+        self.assertEqual(treat_logic.counts, [3])
+
+        # WHEN: asking for too many portions at once
+        ret = run_until_complete(app.treat)(RequestStub(json={'portion': 2, 'count': 6}))
+
+        # THEN: request is refused, nothing is dispensed
+        self.assertEqual(ret.status_code, 400)
+        self.assertEqual(json.loads(ret.body), {"result": "bad request", "max_count": 5})
+        self.assertEqual(treat_logic.counts, [3])
 
 
     def test_treat_with_sizes(self):
@@ -107,39 +305,341 @@ class TestTreatApp(unittest.TestCase):
         app = self.treatApp(treat_logic=treat_logic)
 
         # WHEN asking app for treat with sizes=-1,1,-1
-        app.treat(RequestStub(json={'sizes': "-1,1,-1"}))
+        run_until_complete(app.treat)(RequestStub(json={'sizes': "-1,1,-1"}))
 
         # THEN: treat logic is called with the same sizes
         self.assertEqual(treat_logic.sizes, [-1.0, 1.0, -1.0])
 
+    def test_treat_when_queue_is_full(self):
+        """ check if full treat queue ends in 503 with queue depth and wait time """
+
+        # GIVEN: application with treat logic, which has no free slot in its queue
+        app = self.treatApp(treat_logic=BusyTreatLogicStub())
+
+        # WHEN asking app for treat
+        ret = run_until_complete(app.treat)(RequestStub(json={'sizes': "1"}))
+
+        # THEN: client is told to come back later
+        self.assertEqual(ret.status_code, 503)
+        self.assertEqual(ret.headers["Retry-After"], "8")
+        self.assertEqual(json.loads(ret.body), {"result": "busy", "queue_depth": 4, "wait": 7.5})
+
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+async def http_request(reader, writer, method, path, body=b"", headers=""):
+    """ send HTTP/1.1 request over opened connection, return (status, headers, body) """
+    writer.write(("%s %s HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                  "Content-Length: %s\r\n%s\r\n" % (method, path, len(body), headers)).encode() + body)
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    resp_headers = {}
+    while True:
+        line = (await reader.readline()).strip().decode()
+        if not line:
+            break
+        name, value = line.split(":", 1)
+        resp_headers[name.lower()] = value.strip()
+
+    resp_body = await reader.readexactly(int(resp_headers.get("content-length", 0)))
+    return status, resp_headers, resp_body
+
+
+class TestKeepAliveServer(unittest.TestCase):
+    CLIENTS = 10
+    SLOW_TIME = 0.2
+
+    def setUp(self):
+        templates = TemplatesStub()
+        templates.INDEX = "<html></html>"
+        self.treat_logic = TreatLogicStub()
+        self.app = main.TreatApp(treat_logic=self.treat_logic, config=ConfigStub(), stdlib=StdlibStub(),
+                                 templates=templates)
+        self.port = free_port()
+
+        self.in_flight = self.max_in_flight = 0
+
+        async def slow(req):
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            await asyncio.sleep(self.SLOW_TIME)
+            self.in_flight -= 1
+            return "slow"
+
+        self.app.app.route("/slow")(slow)
+
+    async def serving(self, coro):
+        """ run coro while TreatApp serves on local port """
+        server = asyncio.create_task(self.app.app.start_server(host="127.0.0.1", port=self.port))
+        await asyncio.sleep(0.05)
+        try:
+            return await coro
+        finally:
+            self.app.app.shutdown()
+            await server
+
+    @run_until_complete
+    async def test_requests_from_many_clients_overlap(self):
+        async def client():
+            reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+            status, _, body = await http_request(reader, writer, "GET", "/slow")
+            writer.close()
+            return status, body
+
+        async def clients():
+            return await asyncio.gather(*[client() for _ in range(self.CLIENTS)])
+
+        started = time.time()
+        results = await self.serving(clients())
+        elapsed = time.time() - started
+
+        # THEN: every client got its answer
+        self.assertEqual(results, [(200, b"slow")] * self.CLIENTS)
+        # ... and all the requests have been handled at the same time
+        self.assertEqual(self.max_in_flight, self.CLIENTS)
+        self.assertLess(elapsed, self.CLIENTS * self.SLOW_TIME / 2)
+
+    @run_until_complete
+    async def test_keepalive_connection_is_reused(self):
+        async def client():
+            reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+            results = []
+            for portion in (1, 2):
+                body = json.dumps({"sizes": str(portion)}).encode()
+                results.append(await http_request(reader, writer, "POST", "/treat", body))
+            results.append(await http_request(reader, writer, "GET", "/", headers="Connection: close\r\n"))
+            # server closed connection as asked
+            results.append(await reader.read())
+            writer.close()
+            return results
+
+        first, second, index, rest = await self.serving(client())
+
+        # THEN: both treats were handled over the same connection, which was kept alive
+        self.assertEqual(first[0], 200)
+        self.assertEqual(first[1]["connection"], "keep-alive")
+        self.assertEqual(second[0], 200)
+        self.assertEqual(self.treat_logic.sizes, [1.0, 2.0])
+        # ... and the last one closed it
+        self.assertEqual(index[1]["connection"], "close")
+        self.assertEqual(index[2], b"<html></html>")
+        self.assertEqual(rest, b"")
+
+    @run_until_complete
+    async def test_connection_closing(self):
+        self.app.app.keepalive_timeout = 0.1
+        self.app.app.max_keepalive_requests = 2
+
+        async def exchange(data):
+            reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+            writer.write(data)
+            await writer.drain()
+            ret = await reader.read()
+            writer.close()
+            return ret
+
+        async def client():
+            return [
+                # idle client
+                await exchange(b""),
+                # garbage instead of request
+                await exchange(b"GARBAGE\r\n\r\n"),
+                # HTTP/1.0 client without keep-alive
+                await exchange(b"GET /slow HTTP/1.0\r\n\r\n"),
+                # HTTP/1.0 client with keep-alive, but it sends more requests than allowed
+                await exchange(b"GET /slow HTTP/1.0\r\nConnection: keep-alive\r\n\r\n" * 3),
+            ]
+
+        idle, garbage, http10, too_many = await self.serving(client())
+
+        self.assertEqual(idle, b"")
+        self.assertTrue(garbage.startswith(b"HTTP/1.0 400"))
+        self.assertEqual(http10.count(b"Connection: close"), 1)
+        self.assertEqual(too_many.count(b"Connection: keep-alive"), 1)
+        self.assertEqual(too_many.count(b"Connection: close"), 1)
+
+
+class SlowStdlibStub(StdlibStub):
+    """ every look at the clock takes 30ms """
+    def ticks_us(self):
+        self.now_us += 30000
+        return self.now_us
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.metrics = metrics.Metrics(routes=main.TreatApp.ROUTES, portions=[1, 2])
+        self.treat_logic = TreatLogicStub()
+        self.app = main.TreatApp(treat_logic=self.treat_logic, config=ConfigStub(), stdlib=SlowStdlibStub(),
+                                 templates=TemplatesStub(), metrics=self.metrics)
+
+    def scrape(self):
+        res = run_until_complete(self.app.export_metrics)(RequestStub())
+        self.assertTrue(res.headers["Content-Type"].startswith("text/plain"))
+        return "".join(res.body)
+
+    def routes(self):
+        """ (methods, url, handler) registered in microdot """
+        for route in self.app.app.url_map:
+            yield route[0], route[1].url_pattern, route[2]
+
+    def test_requests_are_counted_per_route(self):
+        # WHEN: the app handles two treats and one index
+        handlers = {url: handler for _, url, handler in self.routes()}
+        run_until_complete(handlers["/treat"])(RequestStub(json={"portion": 2}))
+        run_until_complete(handlers["/treat"])(RequestStub(json={"sizes": "1,2"}))
+        run_until_complete(handlers["/"])(RequestStub())
+
+        text = self.scrape()
+
+        # THEN: requests are counted, with their latency (30ms in every handler)
+        self.assertIn('dispenser_http_requests_total{route="/treat"} 2\n', text)
+        self.assertIn('dispenser_http_requests_total{route="/"} 1\n', text)
+        self.assertIn('dispenser_http_request_duration_seconds_bucket{route="/treat",le="0.025"} 0\n', text)
+        self.assertIn('dispenser_http_request_duration_seconds_bucket{route="/treat",le="0.05"} 2\n', text)
+        self.assertIn('dispenser_http_request_duration_seconds_bucket{route="/treat",le="+Inf"} 2\n', text)
+        self.assertIn('dispenser_http_request_duration_seconds_sum{route="/treat"} 0.06\n', text)
+        # ... and treats are counted per portion
+        self.assertIn('dispenser_treats_total{portion="2"} 1\n', text)
+        self.assertIn('dispenser_treats_total{portion="1"} 0\n', text)
+        self.assertIn('dispenser_treats_total{portion="sizes"} 1\n', text)
+        # ... and gauges are there too
+        self.assertIn('dispenser_jobs_in_flight 3\n', text)
+
+    def test_time_to_first_request(self):
+        # GIVEN: the app was booted 800ms ago
+        self.app.stdlib.now_us = 800000
+
+        # WHEN: the first, and then another requests come
+        for _ in range(2):
+            for handler in self.app.app.before_request_handlers:
+                handler(RequestStub())
+
+        # THEN: time of the first one is reported
+        self.assertIn("dispenser_boot_to_first_request_seconds 0.83\n", self.scrape())
+
+    def test_slow_requests_go_to_inf_bucket(self):
+        self.metrics.observe_request(0, 10000)
+
+        self.assertIn('dispenser_http_request_duration_seconds_bucket{route="/",le="2.5"} 0\n', self.scrape())
+
+    def test_servo_time(self):
+        treat_logic = main.TreatLogic(config=logic_config(), servo=ServoStub(), stdlib=StdlibStub(),
+                                      threads=ThreadsStub(), metrics=self.metrics)
+
+        # WHEN: portion 1 (2 s) is dispensed twice
+        treat_logic.treat(treat_logic.plan_for_portion(1))
+        treat_logic.treat(treat_logic.plan_for_portion(1))
+        self.assertEqual(treat_logic.in_flight(), 1)
+        treat_logic.work_once()
+        self.assertEqual(treat_logic.in_flight(), 0)
+
+        # THEN: servo has been turning for 4 seconds
+        self.assertIn("dispenser_servo_on_seconds_total 4.0\n", self.scrape())
+
+
+class TestStaticAssets(unittest.TestCase):
+    CSS = b"body{color:red}" * 100
+
+    def setUp(self):
+        if gzip is None or tempfile is None:
+            self.skipTest("no gzip or tempfile to prepare the assets with")
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.directory = self.tmpdir.name
+        with open(os.path.join(self.directory, "app.css.gz"), "wb") as f:
+            f.write(gzip.compress(self.CSS))
+        with open(os.path.join(self.directory, "README"), "w") as f:
+            f.write("not an asset")
+        self.assets = assets.StaticAssets(self.directory, max_age=3600, chunk_size=64)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_asset_is_streamed(self):
+        res = self.assets.response(RequestStub(), "app.css")
+
+        # THEN: compressed file is sent with long-lived cache headers
+        self.assertEqual(res.headers["Content-Type"], "text/css")
+        self.assertEqual(res.headers["Content-Encoding"], "gzip")
+        self.assertEqual(res.headers["Cache-Control"], "max-age=3600")
+        # ... straight from file, in small chunks
+        chunks = []
+        while True:
+            chunk = res.body.read(res.send_file_buffer_size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        res.body.close()
+        self.assertTrue(all(len(chunk) <= 64 for chunk in chunks))
+        body = b"".join(chunks)
+        self.assertEqual(res.headers["Content-Length"], str(len(body)))
+        self.assertEqual(gzip.decompress(body), self.CSS)
+
+    def test_not_modified_and_not_found(self):
+        etag = self.assets.assets["app.css"][1]["ETag"]
+
+        res = self.assets.response(RequestStub(headers={"If-None-Match": etag}), "app.css")
+        self.assertEqual(res.status_code, 304)
+
+        res = self.assets.response(RequestStub(), "README")
+        self.assertEqual(res.status_code, 404)
+
+    def test_no_directory(self):
+        no_assets = assets.StaticAssets(os.path.join(self.directory, "nonexistent"), max_age=1)
+        self.assertEqual(no_assets.assets, {})
+
+    @run_until_complete
+    async def test_served_by_treat_app(self):
+        app = main.TreatApp(treat_logic=TreatLogicStub(), config=ConfigStub(), stdlib=StdlibStub(),
+                            templates=TemplatesStub(), assets=self.assets)
+        port = free_port()
+        server = asyncio.create_task(app.app.start_server(host="127.0.0.1", port=port))
+        await asyncio.sleep(0.05)
+
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        status, headers, body = await http_request(reader, writer, "GET", "/static/app.css")
+        writer.close()
+        app.app.shutdown()
+        await server
+
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["connection"], "keep-alive")
+        self.assertEqual(gzip.decompress(body), self.CSS)
 
 
 class TestTurnLogic(unittest.TestCase):
 
     def test_turnlogic_turn(self):
-        """ check if calling treatlogic.treat call set of treatlogic.turn """
+        """ check if calling treatlogic.treat call treatlogic.turn with the plan """
         
         _turns = []
-        def _turn(speed, time):
-            _turns.append((speed, time))
+        def _turn(plan):
+            _turns.append(list(plan))
 
-        # GIVEN: TURN_SPEED = 1, FULL_ANGLE_TIME=2
-        config = ConfigStub()
-        config.TURN_SPEED = 1
-        config.FULL_ANGLE_TIME = 2
+        # GIVEN: TURN_SPEED = 1, FULL_ANGLE_TIME=2, no ramps
+        config = logic_config()
         # GIVEN: real TreatLogic
         treat_logic = main.TreatLogic(config=config, threads=ThreadsStub(), servo=ServoStub(), stdlib=StdlibStub())
         # ... but TreatLogic.turn is mocked with custom function
         treat_logic.turn = _turn
 
-        # WHEN: calling TreatLogic.treat with sizes = [1, -0.5]
-        treat_logic.treat([1, -0.5])
+        # WHEN: calling TreatLogic.treat with sizes = 1,-0.5 and worker does its job
+        treat_logic.treat(treat_logic.plan_for_sizes("1,-0.5"))
+        self.assertTrue(treat_logic.work_once())
 
-        # THEN: turn has been called with speed, times: (1, 2), (-1, 1)
-        self.assertEqual(_turns, [(1, 2), (-1, 1)])
+        # THEN: turn has been called with duty, times: (38, 2s), stop, (8, 1s), stop
+        self.assertEqual(_turns, [[38, 2000000, 0, 0, 8, 1000000, 0, 0]])
 
     def test_turnlogic_servo(self):
-        """ check if calling treatlogic.treat will call Servo speed, wait, and then zero speed """
+        """ check if calling treatlogic.turn will set Servo duty, wait, and then zero duty """
  
         # GIVEN: servo is stubbed
         servo = ServoStub()
@@ -149,13 +649,673 @@ class TestTurnLogic(unittest.TestCase):
         # config is ... config module
         treat_logic = main.TreatLogic(config=config, servo=servo, stdlib=stdlib, threads=ThreadsStub())
  
-        # WHEN called TreatLogic.turn(10, 20)
-        treat_logic.turn(10, 20)
+        # WHEN called TreatLogic.turn with plan (duty 30 for 20s, stop)
+        treat_logic.turn([30, 20000000, 0, 0])
  
         # THEN: usleep was called with (20)
         self.assertEqual(stdlib.uslept, [20])
-        # ... and ServoStub.speed() was called two times , with 10 and with 0
-        self.assertEqual(servo.used_speeds, [10, 0])
+        # ... and ServoStub.duty() was called two times , with 30 and with 0
+        self.assertEqual(servo.used_duties, [30, 0])
+
+    def test_portions_are_precompiled(self):
+        treat_logic = main.TreatLogic(config=logic_config(), servo=ServoStub(), stdlib=StdlibStub(),
+                                      threads=ThreadsStub())
+
+        # THEN: every portion from config has its plan ready
+        self.assertEqual(list(treat_logic.plan_for_portion(1)), [38, 2000000, 0, 0])
+        self.assertEqual(list(treat_logic.plan_for_portion(2)), [8, 1000000, 0, 0])
+
+    def test_sizes_plans_are_cached(self):
+        treat_logic = main.TreatLogic(config=logic_config(), servo=ServoStub(), stdlib=StdlibStub(),
+                                      threads=ThreadsStub())
+
+        plan = treat_logic.plan_for_sizes("0.5")
+
+        # THEN: the same sizes give the same (cached) plan
+        self.assertIs(treat_logic.plan_for_sizes("0.5"), plan)
+        # ... until it is pushed out by other (more recently used) ones
+        treat_logic.plan_for_sizes("0.1")
+        treat_logic.plan_for_sizes("0.2")
+        self.assertIsNot(treat_logic.plan_for_sizes("0.5"), plan)
+
+
+class TestMotion(unittest.TestCase):
+    def test_speed_to_duty(self):
+        self.assertEqual(motion.speed_to_duty(0), 0)
+        self.assertEqual(motion.speed_to_duty(1), 38)
+        self.assertEqual(motion.speed_to_duty(-5), 8)
+        self.assertEqual(motion.speed_to_duty(0.5), 30)
+
+    def test_ramps(self):
+        # WHEN: compiling one full turn forward with 2 steps of ramp, 0.3s each
+        plan = motion.compile_sizes([1], turn_speed=1, full_angle_time=2, ramp_steps=2, ramp_time=0.6)
+
+        # THEN: speed goes up in steps of 1/3 and 2/3 of turn speed, and goes down
+        duties = list(plan[0::2])
+        self.assertEqual(duties, [28, 33, 38, 33, 28, 0])
+        # ... and cruise is shortened by what ramps have turned
+        covered = 2 * 0.3 * (5 + 10) / 15
+        self.assertEqual(plan[5], int((2 - covered) * 1000000))
+        self.assertEqual(motion.plan_duration(plan), (4 * 300000 + plan[5]) / 1000000)
+
+    def test_no_ramps_for_short_turns(self):
+        plan = motion.compile_sizes([-0.1], turn_speed=1, full_angle_time=2, ramp_steps=2, ramp_time=0.6)
+
+        self.assertEqual(list(plan), [8, 200000, 0, 0])
+
+    def test_plan_cache(self):
+        cache = motion.PlanCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("b", 3)
+        cache.put("c", 4)
+
+        # THEN: least recently used is gone
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (None, 3, 4))
+
+
+class TestTreatQueue(unittest.TestCase):
+    def setUp(self):
+        config = logic_config()
+
+        self.servo = ServoStub()
+        self.treat_logic = main.TreatLogic(config=config, threads=ThreadsStub(), servo=self.servo,
+                                           stdlib=StdlibStub())
+
+    def test_jobs_are_dispensed_in_order(self):
+        # GIVEN: two different treats in queue
+        self.treat_logic.treat(self.treat_logic.plan_for_portion(1))
+        self.treat_logic.treat(self.treat_logic.plan_for_portion(2))
+
+        # WHEN: worker drains the queue
+        self.assertTrue(self.treat_logic.work_once(block=True))
+        self.assertTrue(self.treat_logic.work_once())
+        self.assertFalse(self.treat_logic.work_once())
+
+        # THEN: servo turned forth and then back
+        self.assertEqual(self.servo.used_duties, [38, 0, 8, 0])
+        self.assertEqual(len(self.treat_logic.queue), 0)
+        self.assertEqual(self.treat_logic.wait_time(), 0)
+
+    def test_identical_jobs_are_merged(self):
+        # GIVEN: the same treat requested three times in a row
+        for _ in range(3):
+            self.treat_logic.treat(self.treat_logic.plan_for_sizes("1"))
+
+        # THEN: it takes only one slot, but waiting time counts all of them
+        self.assertEqual(len(self.treat_logic.queue), 1)
+        self.assertEqual(self.treat_logic.wait_time(), 6)
+
+        # WHEN: worker takes the job
+        self.assertTrue(self.treat_logic.work_once())
+
+        # THEN: servo turned three times
+        self.assertEqual(self.servo.used_duties, [38, 0] * 3)
+        self.assertFalse(self.treat_logic.work_once())
+
+    def test_job_with_count(self):
+        # GIVEN: portion requested twice in one request, then once more
+        plan = self.treat_logic.plan_for_portion(1)
+        self.treat_logic.treat(plan, 2)
+        self.treat_logic.treat(plan)
+
+        # THEN: all of them are in one slot
+        self.assertEqual(len(self.treat_logic.queue), 1)
+        self.assertEqual(self.treat_logic.wait_time(), 6)
+        self.assertEqual(self.treat_logic.queue.get(False)[1:3], (3, 6))
+
+    def test_full_queue(self):
+        # GIVEN: queue filled with two different jobs
+        self.treat_logic.treat(self.treat_logic.plan_for_sizes("1"))
+        self.treat_logic.treat(self.treat_logic.plan_for_sizes("-1"))
+
+        # WHEN: yet another different job comes
+        # THEN: it is refused with queue depth and time to wait
+        with self.assertRaises(main.QueueFullError) as ctx:
+            self.treat_logic.treat(self.treat_logic.plan_for_sizes("0.5"))
+        self.assertEqual(ctx.exception.depth, 2)
+        self.assertEqual(ctx.exception.wait, 4)
+
+    def test_merged_portions_fill_queue(self):
+        # GIVEN: the same treat requested over and over, merged into one slot
+        plan = self.treat_logic.plan_for_sizes("1")
+        accepted = 0
+        with self.assertRaises(main.QueueFullError) as ctx:
+            for _ in range(100):
+                self.treat_logic.treat(plan, 3)
+                accepted += 1
+
+        # THEN: it is refused, once queue holds portions of all slots at max count (2 * 5)
+        self.assertEqual(accepted, 3)
+        self.assertEqual(ctx.exception.depth, 1)
+        self.assertEqual(ctx.exception.wait, 18)
+
+        # WHEN: what still fits comes, it is taken
+        self.treat_logic.treat(plan)
+        self.assertEqual(self.treat_logic.queue.get(False)[1], 10)
+
+
+class RecordingServoStub(ServoStub):
+    """ servo which records when (in virtual time) duties were set """
+    def duty(self, duty):
+        super().duty(duty)
+        self.used_duties[-1] = (machine.Timer.ticks_us(), duty)
+
+
+class TestTimerExecutor(unittest.TestCase):
+    def setUp(self):
+        machine.Timer.reset()
+        self.servo = RecordingServoStub()
+        self.executor = executor.TimerExecutor(servo=self.servo, timer=machine.Timer(0), clock=ClockStub())
+        self.done = 0
+
+    def on_done(self):
+        self.done += 1
+
+    def test_plan_is_executed_in_timer_callbacks(self):
+        # WHEN: executor starts plan, with zero-time step in the middle, twice
+        self.executor.start([30, 1000, 35, 0, 38, 2500, 0, 0], 2, self.on_done)
+
+        # THEN: first duty is set immediately, and the executor waits for timer
+        self.assertEqual(self.servo.used_duties, [(0, 30)])
+        self.assertTrue(self.executor.busy)
+
+        # WHEN: virtual time goes on
+        machine.Timer.advance(10000)
+
+        # THEN: duties are set when their time comes, (2500us is rounded up to 3ms)
+        self.assertEqual(self.servo.used_duties, [(0, 30), (1000, 35), (1000, 38), (4000, 0),
+                                                  (4000, 30), (5000, 35), (5000, 38), (7000, 0)])
+        # ... and executor is done, with no thread needed
+        self.assertFalse(self.executor.busy)
+        self.assertEqual(self.done, 1)
+
+    def test_late_callbacks_do_not_accumulate(self):
+        # GIVEN: running plan of 1ms steps
+        self.executor.start([30, 1000, 31, 1000, 32, 1000, 0, 0], 1, self.on_done)
+
+        # WHEN: the first callback comes 1ms late
+        machine.Timer.now_us = 2000
+        machine.Timer.advance(5000)
+
+        # THEN: next steps are timed from plan's start, not from the late callback, so the
+        # plan ends in time
+        self.assertEqual(self.servo.used_duties, [(0, 30), (2000, 31), (2000, 32), (3000, 0)])
+
+
+def advance_with_executor(treat_logic, us, step=10000):
+    """ move virtual time `us` forward in `step`s, executor task of `treat_logic` runs
+    between them (as the event loop would, when timer callback woke it up) """
+    async def advance():
+        task = asyncio.create_task(treat_logic.run_executor())
+        for _ in range(us // step):
+            for _ in range(3):
+                await asyncio.sleep(0)
+            machine.Timer.advance(step)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    run_until_complete(advance)()
+
+
+class InterruptedLockStub(LockStub):
+    """ lock, while which is held, virtual time goes on - timer callbacks come in the middle
+    of the critical section (once) """
+    def __init__(self, us):
+        super().__init__()
+        self.us = us
+
+    def __enter__(self):
+        super().__enter__()
+        us, self.us = self.us, 0
+        machine.Timer.advance(us)
+
+
+class FullSchedulerStdlibStub(StdlibStub):
+    def schedule(self, fn, arg):
+        raise RuntimeError("schedule queue full")
+
+
+class TestTreatLogicWithExecutor(unittest.TestCase):
+    def setUp(self):
+        machine.Timer.reset()
+        self.servo = RecordingServoStub()
+        self.executor = executor.TimerExecutor(servo=self.servo, timer=machine.Timer(0), clock=ClockStub())
+        self.treat_logic = main.TreatLogic(config=logic_config(), servo=self.servo, stdlib=StdlibStub(),
+                                           threads=ThreadsStub(), executor=self.executor)
+
+    def test_queued_jobs_run_one_after_another(self):
+        treat_logic = self.treat_logic
+
+        # WHEN: two portions are requested
+        treat_logic.treat(treat_logic.plan_for_portion(1))
+        treat_logic.treat(treat_logic.plan_for_portion(2))
+
+        # THEN: the first one is executing, second one waits in the queue
+        self.assertTrue(self.executor.busy)
+        self.assertEqual(len(treat_logic.queue), 1)
+        self.assertEqual(treat_logic.wait_time(), 3)
+
+        # WHEN: time goes on
+        advance_with_executor(treat_logic, 10 * 1000000)
+
+        # THEN: both have been dispensed, one after another
+        self.assertEqual(self.servo.used_duties, [(0, 38), (2000000, 0), (2000000, 8), (3000000, 0)])
+        self.assertFalse(self.executor.busy)
+        self.assertEqual(treat_logic.wait_time(), 0)
+
+    def test_schedule_queue_is_full(self):
+        # GIVEN: micropython scheduler with no room left
+        self.treat_logic.stdlib = FullSchedulerStdlibStub()
+
+        # WHEN: portion is requested
+        self.treat_logic.treat(self.treat_logic.plan_for_portion(1))
+
+        # THEN: the job is dispensed by executor task, no error goes to the request
+        self.assertFalse(self.executor.busy)
+        advance_with_executor(self.treat_logic, 10 * 1000000)
+        self.assertEqual(self.servo.used_duties, [(0, 38), (2000000, 0)])
+
+    def test_job_ends_while_queue_is_locked(self):
+        # GIVEN: executing job
+        treat_logic = self.treat_logic
+        treat_logic.treat(treat_logic.plan_for_portion(1))
+
+        # WHEN: the job ends in timer callback, which comes while the handler of the next
+        # request puts it in the queue
+        treat_logic.queue._lock = InterruptedLockStub(2000000)
+        treat_logic.treat(treat_logic.plan_for_portion(2))
+
+        # THEN: the callback only woke executor task up, the next job starts after it
+        advance_with_executor(treat_logic, 10 * 1000000)
+        self.assertEqual(self.servo.used_duties, [(0, 38), (2000000, 0), (2000000, 8), (3000000, 0)])
+
+
+def udp_config(**kwargs):
+    return logic_config(UDP_PORT=0, UDP_DEDUPE_WINDOW=4, MAX_TREAT_COUNT=3, **kwargs)
+
+
+class TestTreatDatagramServer(unittest.TestCase):
+    def setUp(self):
+        self.config = udp_config()
+        self.treat_logic = main.TreatLogic(config=self.config, servo=ServoStub(), stdlib=StdlibStub(),
+                                           threads=ThreadsStub())
+        self.metrics = metrics.Metrics(routes=main.TreatApp.ROUTES, portions=self.config.PORTION_SIZES)
+        self.server = main.TreatDatagramServer(treat_logic=self.treat_logic, config=self.config, metrics=self.metrics)
+        self.addr = ("192.168.1.10", 4000)
+
+    def treat(self, seq, portion=1, addr=None, count=1):
+        ack = self.server.handle(struct.pack(main.UDP_TREAT, b"TQ", seq, portion, count), addr or self.addr)
+        magic, ack_seq, status = struct.unpack(main.UDP_ACK, ack)
+        self.assertEqual((magic, ack_seq), (b"TA", seq))
+        return status
+
+    def test_treat(self):
+        self.assertEqual(self.treat(7), main.UDP_OK)
+        self.assertEqual(len(self.treat_logic.queue), 1)
+        self.assertEqual(self.metrics.treats[0], 1)
+
+    def test_retransmit_is_not_dispensed_again(self):
+        first = self.server.handle(struct.pack(main.UDP_TREAT, b"TQ", 7, 1, 1), self.addr)
+        again = self.server.handle(struct.pack(main.UDP_TREAT, b"TQ", 7, 1, 1), self.addr)
+
+        self.assertEqual(first, again)
+        self.assertEqual(self.treat_logic.queue.get(False)[1], 1)  # repeat
+
+        # the same sequence number from other button is other request
+        self.assertEqual(self.treat(7, addr=("192.168.1.11", 4000)), main.UDP_OK)
+        self.assertEqual(self.metrics.treats[0], 2)
+
+    def test_dedupe_window(self):
+        self.server.metrics = None
+        for seq in range(5):
+            self.treat(seq)
+        self.treat_logic.queue.get(False)
+
+        # WHEN: request fell out of the window is retransmitted
+        self.treat(0)
+
+        # THEN: it is dispensed again (window is there for retransmits, which come quickly)
+        self.assertEqual(self.treat_logic.queue.get(False)[1], 1)
+
+    def test_unknown_portion(self):
+        self.assertEqual(self.treat(1, portion=9), main.UDP_BAD_REQUEST)
+        self.assertEqual(len(self.treat_logic.queue), 0)
+
+    def test_count(self):
+        self.assertEqual(self.treat(1, count=3), main.UDP_OK)
+        self.assertEqual(self.treat_logic.queue.get(False)[1], 3)  # repeat
+        self.assertEqual(self.metrics.treats[0], 3)
+
+        self.assertEqual(self.treat(2, count=0), main.UDP_BAD_REQUEST)
+        self.assertEqual(self.treat(3, count=4), main.UDP_BAD_REQUEST)
+        self.assertEqual(len(self.treat_logic.queue), 0)
+
+    def test_busy(self):
+        self.treat(1, portion=1)
+        self.treat(2, portion=2)
+        self.assertEqual(self.treat(3, portion=1), main.UDP_BUSY)
+
+    def test_busy_is_not_remembered(self):
+        self.treat(1, portion=1)
+        self.treat(2, portion=2)
+        self.assertEqual(self.treat(3, portion=1), main.UDP_BUSY)
+
+        # WHEN: queue drains and the refused request is retransmitted
+        self.treat_logic.queue.get(False)
+        status = self.treat(3, portion=1)
+
+        # THEN: it is accepted now
+        self.assertEqual(status, main.UDP_OK)
+        self.assertEqual(self.metrics.treats[0], 2)
+        self.assertEqual(self.treat(3, portion=1), main.UDP_OK)  # and then deduplicated
+        self.assertEqual(len(self.treat_logic.queue), 2)
+
+    def test_garbage_is_ignored(self):
+        self.assertIsNone(self.server.handle(b"GET / HTTP/1.1", self.addr))
+        self.assertIsNone(self.server.handle(struct.pack(main.UDP_TREAT, b"XX", 1, 1, 1), self.addr))
+        self.assertEqual(len(self.treat_logic.queue), 0)
+
+    @run_until_complete
+    async def test_serve_over_loopback(self):
+        addr = self.server.bind("127.0.0.1")
+        task = asyncio.create_task(self.server.serve())
+        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        client.setblocking(False)
+        try:
+            client.sendto(b"garbage", addr)
+            client.sendto(struct.pack(main.UDP_TREAT, b"TQ", 42, 2, 1), addr)
+            for _ in range(1000):
+                await asyncio.sleep(0.001)
+                try:
+                    ack = client.recv(64)
+                    break
+                except OSError:
+                    pass
+        finally:
+            client.close()
+            task.cancel()
+            self.server.sock.close()
+
+        self.assertEqual(struct.unpack(main.UDP_ACK, ack), (b"TA", 42, main.UDP_OK))
+        self.assertEqual(len(self.treat_logic.queue), 1)
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        if hasattr(record, "getMessage"):  # CPython formats the message in handler
+            self.messages.append(record.getMessage())
+        else:
+            self.messages.append(record.message)
+
+
+class Formatted:
+    """ argument, which counts how many times it has been put into message """
+    def __init__(self):
+        self.formatted = 0
+
+    def __str__(self):
+        self.formatted += 1
+        return "arg"
+
+
+class TestLogLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.stdlib = StdlibStub()
+        self.limiter = logfilter.LogLimiter(clock=self.stdlib, repeat_interval=10, rate=2, burst=3)
+        self.limiter.install()
+
+        self.handler = ListHandler()
+        self.logger = logging.getLogger("test-limiter")
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.addHandler(self.handler)
+        self.logger.propagate = False
+
+    def tearDown(self):
+        self.limiter.uninstall()
+        self.limiter.uninstall()  # does nothing the second time
+        self.logger.handlers.remove(self.handler)
+
+    def sleep(self, seconds):
+        self.stdlib.now_us += int(seconds * 1000000)
+
+    def test_repeated_message(self):
+        arg = Formatted()
+
+        # WHEN: the same message is logged over and over (as while waiting for a thread)
+        for i in range(5):
+            self.logger.debug("still waiting, %s", arg)
+            self.sleep(1)
+
+        # THEN: it is logged once, the others are not even formatted
+        self.assertEqual(self.handler.messages, ["still waiting, arg"])
+        self.assertEqual(arg.formatted, 1)
+
+        # WHEN: other message comes, repeats are told before it
+        self.logger.info("done")
+        self.assertEqual(self.handler.messages, ["still waiting, arg", "last message repeated 4 times", "done"])
+
+        # WHEN: the message comes after repeat interval, it is logged
+        self.sleep(11)
+        self.logger.info("done")
+        self.assertEqual(self.handler.messages[-1], "done")
+
+    def test_rate_limit(self):
+        # WHEN: more (different) messages, than fit into a burst, come at once
+        for i in range(5):
+            self.logger.debug("turn %s" % i)
+
+        # THEN: the burst is logged only
+        self.assertEqual(self.handler.messages, ["turn 0", "turn 1", "turn 2"])
+
+        # WHEN: after a second (two more tokens), other messages come
+        self.sleep(1)
+        for message in ["next", "after next", "dropped"]:
+            self.logger.debug(message)
+
+        # THEN: they are logged, after the count of dropped ones
+        self.assertEqual(self.handler.messages[3:], ["2 messages dropped by rate limit", "next", "after next"])
+
+        # ... but errors are never dropped
+        self.logger.error("failed")
+        self.assertEqual(self.handler.messages[-1], "failed")
+
+    def test_disabled_level_takes_no_token(self):
+        self.logger.setLevel(logging.INFO)
+        for i in range(5):
+            self.logger.debug("turn %s" % i)
+        self.logger.info("info")
+        self.assertEqual(self.handler.messages, ["info"])
+
+
+class TestMute(unittest.TestCase):
+
+    def setUp(self):
+        self.root = logging.getLogger()
+        self.root_level = self.root.level
+        self.root.setLevel(logging.INFO)
+
+        self.handler = ListHandler()
+        self.logger = logging.getLogger("test-mute")
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.addHandler(self.handler)
+        self.logger.propagate = False
+        self.mute = logfilter.Mute()
+
+    def tearDown(self):
+        self.mute.unmute()
+        self.root.setLevel(self.root_level)
+        self.logger.handlers.remove(self.handler)
+
+    def test_disabled_levels_are_muted(self):
+        arg = Formatted()
+        quiet = logging.getLogger("test-mute.quiet")
+        quiet.setLevel(logging.WARNING)
+        quiet.addHandler(self.handler)
+        quiet.propagate = False
+
+        self.mute.mute()
+        quiet.debug("muted %s", arg)
+        quiet.info("muted %s", arg)
+        quiet.warning("logged")
+        self.logger.debug("enabled %s", arg)
+        quiet.handlers.remove(self.handler)
+
+        # THEN: calls of disabled levels did nothing at all
+        self.assertEqual(self.handler.messages, ["logged", "enabled arg"])
+        self.assertEqual(arg.formatted, 1)
+        self.assertIs(logging.debug, logfilter._muted)  # root logs from INFO
+
+        # WHEN: unmuted, methods are back
+        self.mute.unmute()
+        self.assertIsNot(logging.debug, logfilter._muted)
+        self.root.setLevel(logging.DEBUG)
+        quiet.setLevel(logging.DEBUG)
+        quiet.addHandler(self.handler)
+        quiet.debug("back")
+        quiet.handlers.remove(self.handler)
+        self.assertEqual(self.handler.messages[-1], "back")
+
+
+class TimerStdlibStub(StdlibStub):
+    """ ticks of virtual clock of machine.Timer stub """
+    def ticks_us(self):
+        return machine.Timer.ticks_us()
+
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        machine.Timer.reset()
+        self.handler = ListHandler()
+        tracing.logger.setLevel(logging.INFO)
+        tracing.logger.addHandler(self.handler)
+        tracing.logger.propagate = False
+
+        self.stdlib = TimerStdlibStub()
+        self.tracer = tracing.Tracer(clock=ClockStub(), side="dispenser", max_traces=2)
+        self.servo = main.TracingServo(servo=ServoStub(), tracer=self.tracer, clock=ClockStub())
+
+    def tearDown(self):
+        tracing.logger.handlers.remove(self.handler)
+
+    def treat_logic(self, executor=None, **config):
+        return main.TreatLogic(config=logic_config(**config), servo=self.servo, stdlib=self.stdlib,
+                               threads=ThreadsStub(), executor=executor, tracer=self.tracer)
+
+    def test_tracer(self):
+        # GIVEN: tracer, which is shared by threads
+        tracer = tracing.Tracer(clock=ClockStub(), side="button", max_traces=2, lock=LockStub())
+
+        # WHEN: spans of more traces come, than the tracer keeps
+        tracer.span("a", "connect", 0, 1500)
+        machine.Timer.now_us = 2000
+        tracer.span("b", "debounce", 1000)
+        tracer.span("a", "request", 1500)
+        tracer.span("c", "debounce", 1800)
+
+        # THEN: the oldest one is logged as it is
+        self.assertEqual(self.handler.messages, ["TRACE a button connect:0:1500 request:1500:500"])
+
+        # WHEN: trace is finished, it is logged and forgotten
+        tracer.finish("c")
+        tracer.finish("unknown")
+        self.assertEqual(self.handler.messages[1:], ["TRACE c button debounce:1800:200"])
+        self.assertEqual(list(tracer.traces), ["b"])
+        self.assertEqual(len(tracing.new_trace_id()), 8)
+
+    def test_servo_with_no_duty(self):
+        self.servo.begin("t1")
+        self.servo.end()
+        self.tracer.finish("t1")
+        self.assertEqual(self.handler.messages, [])
+
+    def test_http_treat_to_servo_stop(self):
+        # GIVEN: dispenser with timer executor
+        timer_executor = executor.TimerExecutor(servo=self.servo, timer=machine.Timer(0), clock=ClockStub())
+        treat_logic = self.treat_logic(timer_executor)
+        app = main.TreatApp(treat_logic=treat_logic, config=ConfigStub(), stdlib=self.stdlib,
+                            templates=TemplatesStub(), tracer=self.tracer)
+        treat = run_until_complete(app.treat)
+
+        # WHEN: the same portion comes in two traced requests, one while the other is dispensed
+        treat(RequestStub(json={"portion": 1}, headers={tracing.HEADER: "t1"}))
+        machine.Timer.advance(500000)
+        treat(RequestStub(json={"portion": 1}, headers={tracing.HEADER: "t2"}))
+        treat(RequestStub(json={"portion": 2}))  # request with no trace
+        advance_with_executor(treat_logic, 10 * 1000000)
+
+        # THEN: every trace is logged, when the servo stopped after its job
+        self.assertEqual(self.handler.messages, [
+            "TRACE t1 dispenser http:0:0 queue:0:0 duty38:0:2000000 duty0:2000000:0 motor:0:2000000",
+            "TRACE t2 dispenser http:500000:0 queue:500000:1500000 duty38:2000000:2000000 duty0:4000000:0 "
+            "motor:2000000:2000000",
+        ])
+
+    def test_threaded_worker(self):
+        treat_logic = self.treat_logic()
+        treat_logic.treat(treat_logic.plan_for_portion(2), trace="t1")
+        treat_logic.treat(treat_logic.plan_for_portion(2), 2, trace="t2")
+        machine.Timer.now_us = 100
+        self.assertTrue(treat_logic.work_once())
+
+        # THEN: both traces of the merged job were dispensed together, duties are recorded
+        # under the first one (worker sleeps are not in virtual time)
+        self.assertEqual(self.handler.messages, [
+            "TRACE t1 dispenser queue:0:100 " + "duty8:100:0 duty0:100:0 " * 3 + "motor:100:0",
+            "TRACE t2 dispenser queue:0:100 motor:100:0",
+        ])
+        self.assertFalse(treat_logic.work_once())
+
+    def test_refused_requests_are_finished(self):
+        # GIVEN: full queue
+        treat_logic = self.treat_logic(TREAT_QUEUE_SIZE=1)
+        treat_logic.treat(treat_logic.plan_for_portion(1))
+        app = main.TreatApp(treat_logic=treat_logic, config=ConfigStub(), stdlib=self.stdlib,
+                            templates=TemplatesStub(), tracer=self.tracer)
+
+        # WHEN: traced requests are refused
+        for count in [6, 1]:
+            ret = run_until_complete(app.treat)(
+                RequestStub(json={"portion": 2, "count": count}, headers={tracing.HEADER: "c%s" % count}))
+            self.assertNotEqual(ret.status_code, 200)
+
+        # THEN: their traces are logged right away
+        self.assertEqual(self.handler.messages, ["TRACE c6 dispenser http:0:0", "TRACE c1 dispenser http:0:0"])
+        self.assertEqual(self.tracer.traces, {})
+
+    def test_udp(self):
+        config = udp_config(TREAT_QUEUE_SIZE=1)
+        treat_logic = self.treat_logic(**config.__dict__)
+        server = main.TreatDatagramServer(treat_logic=treat_logic, config=config, stdlib=self.stdlib,
+                                          tracer=self.tracer)
+
+        def treat(seq, portion, trace=None):
+            data = struct.pack(main.UDP_TREAT, b"TQ", seq, portion, 1)
+            if trace is not None:
+                data += struct.pack(main.UDP_TRACE, trace)
+            return struct.unpack(main.UDP_ACK, server.handle(data, ("192.168.1.10", 4000)))[2]
+
+        # WHEN: traced datagrams come, the bad and refused ones are finished right away
+        self.assertEqual(treat(1, 1, 0xabc), main.UDP_OK)
+        self.assertEqual(treat(2, 9, 0xdef), main.UDP_BAD_REQUEST)
+        self.assertEqual(treat(3, 2, 0x123), main.UDP_BUSY)
+        self.assertEqual(treat(4, 2), main.UDP_BUSY)
+        self.assertEqual(self.handler.messages, ["TRACE 00000def dispenser udp:0:0",
+                                                 "TRACE 00000123 dispenser udp:0:0"])
+
+        # ... the accepted one, when it is dispensed
+        self.assertTrue(treat_logic.work_once())
+        self.assertEqual(self.handler.messages[2], "TRACE 00000abc dispenser udp:0:0 queue:0:0 duty38:0:0 "
+                                                   "duty0:0:0 motor:0:0")
 
 
 if __name__ == '__main__':
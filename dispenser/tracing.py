@@ -0,0 +1,82 @@
+import logging
+import random
+
+logger = logging.getLogger("trace")
+
+# request header with trace id, button sends it with every treat
+HEADER = "X-Trace-Id"
+
+
+def new_trace_id() -> str:
+    return "%08x" % random.getrandbits(32)
+
+
+class Tracer:
+    """ collects spans of traces. Trace is one press of the button, followed from the button
+    to the servo under one id. Spans of a trace are logged in one record, when the trace is
+    finished:
+
+        TRACE <trace id> <side> <name>:<start>:<duration> ...
+
+    start is in ticks_us of this side, duration in us. Records go wherever the other ones
+    go (to rsyslog, on button), utils/trace-report.py of button makes timelines of them.
+
+    At most `max_traces` unfinished traces are kept, the oldest one is logged as it is when
+    more come. Give `lock` if spans are recorded from more threads """
+
+    def __init__(self, *, clock, side, max_traces=8, lock=None):
+        self.clock = clock
+        self.side = side
+        self.max_traces = max_traces
+        self.lock = lock
+
+        self.traces = {}  # trace id -> [(name, start, duration)]
+        self._order = []  # trace ids, the oldest first
+
+    def span(self, trace, name, start, end=None):
+        """ record span of `trace` from ticks_us `start` to `end` (now, if not given) """
+        if end is None:
+            end = self.clock.ticks_us()
+        span = (name, start, self.clock.ticks_diff(end, start))
+
+        evicted = None
+        if self.lock:
+            self.lock.acquire()
+        try:
+            spans = self.traces.get(trace)
+            if spans is None:
+                if len(self._order) >= self.max_traces:
+                    evicted = self._pop(self._order[0])
+                spans = self.traces[trace] = []
+                self._order.append(trace)
+            spans.append(span)
+        finally:
+            if self.lock:
+                self.lock.release()
+
+        if evicted:
+            self._log(*evicted)
+
+    def finish(self, trace):
+        """ log spans of trace """
+        if self.lock:
+            self.lock.acquire()
+        try:
+            finished = self._pop(trace)
+        finally:
+            if self.lock:
+                self.lock.release()
+
+        if finished:
+            self._log(*finished)
+
+    def _pop(self, trace):
+        spans = self.traces.pop(trace, None)
+        if spans is None:
+            return None
+        self._order.remove(trace)
+        return trace, spans
+
+    def _log(self, trace, spans):
+        # formatted here, as LogLimiter would take records of one template for repeats
+        logger.info("TRACE %s %s %s" % (trace, self.side, " ".join("%s:%s:%s" % span for span in spans)))
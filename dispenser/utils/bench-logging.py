@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+""" time spent in TreatLogic.turn() and Servo.speed() with logging at DEBUG, at INFO and
+at INFO with production profile (logfilter.Mute). With sources stripped of debug calls
+(`doit strip_debug=1`) the calls cost what the production profile shows, minus the call of
+the muted method. Runs on board, or in micropython unix port with stubs:
+
+    cd dispenser && mpremote run utils/bench-logging.py  # sources have to be on board
+    cd dispenser && MICROPYPATH=localstubs:upy-local-lib micropython utils/bench-logging.py
+    cd dispenser && python3 utils/bench-logging.py
+
+Where there are no machine and utime (CPython), they come from localstubs, as in tests.
+"""
+import _thread
+import logging
+import sys
+import time
+
+sys.path.append(".")
+try:
+    import machine  # noqa: F401
+except ImportError:  # not in micropython, use stubs
+    sys.path.append("localstubs")
+
+import config  # noqa: E402
+import main  # noqa: E402
+import servo  # noqa: E402
+from logfilter import Mute  # noqa: E402
+
+ROUNDS = 1000
+
+
+class NullHandler(logging.Handler):
+    def emit(self, record):
+        pass
+
+
+class ServoStub:
+    def duty(self, duty):
+        pass
+
+
+class PWMStub:
+    def duty(self, duty):
+        pass
+
+
+class StdlibStub:
+    def sleep(self, time_):
+        pass
+
+
+def now_us():
+    try:
+        return time.ticks_us()  # type: ignore
+    except AttributeError:
+        return int(time.perf_counter() * 1000000)
+
+
+def bench(fn, *args):
+    """ us per call of fn(*args) """
+    started = now_us()
+    for _ in range(ROUNDS):
+        fn(*args)
+    return (now_us() - started) / ROUNDS
+
+
+def benches():
+    logic = main.TreatLogic(config=config, threads=_thread, servo=ServoStub(), stdlib=StdlibStub())
+    plan = logic.plan_for_portion(1)
+    servo_ = servo.Servo.__new__(servo.Servo)  # with no pin, PWM of the stubs would print every call
+    servo_.pwm = PWMStub()
+    return [("turn()", bench(logic.turn, plan)), ("speed()", bench(servo_.speed, 0.5))]
+
+
+def main_():
+    root = logging.getLogger()
+    for logger in [root, main.logger]:
+        logger.handlers = [NullHandler()]  # time of logging calls, not of printing
+    main.logger.propagate = False
+
+    mute = Mute()
+    for profile, level in [("debug", logging.DEBUG), ("info", logging.INFO), ("production", logging.INFO)]:
+        root.setLevel(level)
+        main.logger.setLevel(level)
+        if profile == "production":
+            mute.mute()
+        for name, us in benches():
+            print("%-10s %-8s %8.1f us" % (profile, name, us))
+    mute.unmute()
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,807 @@
+#!/usr/bin/env python3
+""" button and dispenser run together on linux, in virtual time. The real App, Outbox,
+DispenserClient, ConnProvider and Blinker of the button talk to the real TreatApp,
+TreatDatagramServer and TreatLogic (with TimerExecutor) of the dispenser over local
+sockets, through a simulated link with latency and packet loss. GPIO, PWM, timers and
+wifi association are simulated, and the clock of asyncio is virtual - it jumps to the
+next timer whenever no socket is ready - so hours of presses run in seconds, and the same
+seed gives the same run:
+
+    python3 sim/simulator.py --hours 8 --rate 30 --transport udp --loss 0.05
+
+Reported: throughput, presses lost or dispensed twice, latency from press to the servo
+start, request round trips and wifi connects. Presses are followed by their trace ids
+(see tracing.py), with --log-level INFO the TRACE records go to the output for
+button/utils/trace-report.py.
+
+Light sleep of the button stops the whole simulation, like it stops the board: the clock
+jumps to the next press. Deep sleep is not simulated (it is simulated as light sleep).
+"""
+import argparse
+import asyncio
+import bisect
+import importlib
+import logging
+import os
+import random
+import selectors
+import socket
+import sys
+import tempfile
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUTTON_MODULES = ("config", "aconn", "app", "blinker", "dispenser_client", "outbox", "tracing")
+DISPENSER_MODULES = ("config", "executor", "main", "metrics", "template", "tracing")
+PERCENTILES = (50, 95, 99)
+
+logger = logging.getLogger("sim")
+
+
+def load_project(path, names):
+    """ import modules `names` of project in directory `path`, return them as namespace.
+    Modules of the project are removed from sys.modules afterwards, so the other project
+    can have modules of the same names (both have config.py). Missing config_local.py is
+    taken for an empty one """
+    saved = {}
+    for name in list(sys.modules):
+        module = sys.modules[name]
+        if name == "config_local" or os.path.dirname(getattr(module, "__file__", None) or "") == path:
+            saved[name] = sys.modules.pop(name)
+    before = set(sys.modules)
+
+    sys.path.insert(0, path)
+    if not os.path.exists(os.path.join(path, "config_local.py")):
+        sys.modules["config_local"] = types.ModuleType("config_local")
+    try:
+        return types.SimpleNamespace(**{name: importlib.import_module(name) for name in names})
+    finally:
+        sys.path.remove(path)
+        for name in set(sys.modules) - before:
+            del sys.modules[name]
+        sys.modules.pop("config_local", None)
+        sys.modules.update(saved)
+
+
+def percentile(values, p):
+    """ nearest-rank percentile of sorted values """
+    return values[max(0, -(-len(values) * p // 100) - 1)]
+
+
+class SimulationStop(Exception):
+    """ raised in the button, when it would sleep with no press to come """
+
+
+class _VirtualSelector(selectors.DefaultSelector):
+    """ selector of VirtualTimeLoop. Sockets are only polled, when none is ready the loop's
+    clock jumps to the next timer. Sockets are unix ones (see UnixNetwork), which have the
+    data on the other end as soon as send() returns, so nothing in flight is missed """
+
+    def __init__(self):
+        super().__init__()
+        self.loop = None
+
+    def select(self, timeout=None):
+        events = super().select(0)
+        if events or timeout == 0:
+            return events
+        if timeout is None:
+            # no timer at all, only a socket could wake the loop up
+            events = super().select(1)
+            if not events:
+                raise RuntimeError("simulation is stuck, nothing is scheduled")
+            return events
+        self.loop.advance(timeout)
+        return []
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    """ asyncio loop, whose time goes on only by advance(). TCP servers and connections of
+    127.0.0.1 are unix sockets of `network` (set it before the loop runs) """
+
+    def __init__(self):
+        selector = _VirtualSelector()
+        super().__init__(selector)
+        selector.loop = self
+        self.network = None
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+    def run_in_executor(self, executor, func, *args):
+        """ microdot runs sync handlers in a thread on CPython, whose result would come at
+        a real time, not a virtual one. They run here and now, as on micropython """
+        future = self.create_future()
+        try:
+            future.set_result(func(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    async def create_server(self, protocol_factory, host=None, port=None, **kwargs):
+        return await self.create_unix_server(protocol_factory, self.network.path(port, "tcp"), **kwargs)
+
+    async def create_connection(self, protocol_factory, host=None, port=None, **kwargs):
+        return await self.create_unix_connection(protocol_factory, self.network.path(port, "tcp"), **kwargs)
+
+
+class UnixNetwork:
+    """ loopback of the simulation: port of 127.0.0.1 is a unix socket in `directory`.
+    Loopback of IP finishes the delivery in softirq, which may run after send() returned -
+    virtual clock would jump past data in flight. Unix socket has it within send() """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._port = 40000
+
+    def port(self):
+        """ new unused port """
+        self._port += 1
+        return self._port
+
+    def path(self, port, kind):
+        return os.path.join(self.directory, "%s-%s" % (kind, port))
+
+    def datagram_endpoint(self, loop, protocol, port):
+        return loop.create_datagram_endpoint(lambda: protocol, local_addr=self.path(port, "udp"),
+                                             family=socket.AF_UNIX)
+
+
+class UnixDatagrams:
+    """ socket module of DispenserClient of the button, its UDP sockets are unix ones of
+    `network` """
+    AF_INET = socket.AF_INET
+    SOCK_DGRAM = socket.SOCK_DGRAM
+
+    def __init__(self, network):
+        self.network = network
+
+    def socket(self, family, type_):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(self.network.path(self.network.port(), "udp"))  # the dispenser answers to it
+        return sock
+
+    def getaddrinfo(self, host, port):
+        return [(socket.AF_UNIX, socket.SOCK_DGRAM, 0, "", self.network.path(port, "udp"))]
+
+
+# -- hardware
+
+
+class SimPin:
+    """ GPIO pin of the button, with edges injected by the simulation """
+    IN = "in"
+    OUT = "out"
+    IRQ_RISING = 1
+    IRQ_FALLING = 2
+
+    def __init__(self, number, level=1):
+        self.number = number
+        self.level = level
+        self._handler = None
+        self._trigger = 0
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING):
+        self._handler = handler
+        self._trigger = trigger
+
+    def value(self, level=None):
+        if level is None:
+            return self.level
+        self.set(level)
+
+    def set(self, level):
+        old, self.level = self.level, level
+        if self._handler and old != level and self._trigger & (self.IRQ_RISING if level else self.IRQ_FALLING):
+            self._handler(self)
+
+
+class SimPWM:
+    def __init__(self, freq=0, duty=0):
+        self._freq = freq
+        self._duty = duty
+
+    def freq(self, value=None):
+        if value is None:
+            return self._freq
+        self._freq = value
+
+    def duty(self, value=None):
+        if value is None:
+            return self._duty
+        self._duty = value
+
+
+class SimTimer:
+    """ machine.Timer, firing callbacks in virtual time """
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, loop):
+        self.loop = loop
+        self._handle = None
+
+    def init(self, *, mode=PERIODIC, period=-1, callback=None):
+        self.deinit()
+        self._handle = self.loop.call_later(period / 1000, self._fire, mode, period, callback)
+
+    def deinit(self):
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+
+    def _fire(self, mode, period, callback):
+        self._handle = None
+        if mode == self.PERIODIC:
+            self.init(mode=mode, period=period, callback=callback)
+        callback(self)
+
+
+class SimServo:
+    """ servo of the dispenser, counts time it has been turning """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.current = 0
+        self.on_time = 0.0
+        self._since = 0.0
+
+    def duty(self, duty):
+        now = self.loop.time()
+        if self.current:
+            self.on_time += now - self._since
+        self.current = duty
+        self._since = now
+
+
+class SimWLAN:
+    """ network.WLAN of the button. Association takes `cold` seconds, or `warm` seconds
+    with bssid (fast connect), both +- `jitter` """
+
+    def __init__(self, loop, rng, *, cold, warm, jitter):
+        self.loop = loop
+        self.rng = rng
+        self.cold = cold
+        self.warm = warm
+        self.jitter = jitter
+        self.connects = []  # seconds of association of every connect
+
+        self._active = False
+        self._connected_at = None
+        self._ifconfig = ("10.0.0.2", "255.255.255.0", "10.0.0.1", "10.0.0.1")
+
+    def active(self, active=None):
+        if active is None:
+            return self._active
+        self._active = active
+        if not active:
+            self._connected_at = None
+
+    def config(self, *args, **kwargs):
+        if args == ("channel",):
+            return 6
+        if args == ("bssid",):
+            return self.scan()[0][1]
+
+    def connect(self, ssid, password, bssid=None):
+        delay = max(0.0, (self.warm if bssid else self.cold) + self.rng.uniform(-self.jitter, self.jitter))
+        self._connected_at = self.loop.time() + delay
+        self.connects.append(delay)
+
+    def disconnect(self):
+        self._connected_at = None
+
+    def isconnected(self):
+        return self._active and self._connected_at is not None and self.loop.time() >= self._connected_at
+
+    def ifconfig(self, config=None):
+        if config is None:
+            return self._ifconfig
+        if config != "dhcp":
+            self._ifconfig = config
+
+    def scan(self):
+        return [(b"sim", b"\x02\x00\x00\x00\x00\x01", 6, -50, 3, False)]
+
+
+# -- network
+
+
+class Link:
+    """ one way delay and loss of the simulated network. Lost TCP segment comes after
+    retransmit timeout (doubled for every loss in a row), lost datagram never comes """
+
+    def __init__(self, rng, *, latency, jitter, loss, rto=0.2):
+        self.rng = rng
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.rto = rto
+        self.lost = 0
+        self.sent = 0
+
+    def _delay(self):
+        return self.latency + self.rng.uniform(0, self.jitter)
+
+    def datagram_delay(self):
+        """ seconds the datagram takes, None if it is lost """
+        self.sent += 1
+        if self.rng.random() < self.loss:
+            self.lost += 1
+            return None
+        return self._delay()
+
+    def segment_delay(self):
+        self.sent += 1
+        delay = self._delay()
+        rto = self.rto
+        while self.rng.random() < self.loss:
+            self.lost += 1
+            delay += rto
+            rto *= 2
+        return delay
+
+
+class TCPRelay:
+    """ listens on loopback, forwards every connection to `target` over the link """
+
+    def __init__(self, loop, link, target):
+        self.loop = loop
+        self.link = link
+        self.target = target
+        self.server = None
+        self.tasks = set()
+
+    async def start(self, port):
+        self.server = await asyncio.start_server(self._accept, "127.0.0.1", port)
+
+    def close(self):
+        self.server.close()
+
+    async def _accept(self, reader, writer):
+        try:
+            up_reader, up_writer = await asyncio.open_connection(*self.target)
+        except OSError:
+            writer.close()
+            return
+        await asyncio.gather(self._pump(reader, up_writer), self._pump(up_reader, writer))
+
+    async def _pump(self, reader, writer):
+        """ forward data in order, every chunk delayed by the link """
+        deliver_at = 0.0
+        try:
+            while True:
+                data = await reader.read(4096)
+                deliver_at = max(deliver_at, self.loop.time() + self.link.segment_delay())
+                await asyncio.sleep(deliver_at - self.loop.time())
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+        except (OSError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+class UDPRelay(asyncio.DatagramProtocol):
+    """ forwards datagrams of one client to `target`, and answers back, over the link """
+
+    def __init__(self, loop, link, target):
+        self.loop = loop
+        self.link = link
+        self.target = target
+        self.transport = None
+        self.client = None
+
+    async def start(self, port):
+        self.transport, _ = await self.loop.network.datagram_endpoint(self.loop, self, port)
+
+    def close(self):
+        self.transport.close()
+
+    def datagram_received(self, data, addr):
+        to = self.client if addr == self.target else self.target
+        if addr != self.target:
+            self.client = addr
+        delay = self.link.datagram_delay()
+        if to is not None and delay is not None:
+            self.loop.call_later(delay, self.transport.sendto, data, to)
+
+
+class DatagramEndpoint(asyncio.DatagramProtocol):
+    """ socket of TreatDatagramServer. Datagram is handled as soon as it comes, as serve()
+    does, when the socket gets readable """
+
+    def __init__(self, loop, server):
+        self.loop = loop
+        self.server = server
+        self.transport = None
+
+    async def start(self, port):
+        self.transport, _ = await self.loop.network.datagram_endpoint(self.loop, self, port)
+
+    def datagram_received(self, data, addr):
+        ack = self.server.handle(data, addr)
+        if ack is not None:
+            self.transport.sendto(ack, addr)
+
+
+# -- the boards
+
+
+class ButtonStdlib:
+    """ StdlibProvider of the button """
+
+    def __init__(self, sim):
+        self.sim = sim
+        self.loop = sim.loop
+
+    def pin(self, number, direction):
+        if direction == "in":
+            return self.sim.button_pin
+        return SimPin(number, 0)
+
+    def pwm(self, number):
+        return SimPWM()
+
+    async def sleep(self, t):
+        await asyncio.sleep(t)
+
+    def ticks_ms(self):
+        return int(self.loop.time() * 1000)
+
+    def ticks_us(self):
+        return int(self.loop.time() * 1000000)
+
+    def ticks_diff(self, ticks1, ticks2):
+        return ticks1 - ticks2
+
+    def time(self):
+        return int(self.loop.time())
+
+    def sleep_until_pressed(self, pin, deep):
+        """ the whole simulation sleeps (clock jumps) until the next press """
+        press = self.sim.next_press()
+        if press is None:
+            raise SimulationStop()
+        self.sim.sleeps += 1
+        self.loop.advance(max(0.0, press - self.loop.time()))
+
+    def rtc_kept(self):
+        return False  # the simulation starts with power on
+
+    def woken_by_press(self):
+        return False
+
+
+class DispenserStdlib:
+    """ StdlibProvider of the dispenser """
+
+    def __init__(self, loop):
+        self.loop = loop
+
+    def sleep(self, time_):
+        raise RuntimeError("servo thread is not simulated, use SERVO_EXECUTOR timer")
+
+    def ticks_us(self):
+        return int(self.loop.time() * 1000000)
+
+    def ticks_add(self, ticks, delta):
+        return ticks + delta
+
+    def ticks_diff(self, ticks1, ticks2):
+        return ticks1 - ticks2
+
+    def schedule(self, fn, arg):
+        self.loop.call_soon(fn, arg)
+
+
+class Simulation:
+    """ one run. `presses` are times (seconds) of presses, see poisson_presses() """
+
+    def __init__(self, presses, *, seed=1, transport="http", latency=0.002, jitter=0.001, loss=0.0,
+                 wifi_cold=2.5, wifi_warm=0.5, wifi_jitter=0.5, bounce=3, hold=0.15, sleep_idle=300,
+                 outbox=True, drain=600):
+        self.presses = presses
+        self.seed = seed
+        self.transport = transport
+        self.bounce = bounce
+        self.hold = hold
+        self.sleep_idle = sleep_idle
+        self.use_outbox = outbox
+        self.drain = drain
+
+        self.loop = VirtualTimeLoop()
+        rng = random.Random(seed)
+        self.link = Link(random.Random(rng.random()), latency=latency, jitter=jitter, loss=loss)
+        self.wlan = SimWLAN(self.loop, random.Random(rng.random()), cold=wifi_cold, warm=wifi_warm,
+                            jitter=wifi_jitter)
+        self.button_pin = None
+        self.servo = SimServo(self.loop)
+        self.tmpdir = None
+        self.conn = None
+        self.client = None
+        self.box = None
+        self.transports = []  # of datagram sockets, closed at the end
+
+        self.sleeps = 0
+        self._next = 0  # index of next press
+        self.owners = {}  # trace id -> indexes of presses it is sent for
+        self.dispensed = {}  # trace id -> times its jobs started
+        self.portions = 0
+        self.requests = []  # (round trip seconds, outcome) of every request of the button
+
+    def next_press(self):
+        return self.presses[self._next] if self._next < len(self.presses) else None
+
+    def run(self):
+        random.seed(self.seed)  # request ids, backoff jitter and trace ids of the button
+        with tempfile.TemporaryDirectory() as self.tmpdir:
+            self.loop.network = UnixNetwork(self.tmpdir)
+            try:
+                return self.loop.run_until_complete(self._run())
+            finally:
+                self.loop.close()
+
+    async def _run(self):
+        dispenser = load_project(os.path.join(ROOT, "dispenser"), DISPENSER_MODULES)
+        button = load_project(os.path.join(ROOT, "button"), BUTTON_MODULES)
+
+        target = await self._start_dispenser(dispenser)
+        if self.transport == "udp":
+            relay = UDPRelay(self.loop, self.link, self.loop.network.path(target, "udp"))
+        else:
+            relay = TCPRelay(self.loop, self.link, ("127.0.0.1", target))
+        relay_port = self.loop.network.port()
+        await relay.start(relay_port)
+        app = self._button(button, relay_port)
+
+        asyncio.create_task(self._run_button(app))
+        for i, at in enumerate(self.presses):
+            self.loop.call_at(at, self._press, i)
+        await asyncio.sleep((self.presses[-1] if self.presses else 0) + self.drain)
+
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.client.http.close()
+        if self.client.udp:
+            self.client.udp.close()
+        relay.close()
+        for transport in self.transports:
+            transport.close()
+        await asyncio.sleep(0)  # transports are closed in callbacks
+        return self.report()
+
+    async def _start_dispenser(self, dispenser):
+        """ TreatApp (and TreatDatagramServer) of the dispenser, return port they listen on """
+        config = types.SimpleNamespace(**{k: v for k, v in vars(dispenser.config).items() if k.isupper()})
+        config.SERVO_EXECUTOR = "timer"
+        stdlib = DispenserStdlib(self.loop)
+        # presses are told apart by trace ids, which the button sends with them
+        tracer = dispenser.tracing.Tracer(clock=stdlib, side="dispenser")
+        servo = dispenser.main.TracingServo(servo=self.servo, tracer=tracer, clock=stdlib)
+
+        timer_executor = dispenser.executor.TimerExecutor(servo=servo, timer=SimTimer(self.loop), clock=stdlib)
+        metrics = dispenser.metrics.Metrics(routes=dispenser.main.TreatApp.ROUTES, portions=config.PORTION_SIZES)
+        treat_logic = dispenser.main.TreatLogic(config=config, threads=_Threads(), servo=servo, stdlib=stdlib,
+                                                executor=timer_executor, metrics=metrics, tracer=tracer)
+        job_started = treat_logic._job_started
+
+        def record_job(plan, repeat, duration, traces):
+            self.portions += repeat
+            for trace, _ in traces:
+                self.dispensed.setdefault(trace, []).append(self.loop.time())
+            job_started(plan, repeat, duration, traces)
+
+        treat_logic._job_started = record_job
+        treat_logic.start()
+
+        port = self.loop.network.port()
+        datagrams = None
+        if self.transport == "udp":
+            datagrams = dispenser.main.TreatDatagramServer(treat_logic=treat_logic, config=config, metrics=metrics,
+                                                           stdlib=stdlib, tracer=tracer)
+            endpoint = DatagramEndpoint(self.loop, datagrams)
+            await endpoint.start(port)
+            self.transports.append(endpoint.transport)
+        app = dispenser.main.TreatApp(treat_logic=treat_logic, config=config, stdlib=stdlib,
+                                      templates=dispenser.template, metrics=metrics, datagrams=datagrams,
+                                      tracer=tracer)
+        app.app.keepalive_timeout = config.HTTP_KEEPALIVE_TIMEOUT
+        asyncio.create_task(app.app.start_server(host="127.0.0.1", port=port))
+        await asyncio.sleep(0)
+        return port
+
+    def _button(self, button, relay_port):
+        config = types.SimpleNamespace(**{k: v for k, v in vars(button.config).items() if k.isupper()})
+        config.TREAT_URL = "http://127.0.0.1:%s/treat" % relay_port
+        config.TREAT_UDP_PORT = relay_port if self.transport == "udp" else None
+        config.SLEEP_IDLE = self.sleep_idle
+        config.SLEEP_MODE = "light"
+        config.OUTBOX_FILE = os.path.join(self.tmpdir, "outbox.txt") if self.use_outbox else None
+        config.WIFI_CACHE_FILE = os.path.join(self.tmpdir, "wifi.json")
+        config.WIFI = {"client": {"ssid": "sim", "pass": "sim", "dhcp": "button"}}
+
+        stdlib = ButtonStdlib(self)
+        self.button_pin = SimPin(config.BUTTON_PIN)
+        blinker = button.blinker.PWMBlinker(config=config, stdlib=stdlib)
+        cache = button.aconn.WifiCache(config.WIFI_CACHE_FILE)
+        self.conn = button.aconn.ConnProvider(config=config, wlan=self.wlan, stdlib=stdlib, blinker=blinker,
+                                              cache=cache)
+        tracer = button.tracing.Tracer(clock=stdlib, side="button")
+        button.dispenser_client.socket = UnixDatagrams(self.loop.network)
+        client = button.dispenser_client.DispenserClient(config=config, blinker=blinker, stdlib=stdlib, tracer=tracer)
+        send = client.send
+
+        async def timed_send(*args, **kwargs):
+            started = self.loop.time()
+            outcome = "ok"
+            try:
+                await send(*args, **kwargs)
+            except button.dispenser_client.RetryLater:
+                outcome = "retry"
+                raise
+            except Exception:
+                outcome = "error"
+                raise
+            finally:
+                self.requests.append((self.loop.time() - started, outcome))
+
+        client.send = timed_send
+        self.client = client
+        box = None
+        if self.use_outbox:
+            box = self.box = button.outbox.Outbox(config=config, client=client, stdlib=stdlib, tracer=tracer)
+        treat = (box or client).treat
+
+        async def owned_treat(trace=None):
+            # first span of the trace is the press (or the wake up by press) App sends - the
+            # presses which came while it was sending the previous one are merged into it
+            started = tracer.traces[trace][0][1] / 1000000
+            press = bisect.bisect_right(self.presses, started + 0.000001) - 1
+            sent = await treat(trace=trace)
+            if box is None:
+                self.owners.setdefault(trace, []).append(press)
+            elif sent:  # press goes with the trace of the outbox entry it was added to
+                self.owners.setdefault(box.entries[-1][4], []).append(press)
+            return sent
+
+        (box or client).treat = owned_treat
+        return button.app.App(config=config, dispenser_client=box or client, stdlib=stdlib, conn=self.conn,
+                              tracer=tracer)
+
+    async def _run_button(self, app):
+        await self.conn.init_client(blink=False)
+        if self.box:
+            self.box.start()
+        try:
+            await app.run()
+        except SimulationStop:
+            logger.info("button sleeps with no press to come")
+
+    def _press(self, i):
+        """ press i comes, contacts bounce on press and on release """
+        self._next = i + 1
+        pin = self.button_pin
+        for j in range(self.bounce):
+            pin.set(0)
+            pin.set(1)
+        pin.set(0)
+        self.loop.call_later(self.hold, self._release)
+
+    def _release(self):
+        for j in range(self.bounce):
+            self.button_pin.set(1)
+            self.button_pin.set(0)
+        self.button_pin.set(1)
+
+    def report(self):
+        """ results as dict """
+        latencies = []
+        extra = 0
+        for trace, starts in self.dispensed.items():
+            presses = self.owners.get(trace, [])
+            latencies.extend(starts[0] - self.presses[i] for i in presses)
+            extra += (len(starts) - 1) * len(presses)
+        latencies.sort()
+        duration = (self.presses[-1] if self.presses else 0) + self.drain
+        trips = sorted(trip for trip, outcome in self.requests)
+        outcomes = {}
+        for _, outcome in self.requests:
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        return {
+            "simulated_hours": duration / 3600,
+            "presses": len(self.presses),
+            "dispensed": self.portions,
+            "lost": len(self.presses) - len(latencies),
+            "extra": extra,
+            "portions_per_hour": self.portions * 3600 / duration if duration else 0,
+            "servo_on_seconds": self.servo.on_time,
+            "latency": latencies,
+            "requests": outcomes,
+            "round_trip": trips,
+            "wifi_connects": sorted(self.wlan.connects),
+            "sleeps": self.sleeps,
+            "packets": (self.link.sent, self.link.lost),
+        }
+
+
+class _Threads:
+    """ _thread of the dispenser, locks only - the servo runs from timer callbacks """
+
+    def allocate_lock(self):
+        import _thread
+
+        return _thread.allocate_lock()
+
+
+def poisson_presses(rng, *, hours, rate, burst=0.0):
+    """ times of presses, `rate` per hour on average. With probability `burst` a press is
+    followed by 1 to 4 more, 0.3 to 1.5 s apart (impatient owner) """
+    presses = []
+    now = 0.0
+    end = hours * 3600
+    while True:
+        now += rng.expovariate(rate / 3600)
+        if now >= end:
+            return presses
+        presses.append(now)
+        if rng.random() < burst:
+            for _ in range(rng.randint(1, 4)):
+                now += rng.uniform(0.3, 1.5)
+                presses.append(now)
+
+
+def format_report(report):
+    lines = ["simulated %.1f h: %s presses, %s portions dispensed (%.1f per hour), %s lost, %s dispensed twice"
+             % (report["simulated_hours"], report["presses"], report["dispensed"], report["portions_per_hour"],
+                report["lost"], report["extra"]),
+             "servo turned %.0f s, button slept %s times, packets sent %s lost %s"
+             % ((report["servo_on_seconds"], report["sleeps"]) + report["packets"]),
+             "requests: %s" % " ".join("%s=%s" % item for item in sorted(report["requests"].items())),
+             "%-24s %6s" % ("(ms)", "count") + "".join("%10s" % ("p%s" % p) for p in PERCENTILES) + "%10s" % "max"]
+    for name, key in [("press to servo start", "latency"), ("request round trip", "round_trip"),
+                      ("wifi association", "wifi_connects")]:
+        values = report[key]
+        if values:
+            lines.append("%-24s %6s" % (name, len(values))
+                         + "".join("%10.1f" % (percentile(values, p) * 1000) for p in PERCENTILES)
+                         + "%10.1f" % (values[-1] * 1000))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="button and dispenser together, in virtual time")
+    parser.add_argument("--hours", type=float, default=1, help="simulated hours of presses")
+    parser.add_argument("--rate", type=float, default=20, help="presses per hour")
+    parser.add_argument("--burst", type=float, default=0.2, help="probability of more presses in a row")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--transport", choices=["http", "udp"], default="http")
+    parser.add_argument("--latency", type=float, default=2, help="one way latency of the link, ms")
+    parser.add_argument("--jitter", type=float, default=1, help="random latency added, up to ms")
+    parser.add_argument("--loss", type=float, default=0.0, help="probability of packet loss")
+    parser.add_argument("--wifi-cold", type=float, default=2.5, help="seconds of full wifi association")
+    parser.add_argument("--wifi-warm", type=float, default=0.5, help="seconds of fast (cached) association")
+    parser.add_argument("--sleep-idle", type=float, default=300, help="seconds of no press before sleep")
+    parser.add_argument("--bounce", type=int, default=3, help="bounces of contacts per edge")
+    parser.add_argument("--no-outbox", action="store_true", help="presses are sent once, not from outbox")
+    parser.add_argument("--log-level", default="WARNING", help="of both boards")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+    presses = poisson_presses(random.Random(args.seed), hours=args.hours, rate=args.rate, burst=args.burst)
+    sim = Simulation(presses, seed=args.seed, transport=args.transport, latency=args.latency / 1000,
+                     jitter=args.jitter / 1000, loss=args.loss, wifi_cold=args.wifi_cold, wifi_warm=args.wifi_warm,
+                     sleep_idle=args.sleep_idle, bounce=args.bounce, outbox=not args.no_outbox)
+    print(format_report(sim.run()))
+
+
+if __name__ == "__main__":
+    main()
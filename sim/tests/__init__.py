@@ -0,0 +1,6 @@
+import os
+import sys
+
+# simulator.py is a script in sim/, not a package - tests import it from there, whichever
+# directory they run from
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
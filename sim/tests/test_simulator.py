@@ -0,0 +1,51 @@
+import random
+import unittest
+
+import simulator
+from simulator import Simulation, poisson_presses
+
+
+def presses(hours=0.5, rate=40):
+    return poisson_presses(random.Random(5), hours=hours, rate=rate, burst=0.3)
+
+
+class TestSimulation(unittest.TestCase):
+
+    def test_same_seed_same_run(self):
+        # WHEN: the same presses run twice with the same seed, over a lossy link
+        reports = [Simulation(presses(), seed=5, loss=0.2).run() for _ in range(2)]
+
+        # THEN: everything comes out the same
+        self.assertEqual(reports[0], reports[1])
+        self.assertGreater(reports[0]["packets"][1], 0)
+
+    def test_outbox_loses_nothing(self):
+        for transport in ["http", "udp"]:
+            report = Simulation(presses(), seed=5, transport=transport, loss=0.2).run()
+
+            # THEN: every press is dispensed, once, in virtual time
+            self.assertEqual(report["lost"], 0, transport)
+            self.assertEqual(report["extra"], 0, transport)
+            self.assertEqual(report["dispensed"], report["presses"], transport)
+            self.assertEqual(len(report["latency"]), report["presses"], transport)
+            self.assertGreater(report["simulated_hours"], 0.5)
+
+    def test_sleeps_between_presses(self):
+        # WHEN: presses come seldom, the button sleeps between them
+        report = Simulation([10, 1000, 2000], seed=5, sleep_idle=300).run()
+
+        # THEN: press which woke it up is dispensed after warm wifi connect
+        self.assertEqual(report["sleeps"], 2)
+        self.assertEqual(report["dispensed"], 3)
+        self.assertEqual(len(report["wifi_connects"]), 3)
+        self.assertGreater(report["latency"][-1], 0.4)
+
+    def test_format_report(self):
+        report = Simulation([10], seed=5).run()
+        lines = simulator.format_report(report).splitlines()
+        self.assertIn("1 presses, 1 portions dispensed", lines[0])
+        self.assertTrue(lines[4].startswith("press to servo start"))
+
+
+if __name__ == '__main__':
+    unittest.main()